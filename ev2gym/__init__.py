@@ -3,5 +3,6 @@ from gymnasium.envs.registration import register
 register(
     id='EV2Gym-v1',
     entry_point='ev2gym.models.ev2gym_env:EV2Gym',
+    vector_entry_point='ev2gym.models.vector_env:EV2GymVectorEnv',
     kwargs={'config_file': 'ev2gym/example_config_files/V2GProfitMax.yaml'}
 )
\ No newline at end of file
@@ -0,0 +1,76 @@
+'''
+Runs the EV2Gym benchmark suites and compares the results with a saved baseline.
+
+Examples:
+    python -m ev2gym.benchmarks --suite quick --output baseline.json
+    python -m ev2gym.benchmarks --suite quick --output results.json --baseline baseline.json
+    python -m ev2gym.benchmarks --results results.json --baseline baseline.json
+    python -m ev2gym.benchmarks --suite full --groups chargers engines
+
+The exit code is 1 when a metric is worse than the baseline by more than the tolerance.
+'''
+
+import argparse
+import sys
+
+from ev2gym.benchmarks.cases import SUITES, get_suite
+from ev2gym.benchmarks.runner import run_suite, save_results, load_results, compare, \
+    print_results, print_comparison
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser(description="EV2Gym benchmarks")
+    parser.add_argument("--suite", default="quick", choices=list(SUITES),
+                        help="benchmark suite (default: quick)")
+    parser.add_argument("--groups", nargs="+", default=None,
+                        help="run only the cases of these sweeps, e.g. chargers engines")
+    parser.add_argument("--steps", default=500, type=int,
+                        help="steps measured per case (default: 500)")
+    parser.add_argument("--resets", default=5, type=int,
+                        help="resets measured per case (default: 5)")
+    parser.add_argument("--seed", default=0, type=int,
+                        help="random seed (default: 0)")
+    parser.add_argument("--no_isolate", action="store_true",
+                        help="run the cases in this process, the peak memory is then shared by all the cases")
+    parser.add_argument("--output", default=None,
+                        help="JSON file where the results are saved")
+    parser.add_argument("--results", default=None,
+                        help="compare the results of this JSON file instead of running the benchmarks")
+    parser.add_argument("--baseline", default=None,
+                        help="JSON file with the baseline results to compare with")
+    parser.add_argument("--tolerance", default=0.1, type=float,
+                        help="relative change of a metric reported as a regression (default: 0.1)")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = arg_parser().parse_args(argv)
+
+    if args.results is not None:
+        results = load_results(args.results)
+    else:
+        settings = {'suite': args.suite, 'groups': args.groups, 'steps': args.steps,
+                    'resets': args.resets, 'seed': args.seed}
+        results = run_suite(get_suite(args.suite, args.groups),
+                            isolate=not args.no_isolate,
+                            steps=args.steps,
+                            resets=args.resets,
+                            seed=args.seed)
+        if args.output is not None:
+            save_results(args.output, results, settings)
+            print(f'Results saved at {args.output}')
+
+    print_results(results)
+
+    if args.baseline is not None:
+        rows = compare(results, load_results(args.baseline), args.tolerance)
+        print()
+        print_comparison(rows)
+        if any(row['regression'] for row in rows):
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
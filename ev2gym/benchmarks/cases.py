@@ -0,0 +1,209 @@
+'''
+This file contains the BenchmarkCase class, which describes an environment to benchmark as an example
+config file with overrides, and the benchmark suites, sweeps of cases over the size and the features
+of the simulation.
+'''
+
+import os
+import yaml
+from typing import List
+
+from ev2gym.rl_agent import reward, state
+
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'example_config_files')
+
+# State and reward functions shipped in ev2gym.rl_agent
+STATE_FUNCTIONS = ['PublicPST', 'V2G_profit_max', 'V2G_profit_max_loads',
+                   'BusinessPSTwithMoreKnowledge']
+REWARD_FUNCTIONS = ['SquaredTrackingErrorReward', 'SqTrError_TrPenalty_UserIncentives',
+                    'ProfitMax_TrPenalty_UserIncentives', 'SquaredTrackingErrorRewardWithPenalty',
+                    'SimpleReward', 'MinimizeTrackerSurplusWithChargeRewards', 'profit_maximization']
+
+ENGINES = ['object', 'vectorized', 'compiled']
+
+
+class BenchmarkCase():
+    '''
+    An environment to benchmark: an example config file, the values changed in it and the
+    arguments of EV2Gym. Nested config values are changed with dotted keys, e.g. "solar_power.include".
+    '''
+
+    def __init__(self,
+                 name,  # unique name of the case, used to compare results
+                 group,  # sweep the case belongs to
+                 template='PublicPST.yaml',  # config file of example_config_files or path
+                 overrides=None,  # config values changed in the template
+                 state_function='PublicPST',  # name of a function of ev2gym.rl_agent.state
+                 reward_function='SquaredTrackingErrorReward',  # name of a function of ev2gym.rl_agent.reward
+                 engine='vectorized',
+                 ):
+
+        self.name = name
+        self.group = group
+        self.template = template
+        self.overrides = dict(overrides or {})
+        self.state_function = state_function
+        self.reward_function = reward_function
+        self.engine = engine
+
+    def config(self) -> dict:
+        '''Returns the config of the case'''
+        path = self.template
+        if not os.path.exists(path):
+            path = os.path.join(CONFIG_DIR, self.template)
+
+        with open(path, 'r') as f:
+            config = yaml.load(f, Loader=yaml.FullLoader)
+
+        for key, value in self.overrides.items():
+            *parents, name = key.split('.')
+            section = config
+            for parent in parents:
+                section = section[parent]
+            section[name] = value
+
+        return config
+
+    def write_config(self, path) -> str:
+        '''Writes the config of the case to path'''
+        with open(path, 'w') as f:
+            yaml.dump(self.config(), f)
+        return path
+
+    def env_kwargs(self) -> dict:
+        '''Returns the arguments of EV2Gym, except the config file'''
+        return {'state_function': getattr(state, self.state_function),
+                'reward_function': getattr(reward, self.reward_function),
+                'engine': self.engine}
+
+    def to_dict(self) -> dict:
+        return {'name': self.name,
+                'group': self.group,
+                'template': self.template,
+                'overrides': dict(self.overrides),
+                'state_function': self.state_function,
+                'reward_function': self.reward_function,
+                'engine': self.engine}
+
+
+def charger_sweep(counts) -> List[BenchmarkCase]:
+    '''Number of charging stations, connected to one transformer'''
+    return [BenchmarkCase(f'chargers_{n}', 'chargers',
+                          overrides={'number_of_charging_stations': n})
+            for n in counts]
+
+
+def port_sweep(ports) -> List[BenchmarkCase]:
+    '''Number of ports per charging station'''
+    return [BenchmarkCase(f'ports_{n}', 'ports',
+                          overrides={'number_of_ports_per_cs': n})
+            for n in ports]
+
+
+def transformer_sweep(counts, chargers=100) -> List[BenchmarkCase]:
+    '''Number of transformers sharing the same charging stations'''
+    return [BenchmarkCase(f'transformers_{n}', 'transformers',
+                          overrides={'number_of_charging_stations': chargers,
+                                     'number_of_transformers': n})
+            for n in counts]
+
+
+def timescale_sweep(timescales, hours=28) -> List[BenchmarkCase]:
+    '''Length of a step [minutes], the simulations cover the same hours'''
+    return [BenchmarkCase(f'timescale_{ts}', 'timescales',
+                          overrides={'timescale': ts,
+                                     'simulation_length': hours * 60 // ts})
+            for ts in timescales]
+
+
+def v2g_sweep() -> List[BenchmarkCase]:
+    '''Charging stations with and without V2G'''
+    return [BenchmarkCase(f'v2g_{"on" if enabled else "off"}', 'v2g',
+                          overrides={'v2g_enabled': enabled},
+                          state_function='V2G_profit_max',
+                          reward_function='profit_maximization')
+            for enabled in [False, True]]
+
+
+def grid_sweep(combinations) -> List[BenchmarkCase]:
+    '''Inflexible loads, PV generation and demand response, combinations of (loads, pv, dr)'''
+    cases = []
+    for loads, pv, dr in combinations:
+        name = '_'.join(feature for feature, enabled in
+                        [('loads', loads), ('pv', pv), ('dr', dr)] if enabled) or 'none'
+        cases.append(BenchmarkCase(f'grid_{name}', 'grid',
+                                   template='V2GProfitPlusLoads.yaml',
+                                   overrides={'inflexible_loads.include': loads,
+                                              'solar_power.include': pv,
+                                              'demand_response.include': dr},
+                                   state_function='V2G_profit_max_loads',
+                                   reward_function='ProfitMax_TrPenalty_UserIncentives'))
+    return cases
+
+
+def state_function_sweep() -> List[BenchmarkCase]:
+    '''Every shipped state function, on the config with loads, PV and DR'''
+    return [BenchmarkCase(f'state_{name}', 'state_functions',
+                          template='V2GProfitPlusLoads.yaml',
+                          state_function=name,
+                          reward_function='ProfitMax_TrPenalty_UserIncentives')
+            for name in STATE_FUNCTIONS]
+
+
+def reward_function_sweep() -> List[BenchmarkCase]:
+    '''Every shipped reward function, on the config with loads, PV and DR'''
+    return [BenchmarkCase(f'reward_{name}', 'reward_functions',
+                          template='V2GProfitPlusLoads.yaml',
+                          state_function='V2G_profit_max_loads',
+                          reward_function=name)
+            for name in REWARD_FUNCTIONS]
+
+
+def engine_sweep(chargers=100) -> List[BenchmarkCase]:
+    '''Every step engine of EV2Gym'''
+    return [BenchmarkCase(f'engine_{engine}', 'engines',
+                          overrides={'number_of_charging_stations': chargers},
+                          engine=engine)
+            for engine in ENGINES]
+
+
+def quick_suite() -> List[BenchmarkCase]:
+    '''Small sweeps that run in a few minutes'''
+    return charger_sweep([10, 100]) + \
+        port_sweep([1, 2]) + \
+        transformer_sweep([1, 5], chargers=20) + \
+        timescale_sweep([15, 60]) + \
+        v2g_sweep() + \
+        grid_sweep([(False, False, False), (True, True, True)]) + \
+        state_function_sweep() + \
+        reward_function_sweep() + \
+        engine_sweep(chargers=20)
+
+
+def full_suite() -> List[BenchmarkCase]:
+    '''Sweeps up to 10,000 charging stations'''
+    return charger_sweep([10, 100, 1000, 10000]) + \
+        port_sweep([1, 2, 4, 8]) + \
+        transformer_sweep([1, 2, 5, 10, 20, 50]) + \
+        timescale_sweep([5, 15, 30, 60]) + \
+        v2g_sweep() + \
+        grid_sweep([(False, False, False), (True, False, False), (False, True, False),
+                    (False, False, True), (True, True, True)]) + \
+        state_function_sweep() + \
+        reward_function_sweep() + \
+        engine_sweep()
+
+
+SUITES = {'quick': quick_suite,
+          'full': full_suite}
+
+
+def get_suite(name, groups=None) -> List[BenchmarkCase]:
+    '''Returns the cases of the suite name, only those of the given groups if any'''
+    assert name in SUITES, f"Unknown benchmark suite {name}, choose one of {list(SUITES)}"
+
+    cases = SUITES[name]()
+    if groups:
+        cases = [case for case in cases if case.group in groups]
+    return cases
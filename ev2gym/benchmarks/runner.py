@@ -0,0 +1,226 @@
+'''
+This file contains the functions that run the benchmark cases, measuring the construction time, the
+reset time, the steps per second and the peak memory of the environments, and that compare the results
+with a saved baseline.
+'''
+
+import datetime
+import json
+import multiprocessing as mp
+import os
+import platform
+import sys
+import tempfile
+import time
+import traceback
+
+import numpy as np
+from typing import Dict, List
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from ev2gym.models.ev2gym_env import EV2Gym
+
+# metric -> True if higher values are better
+METRICS = {'steps_per_second': True,
+           'construction_time': False,
+           'reset_time': False,
+           'peak_rss_mb': False}
+
+
+def peak_rss_mb():
+    '''Returns the peak resident memory of the process [MB], None if it is not available'''
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+
+def run_case(case,
+             steps=500,  # steps measured, the episodes are reset when they end
+             resets=5,  # resets measured before stepping
+             seed=0,
+             ) -> Dict:
+    '''
+    Runs a benchmark case in the current process and returns its results:
+        - construction_time: time to create the environment [s]
+        - reset_time, reset_time_max: median and longest reset [s]
+        - steps_per_second: steps per second of EV2Gym.step, the resets are not included
+        - peak_rss_mb: peak resident memory of the process [MB]
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        config_file = case.write_config(os.path.join(directory, 'config.yaml'))
+
+        start = time.perf_counter()
+        env = EV2Gym(config_file=config_file, seed=seed, **case.env_kwargs())
+        construction_time = time.perf_counter() - start
+
+    reset_times = []
+    for i in range(resets):
+        start = time.perf_counter()
+        env.reset(seed=seed + i)
+        reset_times.append(time.perf_counter() - start)
+
+    # a block of random actions is reused, so that drawing them is not measured
+    rng = np.random.default_rng(seed)
+    actions = rng.uniform(env.action_space.low, env.action_space.high,
+                          size=(min(steps, 64), env.action_space.shape[0]))
+
+    step_time = 0
+    for i in range(steps):
+        action = actions[i % len(actions)].copy()
+
+        start = time.perf_counter()
+        _, _, done, truncated, _ = env.step(action)
+        step_time += time.perf_counter() - start
+
+        if done or truncated:
+            start = time.perf_counter()
+            env.reset(seed=seed + len(reset_times))
+            reset_times.append(time.perf_counter() - start)
+
+    env.close()
+
+    return {**case.to_dict(),
+            'number_of_ports': int(env.number_of_ports),
+            'construction_time': construction_time,
+            'reset_time': float(np.median(reset_times)) if reset_times else None,
+            'reset_time_max': max(reset_times) if reset_times else None,
+            'steps': steps,
+            'steps_per_second': steps / step_time if step_time > 0 else None,
+            'peak_rss_mb': peak_rss_mb()}
+
+
+def _run_isolated(connection, case, kwargs) -> None:
+    try:
+        connection.send(run_case(case, **kwargs))
+    except Exception:
+        connection.send({**case.to_dict(), 'error': traceback.format_exc()})
+    connection.close()
+
+
+def run_suite(cases,
+              isolate=True,  # run every case in a new process, so that its peak memory is its own
+              verbose=True,
+              **kwargs,  # arguments of run_case
+              ) -> List[Dict]:
+    '''
+    Runs the benchmark cases and returns their results, a case that fails has an "error" entry
+    '''
+    ctx = mp.get_context('spawn')
+
+    results = []
+    for i, case in enumerate(cases):
+        if verbose:
+            print(f'[{i+1}/{len(cases)}] {case.name}', end=' ', flush=True)
+
+        if isolate:
+            receiver, sender = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=_run_isolated, args=(sender, case, kwargs))
+            process.start()
+            sender.close()
+            try:
+                result = receiver.recv()
+            except EOFError:
+                result = {**case.to_dict(),
+                          'error': f'benchmark process exited with code {process.exitcode}'}
+            process.join()
+        else:
+            try:
+                result = run_case(case, **kwargs)
+            except Exception:
+                result = {**case.to_dict(), 'error': traceback.format_exc()}
+
+        if verbose:
+            if 'error' in result:
+                print('failed')
+            else:
+                print(f'{result["steps_per_second"]:.1f} steps/s')
+
+        results.append(result)
+
+    return results
+
+
+def metadata() -> Dict:
+    '''Returns the machine and software the benchmarks ran on'''
+    return {'timestamp': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count()}
+
+
+def save_results(path, results, settings=None) -> str:
+    '''Writes the results to a JSON file with the metadata of the run'''
+    with open(path, 'w') as f:
+        json.dump({'metadata': metadata(),
+                   'settings': settings or {},
+                   'results': results}, f, indent=2)
+    return path
+
+
+def load_results(path) -> List[Dict]:
+    '''Reads the results of a JSON file written by save_results'''
+    with open(path, 'r') as f:
+        return json.load(f)['results']
+
+
+def compare(results, baseline, tolerance=0.1) -> List[Dict]:
+    '''
+    Compares the metrics of the results with the baseline results of the same cases
+
+    Returns a row per case and metric with the baseline and current values, the relative change and
+    whether it is a regression (worse than the baseline by more than tolerance)
+    '''
+    baseline = {result['name']: result for result in baseline if 'error' not in result}
+
+    rows = []
+    for result in results:
+        reference = baseline.get(result['name'])
+        if reference is None or 'error' in result:
+            continue
+
+        for metric, higher_is_better in METRICS.items():
+            value, reference_value = result.get(metric), reference.get(metric)
+            if value is None or reference_value is None or reference_value == 0:
+                continue
+
+            change = (value - reference_value) / reference_value
+            regression = change < -tolerance if higher_is_better else change > tolerance
+            rows.append({'name': result['name'],
+                         'metric': metric,
+                         'baseline': reference_value,
+                         'current': value,
+                         'change': change,
+                         'regression': regression})
+
+    return rows
+
+
+def print_results(results) -> None:
+    print(f'{"case":<48}{"ports":>8}{"build [s]":>11}{"reset [s]":>11}{"steps/s":>11}{"RSS [MB]":>10}')
+    for result in results:
+        if 'error' in result:
+            print(f'{result["name"]:<48} failed: {result["error"].strip().splitlines()[-1]}')
+            continue
+
+        rss = result['peak_rss_mb']
+        print(f'{result["name"]:<48}{result["number_of_ports"]:>8}'
+              f'{result["construction_time"]:>11.3f}{result["reset_time"] or 0:>11.3f}'
+              f'{result["steps_per_second"] or 0:>11.1f}{rss if rss is not None else float("nan"):>10.1f}')
+
+
+def print_comparison(rows) -> None:
+    print(f'{"case":<48}{"metric":<20}{"baseline":>12}{"current":>12}{"change":>9}')
+    for row in rows:
+        print(f'{row["name"]:<48}{row["metric"]:<20}{row["baseline"]:>12.4g}'
+              f'{row["current"]:>12.4g}{row["change"]:>9.1%}'
+              f'{"  REGRESSION" if row["regression"] else ""}')
@@ -0,0 +1,298 @@
+'''
+This file contains the EV2GymAsyncVectorEnv class, a gymnasium VectorEnv that runs batches of
+EV2Gym environments in worker processes.
+
+Every worker owns an EV2GymVectorEnv with a contiguous block of the environments. The actions,
+observations, rewards, termination flags and the statistics of the finished episodes are exchanged
+through shared memory buffers, only short commands are sent through the pipes.
+'''
+
+import multiprocessing as mp
+import traceback
+import warnings
+
+import numpy as np
+from gymnasium.vector import VectorEnv
+from gymnasium.vector.utils import batch_space
+
+from ev2gym.models.ev2gym_env import EV2Gym
+from ev2gym.models.vector_env import EV2GymVectorEnv, env_options
+from ev2gym.utilities.utils import get_statistics
+
+
+class EV2GymAsyncVectorEnv(VectorEnv):
+    '''
+    Batch of num_envs EV2Gym environments created from the same config file and split over
+    num_workers processes.
+
+    Seeding: environment i is seeded with seed + i, and the seeds of its episodes after an
+    autoreset are drawn from its own random generator seeded with seed + i, like in
+    EV2GymVectorEnv, so both classes give the same episodes for the same seed. If no seed is given,
+    a base seed is drawn once in the main process, so the workers never share the random state
+    inherited from the parent.
+    '''
+
+    metadata = EV2GymVectorEnv.metadata
+
+    def __init__(self,
+                 config_file=None,
+                 num_envs=1,
+                 num_workers=None,  # defaults to one worker per cpu core
+                 seed=None,  # environment i is seeded with seed + i
+                 context=None,  # multiprocessing start method, e.g. "fork" or "spawn"
+                 **kwargs,  # extra arguments of EV2Gym
+                 ):
+
+        assert num_envs > 0, "num_envs must be positive"
+        if num_workers is None:
+            num_workers = mp.cpu_count()
+        num_workers = min(num_workers, num_envs)
+
+        if seed is None:
+            seed = int(np.random.default_rng().integers(0, 1000000))
+
+        self.num_envs = num_envs
+        self.num_workers = num_workers
+        self.seed = seed
+
+        # Get the spaces and the statistics of an episode from a local environment
+        env = EV2Gym(config_file=config_file, seed=seed, **kwargs)
+        self.single_action_space = env.action_space
+        self.single_observation_space = env.observation_space
+        self.render_mode = env.render_mode
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            self.statistics_keys = list(get_statistics(env))
+        env.close()
+
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+
+        n_ports = self.single_action_space.shape[0]
+        obs_dim = self.single_observation_space.shape[0]
+
+        ctx = mp.get_context(context)
+        shapes = {'actions': (num_envs, n_ports),
+                  'observations': (num_envs, obs_dim),
+                  'rewards': (num_envs,),
+                  'terminations': (num_envs,),
+                  'truncations': (num_envs,),
+                  'final_obs': (num_envs, obs_dim),
+                  'statistics': (num_envs, len(self.statistics_keys))}
+        self._shared = {name: ctx.RawArray('d', int(np.prod(shape)))
+                        for name, shape in shapes.items()}
+        self._buffers = _buffer_views(self._shared, shapes)
+
+        # Contiguous block of environments of every worker
+        sizes = [len(block) for block in np.array_split(np.arange(num_envs), num_workers)]
+        self.worker_start = np.cumsum([0] + sizes)
+
+        self.closed = False
+        self.pipes = []
+        self.processes = []
+        for w in range(num_workers):
+            parent_pipe, child_pipe = ctx.Pipe()
+            process = ctx.Process(target=_worker,
+                                  name=f'EV2GymWorker-{w}',
+                                  args=(config_file,
+                                        int(self.worker_start[w]),
+                                        sizes[w],
+                                        seed,
+                                        kwargs,
+                                        self._shared,
+                                        shapes,
+                                        self.statistics_keys,
+                                        child_pipe,
+                                        parent_pipe),
+                                  daemon=True)
+            process.start()
+            child_pipe.close()
+            self.pipes.append(parent_pipe)
+            self.processes.append(process)
+
+        self._receive()
+
+    def reset(self, seed=None, options=None):
+        '''
+        Resets all the environments, environment i is seeded with seed + i,
+        see env_options for the scenario_index option
+        '''
+
+        for w, pipe in enumerate(self.pipes):
+            worker_options = options
+            if (options or {}).get('scenario_index') is not None:
+                # the scenarios of the environments of the worker
+                worker_options = {**options, 'scenario_index': [
+                    env_options(options, i)['scenario_index']
+                    for i in range(self.worker_start[w], self.worker_start[w + 1])]}
+            pipe.send(('reset', (seed, worker_options)))
+
+        # the batched infos of the workers are merged into infos of the whole batch
+        infos = {}
+        for w, worker_infos in enumerate(self._receive()):
+            _merge_infos(infos, worker_infos, int(self.worker_start[w]), self.num_envs)
+
+        return self._buffers['observations'].copy(), infos
+
+    def step_async(self, actions):
+        '''Writes the actions to the shared buffer and starts the step of all the workers'''
+
+        actions = np.asarray(actions, dtype=float)
+        assert actions.shape == self.action_space.shape, \
+            f"Actions must be of shape {self.action_space.shape}"
+
+        self._buffers['actions'][:] = actions
+        for pipe in self.pipes:
+            pipe.send(('step', None))
+
+    def step_wait(self):
+        '''
+        Waits for the workers to finish the step
+
+        Returns:
+            - observations: (num_envs, obs_dim) array
+            - rewards, terminations, truncations: (num_envs,) arrays
+            - infos: final_obs and final_info of the environments that finished an episode
+        '''
+        self._receive()
+
+        buffers = self._buffers
+        terminations = buffers['terminations'].astype(bool)
+        truncations = buffers['truncations'].astype(bool)
+        done = terminations | truncations
+
+        infos = {}
+        if done.any():
+            final_obs = np.full(self.num_envs, fill_value=None, dtype=object)
+            for i in np.flatnonzero(done):
+                final_obs[i] = buffers['final_obs'][i].copy()
+
+            final_info = {}
+            for j, key in enumerate(self.statistics_keys):
+                final_info[key] = np.where(done, buffers['statistics'][:, j], 0)
+                final_info[f'_{key}'] = done.copy()
+
+            infos = {'final_obs': final_obs, '_final_obs': done.copy(),
+                     'final_info': final_info, '_final_info': done.copy()}
+
+        return buffers['observations'].copy(), buffers['rewards'].copy(), \
+            terminations, truncations, infos
+
+    def step(self, actions):
+        '''Steps all the environments with a (num_envs, number_of_ports) array of actions'''
+        self.step_async(actions)
+        return self.step_wait()
+
+    def _receive(self):
+        '''
+        Waits for all the workers and raises the first error that occurred in a worker,
+        returns the messages of the workers
+        '''
+        messages = []
+        errors = []
+        for w, pipe in enumerate(self.pipes):
+            status, message = pipe.recv()
+            if status == 'error':
+                errors.append(f'Worker {w}:\n{message}')
+            messages.append(message)
+
+        if errors:
+            self.close()
+            raise RuntimeError('\n'.join(errors))
+
+        return messages
+
+    def close_extras(self, **kwargs):
+        for pipe in self.pipes:
+            try:
+                pipe.send(('close', None))
+            except (BrokenPipeError, OSError):
+                pass
+
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+        for pipe in self.pipes:
+            pipe.close()
+
+
+def _buffer_views(shared, shapes):
+    '''Returns numpy views of the shared memory buffers'''
+    return {name: np.frombuffer(shared[name], dtype=float).reshape(shapes[name])
+            for name in shapes}
+
+
+def _merge_infos(infos, worker_infos, start, num_envs) -> None:
+    '''
+    Writes the batched infos of a worker, whose first environment is start, into the infos of
+    the num_envs environments of the batch
+    '''
+    for key, value in worker_infos.items():
+        if isinstance(value, dict):
+            _merge_infos(infos.setdefault(key, {}), value, start, num_envs)
+            continue
+
+        value = np.asarray(value)
+        if key not in infos:
+            infos[key] = np.zeros(num_envs, dtype=value.dtype)
+        elif infos[key].dtype != np.result_type(infos[key], value):
+            infos[key] = infos[key].astype(np.result_type(infos[key], value))
+        infos[key][start:start + len(value)] = value
+
+
+def _worker(config_file, start, num_envs, seed, kwargs, shared, shapes, statistics_keys,
+            pipe, parent_pipe):
+    '''
+    Runs the environments start, ..., start + num_envs - 1 and writes their outputs
+    to the shared memory buffers
+    '''
+    parent_pipe.close()
+
+    try:
+        env = EV2GymVectorEnv(config_file=config_file,
+                              num_envs=num_envs,
+                              seed=seed + start,
+                              **kwargs)
+
+        buffers = {name: array[start:start + num_envs]
+                   for name, array in _buffer_views(shared, shapes).items()}
+        pipe.send(('ok', None))
+    except Exception:
+        pipe.send(('error', traceback.format_exc()))
+        return
+
+    while True:
+        command, data = pipe.recv()
+        message = None
+        try:
+            if command == 'reset':
+                seed, options = data
+                buffers['observations'][:], message = env.reset(
+                    seed=None if seed is None else seed + start,
+                    options=options)
+
+            elif command == 'step':
+                buffers['observations'][:], buffers['rewards'][:], \
+                    buffers['terminations'][:], buffers['truncations'][:], infos = \
+                    env.step(buffers['actions'].copy())
+
+                if 'final_obs' in infos:
+                    for i in np.flatnonzero(infos['_final_obs']):
+                        buffers['final_obs'][i] = infos['final_obs'][i]
+                        final_info = infos['final_info']
+                        buffers['statistics'][i] = [final_info[key][i] if key in final_info
+                                                    else np.nan
+                                                    for key in statistics_keys]
+
+            elif command == 'close':
+                env.close()
+                break
+
+            pipe.send(('ok', message))
+
+        except Exception:
+            pipe.send(('error', traceback.format_exc()))
+
+    pipe.close()
@@ -0,0 +1,94 @@
+'''
+This file contains array versions of the two-stage battery model of EV._charge and of EV._discharge,
+which charge or discharge the EVs of many ports at once.
+
+The EV methods are the reference implementation, the kernels follow the same operations in the
+same order so that their results are bit-identical to calling the methods for every EV.
+'''
+
+import numpy as np
+from typing import Tuple
+
+
+def charge(pilot,  # pilot signal of every EV [A], positive
+           voltage,  # AC voltage of the charger [V]
+           phases,  # phases used to charge every EV
+           current_capacity,  # [kWh]
+           battery_capacity,  # [kWh]
+           max_ac_charge_power,  # [kW]
+           transition_soc,
+           charge_efficiency,
+           timescale,  # length of the charging period [minutes]
+           ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Charges the EVs with the two-stage linear battery model of EV._charge
+
+    Returns:
+        - current_capacity: the capacity of every EV after the period [kWh]
+        - current_energy: the energy given to every EV [kWh]
+        - actual_current: the average charging current of every EV [A]
+    '''
+    voltage = voltage * np.sqrt(phases)
+    period = timescale
+    soc = current_capacity / battery_capacity
+
+    # All calculations are done in terms of battery SoC
+    pilot_dsoc = charge_efficiency * pilot * voltage / 1000 / \
+        battery_capacity / (60 / period)
+    max_dsoc = charge_efficiency * max_ac_charge_power / \
+        battery_capacity / (60 / period)
+    pilot_dsoc = np.where(pilot_dsoc > max_dsoc, max_dsoc, pilot_dsoc)
+
+    # every branch is computed for all the EVs and the right one is selected
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        pilot_transition_soc = transition_soc + (
+            pilot_dsoc - max_dsoc
+        ) / max_dsoc * (transition_soc - 1)
+
+        curr_soc = np.where(
+            soc < pilot_transition_soc,
+            np.where(1 <= (pilot_transition_soc - soc) / pilot_dsoc,
+                     pilot_dsoc + soc,
+                     1 + np.exp((pilot_dsoc + soc - pilot_transition_soc)
+                                / (pilot_transition_soc - 1)
+                                ) * (pilot_transition_soc - 1)),
+            1 + np.exp(pilot_dsoc / (pilot_transition_soc - 1)) * (soc - 1))
+
+    curr_soc = np.where(transition_soc == 1, np.minimum(pilot_dsoc + soc, 1), curr_soc)
+
+    dsoc = curr_soc - soc
+    energy = dsoc * battery_capacity
+
+    return curr_soc * battery_capacity, energy, energy / (period / 60) * 1000 / voltage
+
+
+def discharge(amps,  # current of every EV [A], negative
+              voltage,  # AC voltage of the charger [V]
+              phases,  # phases used to discharge every EV
+              current_capacity,  # [kWh]
+              min_battery_capacity,  # [kWh]
+              max_discharge_power,  # [kW], negative
+              discharge_efficiency,
+              timescale,  # length of the discharging period [minutes]
+              ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Discharges the EVs as EV._discharge
+
+    Returns:
+        - current_capacity: the capacity of every EV after the period [kWh]
+        - current_energy: the energy given by every EV [kWh], negative
+        - actual_current: the average discharging current of every EV [A]
+    '''
+    voltage = voltage * np.sqrt(phases)
+
+    given_power = (amps * voltage / 1000)
+    given_power = np.where(np.abs(given_power/1000) > np.abs(max_discharge_power),
+                           max_discharge_power, given_power)
+
+    given_energy = given_power * discharge_efficiency * timescale / 60
+    empty = current_capacity + given_energy < min_battery_capacity
+    given_energy = np.where(empty, -(current_capacity - min_battery_capacity),
+                            given_energy)
+
+    return np.where(empty, min_battery_capacity, current_capacity + given_energy), \
+        given_energy, given_energy*60/timescale * 1000 / voltage
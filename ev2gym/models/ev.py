@@ -7,6 +7,14 @@ import warnings
 import math
 from typing import Tuple, Union
 
+# number of SoC bins of the active steps kept by every EV for the battery degradation model
+SOC_BINS = 50
+
+
+def soc_bin(soc):
+    '''Returns the bin of the SoC values soc in [0, 1]'''
+    return np.clip(np.floor(np.asarray(soc) * SOC_BINS), 0, SOC_BINS - 1).astype(int)
+
 
 class EV():
     '''
@@ -99,8 +107,12 @@ class EV():
 
         # Baterry degradation        
         self.abs_total_energy_exchanged = 0
-        self.historic_soc = []
-        self.active_steps = []
+        # running sums of the SoC before every step, and count and sum of the SoC of the active steps
+        # in every SoC bin
+        self.soc_steps = 0
+        self.soc_sum = 0
+        self.active_soc_count = np.zeros(SOC_BINS, dtype=int)
+        self.active_soc_sum = np.zeros(SOC_BINS)
         
         self.calendar_loss = 0
         self.cyclic_loss = 0
@@ -120,8 +132,10 @@ class EV():
         self.c_lost = 0
         
         self.abs_total_energy_exchanged = 0
-        self.historic_soc = []
-        self.active_steps = []
+        self.soc_steps = 0
+        self.soc_sum = 0
+        self.active_soc_count = np.zeros(SOC_BINS, dtype=int)
+        self.active_soc_sum = np.zeros(SOC_BINS)
         
         self.calendar_loss = 0
         self.cyclic_loss = 0
@@ -143,15 +157,14 @@ class EV():
             amps = 0
         elif amps < 0 and amps > self.min_discharge_power*1000/(voltage*math.sqrt(phases)):
             amps = 0
-            
-        self.historic_soc.append(self.get_soc())
 
-        
+        soc = self.get_soc()
+        self.soc_steps += 1
+        self.soc_sum += soc
+
         if amps == 0:
             self.current_energy = 0
             self.actual_current = 0
-            
-            self.active_steps.append(0)
             return 0, 0
 
         # If the action is different than the previous action, then increase the charging cycles
@@ -173,7 +186,10 @@ class EV():
         #round up to the nearest 0.01 the current capacity
         self.current_capacity = self.my_ceil(self.current_capacity, 2)
         
-        self.active_steps.append(1 if self.actual_current != 0 else 0)
+        if self.actual_current != 0:
+            b = soc_bin(soc)
+            self.active_soc_count[b] += 1
+            self.active_soc_sum[b] += soc
         return self.current_energy, self.actual_current
 
     def my_ceil(self, a, precision=2):
@@ -346,76 +362,109 @@ class EV():
 
     def get_battery_degradation(self) -> Tuple[float, float]:
         '''
-        A function that returns the capacity loss of the EV.
-
-        Qacc := Accumulated battery cell throughput (Ah)
-        Qsim := Battery cell throughput during simulation (Ah)        
-        Tacc := Battery age (days)
-        Tsim := Simulation time (days)
-        theta := Battery temperature (K)
+        A function that returns the capacity loss of the EV, see battery_degradation.
 
         Outputs: 
-            - Capacity loss: the capacity loss
+            - Capacity loss: the calendar and cyclic capacity loss
         '''
+        d_cal, d_cyc = battery_degradation([self])
 
-        # Degradation modelling parameters
-        e0 = 7.543e6
-        e1 = 23.75e6
-        e2 = 6976
+        self.calendar_loss = d_cal[0]
+        self.cyclic_loss = d_cyc[0]
 
-        z0 = 7.348e-3
-        z1 = 3.667
-        z2 = 7.6e-4
-        z3 = 4.081e-3
+        return d_cal[0], d_cyc[0]
 
-        b_cap_ah = 2.05  # ah
-        b_cap_kwh = 78  # kwh
 
-        d_dist = 15000  # km
-        b_age = 2*365  # days
-        G = 0.186  # kwh/km
+def battery_degradation(evs) -> Tuple[np.ndarray, np.ndarray]:
+    '''
+    A function that returns the capacity loss of a list of EVs.
+
+    The SoC of the EVs is only kept as running sums (EV.soc_steps, EV.soc_sum) and as the count and
+    sum of the SoC of the active steps in SOC_BINS fixed bins (EV.active_soc_count, EV.active_soc_sum),
+    so the memory of an EV does not grow with its time at the charging station. The final SoC of
+    every EV is added as an active step.
+
+    The deviations of the active steps from their mean SoC are exact for the bins that do not
+    contain the mean, the steps in the bin of the mean are taken at the mean SoC of that bin,
+    so delta_DoD is at most 2 / SOC_BINS lower than with the full SoC history.
+
+    Qacc := Accumulated battery cell throughput (Ah)
+    Qsim := Battery cell throughput during simulation (Ah)        
+    Tacc := Battery age (days)
+    Tsim := Simulation time (days)
+    theta := Battery temperature (K)
+
+    Outputs: 
+        - d_cal: the calendar capacity loss of every EV
+        - d_cyc: the cyclic capacity loss of every EV
+    '''
 
-        # Age of the battery in days
-        T_acc = b_age
+    # Degradation modelling parameters
+    e0 = 7.543e6
+    e1 = 23.75e6
+    e2 = 6976
 
-        # Simulation time in days
-        T_sim = (self.time_of_departure - self.time_of_arrival + 1)*self.timescale/ (60*24) # days
+    z0 = 7.348e-3
+    z1 = 3.667
+    z2 = 7.6e-4
+    z3 = 4.081e-3
 
-        theta = 298.15  # Kelvin
-        k = 0.8263  # Volts
+    b_cap_ah = 2.05  # ah
+    b_cap_kwh = 78  # kwh
 
-        v_min = 3.3324  # Volts
-        self.historic_soc.append(self.get_soc()) # Add the final soc to the historic soc
-        avg_soc = np.mean(self.historic_soc) 
-        v_avg = v_min + k * avg_soc
+    d_dist = 15000  # km
+    b_age = 2*365  # days
+    G = 0.186  # kwh/km
 
-        # alpha(v_avg)
-        alpha = (e0 * v_avg - e1) * math.exp(-e2 / theta)
-        d_cal = alpha * 0.75 * T_sim / (T_acc)**0.25
+    # Age of the battery in days
+    T_acc = b_age
 
-        # beta(v_avg, soc_avg)
-        # print(f'avg_soc: {avg_soc}')        
-        self.active_steps.append(1)
-        
-        # get historic soc that self.active_steps == 1
-        filtered_historic_soc = [soc for i, soc in enumerate(self.historic_soc) if self.active_steps[i] == 1]
-        # print(f'filtered soc {filtered_historic_soc}')
-        avg_filtered_soc = np.mean(filtered_historic_soc) 
-        
-        delta_DoD = 2 * abs(avg_filtered_soc.repeat(len( filtered_historic_soc)) - filtered_historic_soc).mean()
-        # print(f'delta_DoD: {delta_DoD}')
-        v_half_soc = v_min + k * 0.5
-        beta = z0 * (v_half_soc - z1)**2 + z2 + z3 * delta_DoD        
+    n_evs = len(evs)
+    time_of_arrival = np.array([ev.time_of_arrival for ev in evs], dtype=float)
+    time_of_departure = np.array([ev.time_of_departure for ev in evs], dtype=float)
+    timescale = np.array([ev.timescale for ev in evs], dtype=float)
+    soc = np.array([ev.get_soc() for ev in evs], dtype=float)
+    soc_steps = np.array([ev.soc_steps for ev in evs], dtype=float)
+    soc_sum = np.array([ev.soc_sum for ev in evs], dtype=float)
+    abs_total_energy_exchanged = np.array([ev.abs_total_energy_exchanged for ev in evs],
+                                          dtype=float)
 
-        Q_sim = (self.abs_total_energy_exchanged / b_cap_kwh) * b_cap_ah
+    # Simulation time in days
+    T_sim = (time_of_departure - time_of_arrival + 1)*timescale / (60*24)  # days
 
-        # accumulated throughput
-        Q_acc = 2 * (b_age * (d_dist / 365) * G * b_cap_ah) / b_cap_kwh
-        # print(f'Q_acc: {Q_acc}')
+    theta = 298.15  # Kelvin
+    k = 0.8263  # Volts
 
-        d_cyc = beta * 0.5 * Q_sim / (Q_acc)**0.5
+    v_min = 3.3324  # Volts
+    # Add the final soc to the historic soc
+    avg_soc = (soc_sum + soc) / (soc_steps + 1)
+    v_avg = v_min + k * avg_soc
 
-        self.calendar_loss = d_cal
-        self.cyclic_loss = d_cyc
-        
-        return d_cal, d_cyc
+    # alpha(v_avg)
+    alpha = (e0 * v_avg - e1) * math.exp(-e2 / theta)
+    d_cal = alpha * 0.75 * T_sim / (T_acc)**0.25
+
+    # beta(v_avg, soc_avg)
+    # SoC bins of the active steps of all the EVs, with the final soc of every EV
+    count = np.array([ev.active_soc_count for ev in evs], dtype=float).reshape(n_evs, SOC_BINS)
+    sums = np.array([ev.active_soc_sum for ev in evs], dtype=float).reshape(n_evs, SOC_BINS)
+    final_bin = soc_bin(soc)
+    count[np.arange(n_evs), final_bin] += 1
+    sums[np.arange(n_evs), final_bin] += soc
+
+    active_steps = count.sum(axis=1)
+    avg_filtered_soc = sums.sum(axis=1) / active_steps
+
+    # mean absolute deviation of the SoC of the active steps
+    delta_DoD = 2 * np.abs(sums - avg_filtered_soc[:, None] * count).sum(axis=1) / active_steps
+    v_half_soc = v_min + k * 0.5
+    beta = z0 * (v_half_soc - z1)**2 + z2 + z3 * delta_DoD
+
+    Q_sim = (abs_total_energy_exchanged / b_cap_kwh) * b_cap_ah
+
+    # accumulated throughput
+    Q_acc = 2 * (b_age * (d_dist / 365) * G * b_cap_ah) / b_cap_kwh
+
+    d_cyc = beta * 0.5 * Q_sim / (Q_acc)**0.5
+
+    return d_cal, d_cyc
@@ -11,19 +11,30 @@ import datetime
 import pickle
 import os
 import random
-from copy import deepcopy
+from copy import copy
 import yaml
 import json
 
 # from .grid import Grid
 from ev2gym.models.replay import EvCityReplay
+from ev2gym.models.ev import EV
+from ev2gym.models.ev_registry import EVRegistry
+from ev2gym.models.port_state import PortStateEngine, CS_FIELDS
+from ev2gym.models.power_potential import ChargePowerPotential
+from ev2gym.models.running_statistics import RunningStatistics
+from ev2gym.models.profiler import StepProfiler, NULL_PHASE
+from ev2gym.models.transformer_bank import TransformerBank
+from ev2gym.models.telemetry import PortTelemetry, TelemetrySink
+from ev2gym.models.scenario_bank import ScenarioBank
 from ev2gym.visuals.plots import ev_city_plot, visualize_step
-from ev2gym.utilities.utils import get_statistics, print_statistics, calculate_charge_power_potential
-from ev2gym.utilities.loaders import load_ev_spawn_scenarios, load_power_setpoints, load_transformers, load_ev_charger_profiles, load_ev_profiles, load_electricity_prices
+from ev2gym.utilities.utils import get_statistics, print_statistics
+from ev2gym.utilities.loaders import load_ev_spawn_scenarios, load_power_setpoints, load_transformers, load_ev_charger_profiles, load_ev_profiles, load_electricity_prices, \
+    load_arrival_index
 from ev2gym.visuals.render import Renderer
 
 from ev2gym.rl_agent.reward import SquaredTrackingErrorReward
 from ev2gym.rl_agent.state import PublicPST
+from ev2gym.rl_agent.state_spec import StateSpec, observation_builder
 
 
 class EV2Gym(gym.Env):
@@ -40,11 +51,25 @@ class EV2Gym(gym.Env):
                  reward_function=SquaredTrackingErrorReward,
                  eval_mode="Normal",  # eval mode can be "Normal", "Unstirred" or "Optimal" in order to save the correct statistics in the replay file
                  lightweight_plots=False,
+                 # detail level of the per-port traces: "full", "energy", "arrivals" or "none" (default "none" for lightweight_plots)
+                 port_telemetry=None,
+                 # TelemetrySink or directory path, streams the statistics to disk and keeps only a window of them in memory
+                 telemetry_sink=None,
                  # whether to empty the ports at the end of the simulation or not
                  empty_ports_at_end_of_simulation=True,
                  extra_sim_name=None,
                  verbose=False,
                  render_mode=None,
+                 # "object" steps every EV_Charger and EV object, "vectorized" steps all ports at once using the PortStateEngine arrays,
+                 # "compiled" is the vectorized engine with the numba kernel of port_kernel (the numpy version is used if numba is not installed)
+                 engine="object",
+                 # "sequential" spawns the EVs one by one, "vectorized" samples them in bulk and "sparse" samples
+                 # the arrivals of every port as a renewal process (both use a different random stream)
+                 ev_spawner="sequential",
+                 # ScenarioBank or path of a bank made with generate_scenario_bank (shuffled), the episodes are read from it
+                 scenario_bank=None,
+                 # True or a StepProfiler, measures the time of the phases of every step, see profile_report()
+                 profile=False,
                  ):
 
         super(EV2Gym, self).__init__()
@@ -132,8 +157,27 @@ class EV2Gym(gym.Env):
         # Whether to simulate the grid or not (Future feature...)
         self.simulate_grid = False
 
+        if profile is True:
+            profile = StepProfiler()
+        self.profiler = profile if profile else None
+
         if self.cs > 100:
             self.lightweight_plots = True
+
+        if port_telemetry is None:
+            port_telemetry = "none" if self.lightweight_plots else "full"
+        self.port_telemetry_detail = port_telemetry
+
+        # Length of the statistics arrays, a ring buffer of the last steps when streaming them to disk
+        if isinstance(telemetry_sink, str):
+            telemetry_sink = TelemetrySink(telemetry_sink)
+        self.telemetry_sink = telemetry_sink
+        if self.telemetry_sink is not None:
+            assert not (self.save_plots or self.save_replay), \
+                "Plots and replays need the statistics of the whole simulation, they cannot be saved when streaming them"
+            self.trace_length = min(self.simulation_length, self.telemetry_sink.window)
+        else:
+            self.trace_length = self.simulation_length
         self.sim_starting_date = self.sim_date
 
         # Read the config.charging_network_topology json file and read the topology
@@ -152,7 +196,7 @@ class EV2Gym(gym.Env):
 
         # Simulate grid
         if self.simulate_grid:
-            pass
+            raise NotImplementedError("Simulating the grid is not supported yet")
             # self.grid = Grid(charging_stations=self.cs, case=case)
             # self.cs_buses = self.grid.get_charging_stations_buses()
             # self.cs_transformers = self.grid.get_bus_transformers()
@@ -175,24 +219,63 @@ class EV2Gym(gym.Env):
         for cs in self.charging_stations:
             cs.reset()
 
+        # Array state of the transformers, the transformers become views of it
+        self.transformer_bank = TransformerBank(self.transformers,
+                                                self.charging_stations,
+                                                self.simulation_length)
+
         # Calculate the total number of ports in the simulation
         self.number_of_ports = np.array(
             [cs.n_ports for cs in self.charging_stations]).sum()
 
+        # Struct-of-arrays port state, the charging stations and EVs become views of it
+        assert engine in ["object", "vectorized", "compiled"], f'Unknown engine {engine}'
+        self.engine = engine
+        if self.engine in ["vectorized", "compiled"]:
+            self.port_state = PortStateEngine(self.charging_stations,
+                                              self.simulation_length,
+                                              compiled=self.engine == "compiled")
+            self.power_potential = None
+            if verbose and self.engine == "compiled" and not self.port_state.compiled:
+                print('numba is not installed, using the vectorized engine')
+        else:
+            self.port_state = None
+            # Charge power potential updated on arrivals, departures and full-SoC transitions
+            self.power_potential = ChargePowerPotential(self.charging_stations)
+
         # Load EV spawn scenarios
+        assert ev_spawner in ["sequential", "vectorized", "sparse"], f'Unknown EV spawner {ev_spawner}'
+        self.ev_spawner = ev_spawner
         if self.load_from_replay_path is None:
             load_ev_spawn_scenarios(self)
 
-        # Spawn EVs
-        self.EVs_profiles = load_ev_profiles(self)
-        self.EVs = []
+        # Pre-generated scenarios
+        if isinstance(scenario_bank, str):
+            scenario_bank = ScenarioBank(scenario_bank, shuffle=True)
+        elif scenario_bank is not None:
+            # every environment iterates over the bank in its own order
+            scenario_bank = scenario_bank.copy()
+        self.scenario_bank = scenario_bank
+        self.scenario_index = None
+
+        if self.scenario_bank is not None:
+            assert self.load_from_replay_path is None, \
+                "A scenario bank cannot be used when loading a replay"
+            self.scenario_bank.check(self)
+            self.scenario_bank.start_pass(self.seed)
+            self.scenario_bank.load(self)
+        else:
+            # Spawn EVs
+            self.EVs_profiles = load_ev_profiles(self)
+            self.arrival_order, self.arrival_offsets = load_arrival_index(self)
 
-        # Load Electricity prices for every charging station
-        self.charge_prices, self.discharge_prices = load_electricity_prices(
-            self)
+            # Load Electricity prices for every charging station
+            self.charge_prices, self.discharge_prices = load_electricity_prices(
+                self)
 
-        # Load power setpoint of simulation
-        self.power_setpoints = load_power_setpoints(self)
+            # Load power setpoint of simulation
+            self.power_setpoints = load_power_setpoints(self)
+        self.EVs = []
         self.current_power_usage = np.zeros(self.simulation_length)
         self.charge_power_potential = np.zeros(self.simulation_length)
 
@@ -232,8 +315,178 @@ class EV2Gym(gym.Env):
         # Observation mask: is a vector of size ("Sum of all ports of all charging stations") showing in which ports an EV is connected
         self.observation_mask = np.zeros(self.number_of_ports)
 
+    def __getstate__(self):
+        '''Copies and pickles of the environment do not stream to the telemetry sink'''
+        state = self.__dict__.copy()
+        state['telemetry_sink'] = None
+        # the observation builder is bound to the objects of this environment
+        state['_observation_builder'] = None
+        # copies iterate over the scenario bank on their own
+        if state.get('scenario_bank') is not None:
+            state['scenario_bank'] = self.scenario_bank.copy()
+        # copies are profiled separately
+        if state.get('profiler') is not None:
+            state['profiler'] = StepProfiler(self.profiler.max_trace_events)
+        return state
+
+    def __setstate__(self, state):
+        '''Restores a pickled or copied environment and binds its objects to the port state'''
+        self.__dict__.update(state)
+        if self.__dict__.get('port_state') is not None:
+            self.port_state.bind()
+        if self.__dict__.get('transformer_bank') is not None:
+            self.transformer_bank.bind()
+        if self.__dict__.get('connected_ev_index') is not None:
+            # the connected EVs are new objects
+            ev_index = {id(ev): i for i, ev in enumerate(self.EVs)}
+            self.connected_ev_index = {id(ev): ev_index[id(ev)]
+                                       for cs in self.charging_stations
+                                       for ev in cs.evs_connected if ev is not None}
+
+    def get_state(self) -> dict:
+        '''
+        Returns a snapshot of the simulation state that can be restored with set_state.
+
+        The episode data that does not change while stepping (EV profiles, prices, setpoints)
+        and the EVs that have already departed are shared with the environment,
+        the ports, connected EVs, transformers, counters, RNG states and statistics are copied.
+        '''
+        connected = []
+        for j, cs in enumerate(self.charging_stations):
+            for port, ev in enumerate(cs.evs_connected):
+                if ev is None:
+                    continue
+                if self.port_state is not None:
+                    ev_state = self.port_state.plain_state(ev)
+                else:
+                    ev_state = dict(ev.__dict__)
+                    ev_state['active_soc_count'] = ev.active_soc_count.copy()
+                    ev_state['active_soc_sum'] = ev.active_soc_sum.copy()
+                connected.append((j, port, self.connected_ev_index[id(ev)], ev_state))
+
+        statistics = {name: getattr(self, name).copy()
+                      for name in ['current_power_usage', 'charge_power_potential', 'cs_power',
+                                   'cs_current', 'tr_overload', 'tr_inflexible_loads',
+                                   'tr_solar_power']}
+
+        return {
+            'episode': {name: getattr(self, name)
+                        for name in ['EVs_profiles', 'arrival_order', 'arrival_offsets',
+                                     'power_setpoints', 'charge_prices', 'discharge_prices',
+                                     'sim_starting_date', 'previous_power_usage', 'seed',
+                                     'scenario_index']},
+            'counters': {name: getattr(self, name)
+                         for name in ['current_step', 'sim_date', 'done', 'total_evs_spawned',
+                                      'total_reward', 'total_transformer_overload',
+                                      'current_ev_departed',
+                                      'current_ev_arrived', 'current_evs_parked']},
+            'statistics': statistics,
+            'port_telemetry': self.port_telemetry.copy(),
+            'running_statistics': self.running_statistics.copy(),
+            'charging_stations': [({name: getattr(cs, name) for name in CS_FIELDS},
+                                   list(cs.current_signal))
+                                  for cs in self.charging_stations],
+            'transformer_bank': self.transformer_bank.get_state(),
+            # the forecasts and events only change when a scenario bank is used
+            'transformers': [(tr.inflexible_load_forecast, tr.pv_generation_forecast, tr.dr_events)
+                             for tr in self.transformers],
+            'EVs': list(self.EVs),
+            'ev_registry': self.ev_registry.get_state(),
+            'connected': connected,
+            'rng': (np.random.get_state(), random.getstate(),
+                    self.tr_rng.bit_generator.state),
+        }
+
+    def set_state(self, state) -> None:
+        '''
+        Restores a snapshot taken with get_state, the same snapshot can be restored many times
+        '''
+        self.__dict__.update(state['episode'])
+        self.__dict__.update(state['counters'])
+
+        for name, array in state['statistics'].items():
+            setattr(self, name, array.copy())
+        self.port_telemetry = state['port_telemetry'].copy()
+        self.running_statistics = state['running_statistics'].copy()
+
+        # Release the ports before restoring the charging stations
+        if self.port_state is not None:
+            self.port_state.reset()
+
+        for cs, (fields, signal) in zip(self.charging_stations, state['charging_stations']):
+            for name, value in fields.items():
+                setattr(cs, name, value)
+            cs.current_signal = list(signal)
+            cs.evs_connected = [None] * cs.n_ports
+
+        self.transformer_bank.set_state(state['transformer_bank'])
+        for tr, (load_forecast, pv_forecast, dr_events) in zip(self.transformers, state['transformers']):
+            tr.inflexible_load_forecast = load_forecast
+            tr.pv_generation_forecast = pv_forecast
+            tr.dr_events = dr_events
+
+        # Connected EVs are recreated, the departed ones are shared with the snapshot
+        self.EVs = list(state['EVs'])
+        self.ev_registry = EVRegistry()
+        self.ev_registry.set_state(state['ev_registry'])
+        self.connected_ev_index = {}
+        for j, port, i, ev_state in state['connected']:
+            ev = EV.__new__(EV)
+            ev.__dict__.update(ev_state)
+            ev.active_soc_count = ev_state['active_soc_count'].copy()
+            ev.active_soc_sum = ev_state['active_soc_sum'].copy()
+
+            self.charging_stations[j].evs_connected[port] = ev
+            if self.port_state is not None:
+                self.port_state.attach(ev, j, port)
+            self.EVs[i] = ev
+            self.connected_ev_index[id(ev)] = i
+
+        if self.port_state is None:
+            self.power_potential.rebuild(self.current_step + 1)
+
+        np_state, random_state, tr_rng_state = state['rng']
+        np.random.set_state(np_state)
+        random.setstate(random_state)
+        self.tr_rng = np.random.default_rng()
+        self.tr_rng.bit_generator.state = tr_rng_state
+
+    def fork(self):
+        '''
+        Returns a copy of the environment in the same state.
+        The configuration and the episode data are shared, forks do not render or save replays and plots.
+        '''
+        env = copy(self)
+        env.render_mode = None
+        env.renderer = None
+        env.save_replay = False
+        env.save_plots = False
+
+        env.charging_stations = [copy(cs) for cs in self.charging_stations]
+        env.transformers = [copy(tr) for tr in self.transformers]
+        env.transformer_bank = TransformerBank(env.transformers,
+                                               env.charging_stations,
+                                               env.simulation_length)
+        if self.port_state is not None:
+            env.port_state = PortStateEngine(env.charging_stations,
+                                             env.simulation_length,
+                                             compiled=self.port_state.compiled)
+        else:
+            env.power_potential = ChargePowerPotential(env.charging_stations)
+
+        env.set_state(self.get_state())
+        return env
+
     def reset(self, seed=None, options=None, **kwargs):
         '''Resets the environment to its initial state'''
+        if self.profiler is not None:
+            self.profiler.begin_step(0)
+
+        with self._phase('reset'):
+            return self._reset(seed, options)
+
+    def _reset(self, seed, options):
+        '''Resets the environment, see reset()'''
 
         if seed is None:
             self.seed = np.random.randint(0, 1000000)
@@ -252,9 +505,24 @@ class EV2Gym(gym.Env):
         # Reset all charging stations
         for cs in self.charging_stations:
             cs.reset()
-            
-        for tr in self.transformers:
-            tr.reset(step=self.current_step)
+
+        if self.port_state is not None:
+            self.port_state.reset()
+        else:
+            self.power_potential.reset()
+
+        self.transformer_bank.reset(step=self.current_step)
+
+        if self.scenario_bank is not None:
+            # Read the episode from the scenario bank, options={"scenario_index": i} selects a scenario
+            # and a seed starts a new pass over the bank
+            if seed is not None:
+                self.scenario_bank.start_pass(seed)
+            self.scenario_bank.load(self, index=(options or {}).get('scenario_index'))
+            self.EVs = []
+            self.init_statistic_variables()
+            with self._phase('state_function'):
+                return self._get_observation(), {}
 
         if self.load_from_replay_path is not None or not self.config['random_day']:
             self.sim_date = self.sim_starting_date
@@ -284,6 +552,7 @@ class EV2Gym(gym.Env):
 
         self.sim_starting_date = self.sim_date
         self.EVs_profiles = load_ev_profiles(self)
+        self.arrival_order, self.arrival_offsets = load_arrival_index(self)
         self.power_setpoints = load_power_setpoints(self)
         self.EVs = []
 
@@ -294,7 +563,8 @@ class EV2Gym(gym.Env):
 
         self.init_statistic_variables()
 
-        return self._get_observation(), {}
+        with self._phase('state_function'):
+            return self._get_observation(), {}
 
     def init_statistic_variables(self):
         '''
@@ -314,45 +584,36 @@ class EV2Gym(gym.Env):
         # self.transformer_amps = np.zeros([self.number_of_transformers,
         #                                   self.simulation_length])
 
-        self.cs_power = np.zeros([self.cs, self.simulation_length])
-        self.cs_current = np.zeros([self.cs, self.simulation_length])
+        self.cs_power = np.zeros([self.cs, self.trace_length])
+        self.cs_current = np.zeros([self.cs, self.trace_length])
 
         self.tr_overload = np.zeros(
-            [self.number_of_transformers, self.simulation_length])
+            [self.number_of_transformers, self.trace_length])
+        self.total_transformer_overload = 0
 
         self.tr_inflexible_loads = np.zeros(
-            [self.number_of_transformers, self.simulation_length])
+            [self.number_of_transformers, self.trace_length])
 
         self.tr_solar_power = np.zeros(
-            [self.number_of_transformers, self.simulation_length])
-
-        # self.port_power = np.zeros([self.number_of_ports,
-        #                             self.cs,
-        #                             self.simulation_length],
-        #                            dtype=np.float16)
-        if not self.lightweight_plots:
-            self.port_current = np.zeros([self.number_of_ports,
-                                          self.cs,
-                                          self.simulation_length],
-                                         dtype=np.float16,
-                                         )
-            self.port_current_signal = np.zeros([self.number_of_ports,
-                                                 self.cs,
-                                                 self.simulation_length],
-                                                dtype=np.float16,
-                                                )
-
-            self.port_energy_level = np.zeros([self.number_of_ports,
-                                               self.cs,
-                                               self.simulation_length],
-                                              dtype=np.float16)
-            # self.port_charging_cycles = np.zeros([self.number_of_ports,
-            #                                       self.cs,
-            #                                       self.simulation_length],
-            #                                      dtype=np.float16)
-            self.port_arrival = dict({f'{j}.{i}': []
-                                      for i in range(self.number_of_ports)
-                                      for j in range(self.cs)})
+            [self.number_of_transformers, self.trace_length])
+
+        # Departed EVs are stored in the EV registry, the index of the connected EVs in self.EVs
+        self.ev_registry = EVRegistry()
+        self.connected_ev_index = {}
+
+        # Power tracking statistics accumulated every step
+        self.running_statistics = RunningStatistics(self.simulation_length, self.timescale)
+
+        # Per-port traces, stored only for the ports that exist
+        self.port_telemetry = PortTelemetry([cs.n_ports for cs in self.charging_stations],
+                                            self.trace_length,
+                                            detail=self.port_telemetry_detail)
+
+        if self.telemetry_sink is not None:
+            columns = {name: getattr(self, name) for name in TelemetrySink.COLUMNS}
+            for name, trace in self.port_telemetry.traces.items():
+                columns[f'port_{name}'] = trace
+            self.telemetry_sink.start_episode(self.sim_name, columns, self.simulation_length)
 
         self.done = False
 
@@ -365,106 +626,200 @@ class EV2Gym(gym.Env):
             - observation: is a matrix with the complete observation space
             - reward: is a scalar value representing the reward of the current step
             - done: is a boolean value indicating whether the episode is done or not
+            - truncated: always False
+            - info: the statistics of the simulation when the episode is done, with the time of
+              every phase of the step in info['profile'] [ms] when profiling
         '''
-        assert not self.done, "Episode is done, please reset the environment"
+        if self.profiler is None:
+            return self._step(actions, visualize)
 
-        if self.verbose:
-            print("-"*80)
+        with self.profiler.phase('step'):
+            outputs = self._step(actions, visualize)
+
+        outputs[4]['profile'] = self.profiler.step_report()
+        return outputs
+
+    def _step(self, actions, visualize):
+        '''Steps the simulation, see step()'''
+        self._begin_step()
 
         total_costs = 0
         total_invalid_action_punishment = 0
         user_satisfaction_list = []
         departing_evs = []
 
+        port_counter = 0
+
+        if self.port_state is not None:
+            # Step all ports at once
+            with self._phase('charger_step'):
+                total_costs, user_satisfaction_list, total_invalid_action_punishment, departing_evs = \
+                    self.port_state.step(actions, *self._port_state_prices(),
+                                         self.current_step)
+            self._aggregate_port_state(user_satisfaction_list)
+        else:
+            cs_amps = np.zeros(self.cs)
+            cs_power = np.zeros(self.cs)
+
+            # Call step for each charging station and spawn EVs where necessary
+            with self._phase('charger_step'):
+                for i, cs in enumerate(self.charging_stations):
+                    n_ports = cs.n_ports
+                    costs, user_satisfaction, invalid_action_punishment, ev = cs.step(
+                        actions[port_counter:port_counter + n_ports],
+                        self.charge_prices[cs.id, self.current_step],
+                        self.discharge_prices[cs.id, self.current_step])
+
+                    departing_evs += ev
+                    self.power_potential.update(i, ev, self.current_step + 1)
+
+                    for u in user_satisfaction:
+                        user_satisfaction_list.append(u)
+
+                    self.current_power_usage[self.current_step] += cs.current_power_output
+
+                    cs_amps[i] = cs.current_total_amps
+                    cs_power[i] = cs.current_power_output
+
+                    total_costs += costs
+                    total_invalid_action_punishment += invalid_action_punishment
+                    self.current_ev_departed += len(user_satisfaction)
+
+                    port_counter += n_ports
+
+            # Update transformer variables for this timestep
+            with self._phase('transformer_step'):
+                self.transformer_bank.step(cs_amps, cs_power)
+
+        return self._finish_step(total_costs,
+                                 user_satisfaction_list,
+                                 total_invalid_action_punishment,
+                                 departing_evs,
+                                 visualize)
+
+    def _begin_step(self):
+        '''Prepares the counters and transformers for a new step'''
+        assert not self.done, "Episode is done, please reset the environment"
+
+        if self.verbose:
+            print("-"*80)
+
         self.current_ev_departed = 0
         self.current_ev_arrived = 0
 
-        port_counter = 0
-
         # Reset current power of all transformers
-        for tr in self.transformers:
-            tr.reset(step=self.current_step)
+        self.transformer_bank.reset(step=self.current_step)
 
-        # Call step for each charging station and spawn EVs where necessary
-        for i, cs in enumerate(self.charging_stations):
-            n_ports = cs.n_ports
-            costs, user_satisfaction, invalid_action_punishment, ev = cs.step(
-                actions[port_counter:port_counter + n_ports],
-                self.charge_prices[cs.id, self.current_step],
-                self.discharge_prices[cs.id, self.current_step])
+        if self.profiler is not None:
+            self.profiler.begin_step(self.current_step)
+
+    def _phase(self, name):
+        '''Returns a context manager measuring the phase name when profiling'''
+        if self.profiler is None:
+            return NULL_PHASE
+        return self.profiler.phase(name)
+
+    def profile_report(self) -> dict:
+        '''
+        Returns the cumulative time of every phase of the simulation, see StepProfiler.report()
+        '''
+        assert self.profiler is not None, "Profiling is disabled, create the environment with profile=True"
+        return self.profiler.report()
 
-            departing_evs += ev
+    def export_profile_trace(self, path) -> str:
+        '''
+        Writes the phases of the last steps as a Chrome trace JSON file, see StepProfiler.export_chrome_trace()
+        '''
+        assert self.profiler is not None, "Profiling is disabled, create the environment with profile=True"
+        return self.profiler.export_chrome_trace(path)
 
-            for u in user_satisfaction:
-                user_satisfaction_list.append(u)
+    def _port_state_prices(self):
+        '''Returns the charge and discharge prices of the current step in the order of the port state'''
+        return self.charge_prices[self.port_state.cs_ids, self.current_step], \
+            self.discharge_prices[self.port_state.cs_ids, self.current_step]
 
-            self.current_power_usage[self.current_step] += cs.current_power_output
+    def _aggregate_port_state(self, user_satisfaction_list):
+        '''Aggregates the charging stations of the port state per transformer'''
+        self.current_power_usage[self.current_step] += self.port_state.cs_power_output.sum()
 
-            # Update transformer variables for this timestep
-            self.transformers[cs.connected_transformer].step(
-                cs.current_total_amps, cs.current_power_output)
+        with self._phase('transformer_step'):
+            self.transformer_bank.step(self.port_state.cs_total_amps,
+                                       self.port_state.cs_power_output)
 
-            total_costs += costs
-            total_invalid_action_punishment += invalid_action_punishment
-            self.current_ev_departed += len(user_satisfaction)
+        self.current_ev_departed += len(user_satisfaction_list)
 
-            port_counter += n_ports
+    def _finish_step(self, total_costs, user_satisfaction_list, total_invalid_action_punishment,
+                     departing_evs, visualize=False, out=None, observe=True):
+        '''
+        Spawns the arriving EVs, updates the statistics and returns the outputs of the step,
+        the observation is written to out if given and is None if observe is False
+        '''
 
-        # Spawn EVs
-        counter = self.total_evs_spawned
-        for i, ev in enumerate(self.EVs_profiles[counter:]):
-            if ev.time_of_arrival == self.current_step + 1:
-                ev = deepcopy(ev)
+        # Spawn EVs, the profiles only hold immutable values so a shallow copy is enough
+        with self._phase('ev_spawn'):
+            for ev in self.get_arriving_evs(self.current_step + 1):
+                ev = copy(ev)
                 ev.reset()
                 ev.simulation_length = self.simulation_length
                 index = self.charging_stations[ev.location].spawn_ev(ev)
+                if self.power_potential is not None:
+                    self.power_potential.arrive(ev.location, index, ev, self.current_step + 1)
 
-                if not self.lightweight_plots:
-                    self.port_arrival[f'{ev.location}.{index}'].append(
-                        (self.current_step+1, ev.time_of_departure+1))
+                self.port_telemetry.add_arrival(ev.location, index,
+                                                self.current_step+1, ev.time_of_departure+1)
 
                 self.total_evs_spawned += 1
                 self.current_ev_arrived += 1
+                self.connected_ev_index[id(ev)] = len(self.EVs)
                 self.EVs.append(ev)
 
-            elif ev.time_of_arrival > self.current_step + 1:
-                break
+        with self._phase('statistics'):
+            self._update_power_statistics(departing_evs)
 
-        self._update_power_statistics(departing_evs)
+        # Departed EVs are replaced by views of their row in the EV registry
+        for ev in departing_evs:
+            self.EVs[self.connected_ev_index.pop(id(ev))] = self.ev_registry.append(ev)
 
         self.current_step += 1
         self._step_date()
 
         if self.current_step < self.simulation_length:
-            self.charge_power_potential[self.current_step] = calculate_charge_power_potential(
-                self)
+            with self._phase('charge_power_potential'):
+                if self.port_state is not None:
+                    self.charge_power_potential[self.current_step] = \
+                        self.port_state.charge_power_potential(self.current_step)
+                else:
+                    self.charge_power_potential[self.current_step] = \
+                        self.power_potential.total(self.current_step)
 
         self.current_evs_parked += self.current_ev_arrived - self.current_ev_departed
 
-        # Call step for the grid
-        if self.simulate_grid:
-            # TODO: transform actions -> grid_actions
-            raise NotImplementedError
-            grid_report = self.grid.step(actions=actions)
-            reward = self._calculate_reward(grid_report)
-        else:
+        with self._phase('reward_function'):
             reward = self._calculate_reward(total_costs,
                                             user_satisfaction_list,
                                             total_invalid_action_punishment)
 
-        if visualize:
-            visualize_step(self)
+        with self._phase('render'):
+            if visualize:
+                visualize_step(self)
+
+            self.render()
 
-        self.render()
+        return self._check_termination(user_satisfaction_list, reward, out, observe)
 
-        return self._check_termination(user_satisfaction_list, reward)
+    def get_arriving_evs(self, step):
+        '''Returns the EV profiles arriving at the given step using the arrival index'''
+        if step < 0 or step > self.simulation_length:
+            return []
+        start, end = self.arrival_offsets[step], self.arrival_offsets[step+1]
+        return [self.EVs_profiles[i] for i in self.arrival_order[start:end]]
 
-    def _check_termination(self, user_satisfaction_list, reward):
+    def _check_termination(self, user_satisfaction_list, reward, out=None, observe=True):
         '''Checks if the episode is done or any constraint is violated'''
         truncated = False
         # Check if the episode is done or any constraint is violated
         if self.current_step >= self.simulation_length or \
-            (any(tr.is_overloaded() > 0 for tr in self.transformers)
+            (self.transformer_bank.overloaded().any()
              and not self.generate_rnd_game):
             """Terminate if:
                 - The simulation length is reached
@@ -478,7 +833,7 @@ class EV2Gym(gym.Env):
             if self.verbose:
                 print_statistics(self)
 
-                if any(tr.is_overloaded() for tr in self.transformers):
+                if self.transformer_bank.overloaded().any():
                     print(
                         f"Transformer overloaded, {self.current_step} timesteps\n")
                 else:
@@ -486,25 +841,42 @@ class EV2Gym(gym.Env):
                         f"Episode finished after {self.current_step} timesteps\n")
 
             if self.save_replay:
-                self._save_sim_replay()
+                with self._phase('replay_saving'):
+                    self._save_sim_replay()
 
             if self.save_plots:
-                #save the env as a pickle file
-                with open(f"./results/{self.sim_name}/env.pkl", 'wb') as f:
-                    self.renderer = None
-                    pickle.dump(self, f)
-                ev_city_plot(self)
+                with self._phase('save_plots'):
+                    #save the env as a pickle file
+                    with open(f"./results/{self.sim_name}/env.pkl", 'wb') as f:
+                        self.renderer = None
+                        pickle.dump(self, f)
+                    ev_city_plot(self)
 
             self.done = True
-            return self._get_observation(), reward, True, truncated, get_statistics(self)
+            observation = None
+            if observe:
+                with self._phase('state_function'):
+                    observation = self._get_observation(out)
+            with self._phase('episode_statistics'):
+                stats = get_statistics(self)
+            return observation, reward, True, truncated, stats
         else:
-            return self._get_observation(), reward, False, truncated, {'None': None}
+            observation = None
+            if observe:
+                with self._phase('state_function'):
+                    observation = self._get_observation(out)
+            return observation, reward, False, truncated, {'None': None}
 
     def render(self):
         '''Renders the simulation'''
         if self.render_mode:
             self.renderer.render()
 
+    def close(self):
+        '''Writes the remaining statistics of the telemetry sink'''
+        if self.telemetry_sink is not None:
+            self.telemetry_sink.close()
+
     def _save_sim_replay(self):
         '''Saves the simulation data in a pickle file'''
         replay = EvCityReplay(self)
@@ -516,6 +888,9 @@ class EV2Gym(gym.Env):
     
     def set_save_plots(self, save_plots):
         if save_plots:
+            assert self.telemetry_sink is None, \
+                "Plots need the statistics of the whole simulation, they cannot be saved when streaming them"
+
             os.makedirs("./results", exist_ok=True)
             print(f"Creating directory: ./results/{self.sim_name}")
             os.makedirs(f"./results/{self.sim_name}", exist_ok=True)
@@ -525,49 +900,99 @@ class EV2Gym(gym.Env):
     def _update_power_statistics(self, departing_evs):
         '''Updates the power statistics of the simulation'''
 
+        # index of the current step in the statistics arrays
+        t = self.current_step % self.trace_length
+
         # if not self.lightweight_plots:
-        for tr in self.transformers:
-            # self.transformer_amps[tr.id, self.current_step] = tr.current_amps
-            self.tr_overload[tr.id,
-                             self.current_step] = tr.get_how_overloaded()
-            self.tr_inflexible_loads[tr.id,
-                                     self.current_step] = tr.inflexible_load[self.current_step]
-            self.tr_solar_power[tr.id,
-                                self.current_step] = tr.solar_power[self.current_step]
+        # self.transformer_amps[:, self.current_step] = self.transformer_bank.current_amps
+        self.tr_overload[:, t] = self.transformer_bank.how_overloaded()
+        self.tr_inflexible_loads[:, t] = self.transformer_bank.inflexible_load[:, self.current_step]
+        self.tr_solar_power[:, t] = self.transformer_bank.solar_power[:, self.current_step]
+        self.total_transformer_overload += self.tr_overload[:, t].sum()
+        self.running_statistics.update(self.current_step, self.power_setpoints,
+                                       self.current_power_usage)
+
+        if self.port_state is not None:
+            self._update_port_statistics(t)
+        else:
+            self._update_cs_statistics(t, departing_evs)
+
+        if self.telemetry_sink is not None:
+            self.telemetry_sink.record(self.current_step)
+
+    def _update_cs_statistics(self, t, departing_evs):
+        '''Updates the charging station and port statistics of step index t'''
 
+        telemetry = self.port_telemetry
         for cs in self.charging_stations:
-            self.cs_power[cs.id, self.current_step] = cs.current_power_output
-            self.cs_current[cs.id, self.current_step] = cs.current_total_amps
+            self.cs_power[cs.id, t] = cs.current_power_output
+            self.cs_current[cs.id, t] = cs.current_total_amps
+
+            if not telemetry.traces:
+                continue
 
             for port in range(cs.n_ports):
-                if not self.lightweight_plots:
-                    self.port_current_signal[port, cs.id,
-                                             self.current_step] = cs.current_signal[port]
+                slot = telemetry.slot(cs.id, port)
+                telemetry.record('current_signal', t,
+                                 slot, cs.current_signal[port])
                 ev = cs.evs_connected[port]
-                if ev is not None and not self.lightweight_plots:
-                    # self.port_power[port, cs.id,
-                    #                 self.current_step] = ev.current_energy
-                    self.port_current[port, cs.id,
-                                      self.current_step] = ev.actual_current
-
-                    self.port_energy_level[port, cs.id,
-                                           self.current_step] = ev.current_capacity/ev.battery_capacity
+                if ev is not None:
+                    telemetry.record('current', t,
+                                     slot, ev.actual_current)
+                    telemetry.record('energy_level', t,
+                                     slot, ev.current_capacity/ev.battery_capacity)
 
             for ev in departing_evs:
-                if not self.lightweight_plots:
-                    self.port_energy_level[ev.id, ev.location, self.current_step] = \
-                        ev.current_capacity/ev.battery_capacity
-                    self.port_current[ev.id, ev.location,
-                                      self.current_step] = ev.actual_current
+                slot = telemetry.slot(ev.location, ev.id)
+                telemetry.record('energy_level', t,
+                                 slot, ev.current_capacity/ev.battery_capacity)
+                telemetry.record('current', t,
+                                 slot, ev.actual_current)
+
+    def _update_port_statistics(self, t):
+        '''Array version of the charging station and port statistics for the vectorized engine'''
+
+        ps = self.port_state
+        self.cs_power[ps.cs_ids, t] = ps.cs_power_output
+        self.cs_current[ps.cs_ids, t] = ps.cs_total_amps
+
+        telemetry = self.port_telemetry
+        if not telemetry.traces:
+            return
+
+        # the telemetry rows follow the same port order as the engine slots
+        telemetry.record('current_signal', t, slice(None), ps.signal)
+
+        # departing EVs keep the values of their last step, even if a new EV arrived at the port
+        ports = ps.departed | ps.occupied
+        soc = np.where(ps.departed, ps.step_soc,
+                       ps.current_capacity / np.where(ps.occupied, ps.battery_capacity, 1))
+        current = np.where(ps.departed, ps.step_current, ps.actual_current)
+
+        telemetry.record('current', t, ports, current[ports])
+        telemetry.record('energy_level', t, ports, soc[ports])
 
     def _step_date(self):
         '''Steps the simulation date by one timestep'''
         self.sim_date = self.sim_date + \
             datetime.timedelta(minutes=self.timescale)
 
-    def _get_observation(self):
-
-        return self.state_function(self)
+    def _get_observation(self, out=None):
+        '''
+        Returns the observation of the current step, StateSpec state functions are built with
+        an ObservationBuilder. If out is given the observation is written to it
+        '''
+        if not isinstance(self.state_function, StateSpec):
+            if out is None:
+                return self.state_function(self)
+            out[:] = self.state_function(self)
+            return out
+
+        builder = observation_builder(self, self.state_function)
+        if out is None:
+            # copied so that the returned observations do not change with the next steps
+            return builder.build().copy()
+        return builder.build(out=out)
 
     def set_reward_function(self, reward_function):
         '''
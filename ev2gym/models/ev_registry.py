@@ -0,0 +1,192 @@
+'''
+This file contains the EVRegistry class, which stores the parameters and status of EV sessions in
+structured numpy arrays (one row per session), and the EVRecord class, a view of a row.
+
+The EV profiles of an episode and the EVs that have departed are kept in registries, so that a
+long simulation does not hold a full EV object with its instance dictionary for every session.
+EVRecord views are EV objects with the same attributes and methods, so statistics, replays,
+baselines and plots keep working unchanged. Copied and pickled views are plain EV objects.
+'''
+
+import numpy as np
+
+from ev2gym.models.ev import EV, SOC_BINS
+from ev2gym.models.port_state import new_unbound
+
+# Arguments of the EV constructor
+SESSION_FIELDS = ['id', 'location', 'battery_capacity_at_arrival', 'time_of_arrival',
+                  'time_of_departure', 'desired_capacity', 'battery_capacity',
+                  'min_battery_capacity', 'max_ac_charge_power', 'min_ac_charge_power',
+                  'max_dc_charge_power', 'max_discharge_power', 'min_discharge_power',
+                  'ev_phases', 'transition_soc', 'charge_efficiency', 'discharge_efficiency',
+                  'timescale']
+
+# EV status variables
+STATUS_FIELDS = ['current_capacity', 'prev_capacity', 'current_energy', 'actual_current',
+                 'charging_cycles', 'previous_power', 'required_energy',
+                 'total_energy_exchanged', 'abs_total_energy_exchanged', 'soc_steps', 'soc_sum',
+                 'active_soc_count', 'active_soc_sum', 'calendar_loss', 'cyclic_loss',
+                 'c_lost', 'simulation_length']
+
+INT_FIELDS = ['id', 'location', 'time_of_arrival', 'time_of_departure', 'ev_phases', 'timescale',
+              'charging_cycles', 'soc_steps', 'simulation_length']
+
+# SoC bins of the battery degradation model, stored as fixed-size subarrays
+ARRAY_FIELDS = {'active_soc_count': (int, (SOC_BINS,)),
+                'active_soc_sum': (float, (SOC_BINS,))}
+
+EV_DTYPE = np.dtype([(name, *ARRAY_FIELDS[name]) if name in ARRAY_FIELDS else
+                     (name, int if name in INT_FIELDS else float)
+                     for name in SESSION_FIELDS + STATUS_FIELDS])
+
+
+def _field_values(ev) -> tuple:
+    # fields that an EV has not set yet (e.g. simulation_length before spawning) are stored as 0
+    return tuple(getattr(ev, name, 0) for name in EV_DTYPE.names)
+
+
+class EVRecordField:
+    '''
+    Data descriptor of an EV attribute stored in a field of an EVRegistry row
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = obj._rows[self.name][obj._row]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def __set__(self, obj, value):
+        obj._rows[self.name][obj._row] = value
+
+
+class EVRecord(EV):
+    '''
+    View of an EV session stored in a row of an EVRegistry.
+
+    Only the fields of the registry can be set, any other attribute raises an AttributeError
+    because it could not be stored in the row.
+    '''
+
+    __slots__ = ('_rows', '_row')
+
+    def __init__(self, rows, row):
+        self._rows = rows
+        self._row = row
+
+    def __setattr__(self, name, value):
+        if name not in EV_DTYPE.fields and name not in EVRecord.__slots__:
+            raise AttributeError(f"'{name}' is not a field of the EV registry")
+        super().__setattr__(name, value)
+
+    def __reduce_ex__(self, protocol):
+        # pickled and copied views are plain EV objects
+        state = {name: getattr(self, name) for name in EV_DTYPE.names}
+        for name in ARRAY_FIELDS:
+            state[name] = state[name].copy()
+        return (new_unbound, (EV,), state)
+
+
+for name in EV_DTYPE.names:
+    setattr(EVRecord, name, EVRecordField(name))
+
+
+class EVRegistry():
+    '''
+    EV sessions stored in chunks of chunk_size rows, registry[i] is a view of session i.
+
+    Rows are only appended, so the views handed out stay valid. A registry can be restored to
+    an earlier length with get_state and set_state, the views of the rows before that length
+    are shared with the snapshot and the rows appended afterwards are written to a copy.
+
+    Methods:
+        - append / extend: store EVs in new rows and return their views
+        - column: returns an array with a field of all the sessions
+        - get_state / set_state: snapshot and restore the registry
+    '''
+
+    def __init__(self,
+                 evs=(),  # EVs stored in the registry
+                 chunk_size=1024,  # rows allocated at once
+                 ):
+
+        self.chunk_size = chunk_size
+        self.chunks = []
+        self.n_evs = 0
+        # the last chunk is shared with a snapshot and is copied before appending to it
+        self.shared_chunk = False
+
+        self.extend(evs)
+
+    def __len__(self) -> int:
+        return self.n_evs
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.n_evs))]
+
+        if index < 0:
+            index += self.n_evs
+        if not 0 <= index < self.n_evs:
+            raise IndexError("EVRegistry index out of range")
+
+        return EVRecord(self.chunks[index // self.chunk_size], index % self.chunk_size)
+
+    def __iter__(self):
+        for index in range(self.n_evs):
+            yield self[index]
+
+    def _reserve(self, n_evs) -> None:
+        if self.shared_chunk:
+            self.chunks[-1] = self.chunks[-1].copy()
+            self.shared_chunk = False
+        while len(self.chunks) * self.chunk_size < n_evs:
+            self.chunks.append(np.zeros(self.chunk_size, dtype=EV_DTYPE))
+
+    def append(self, ev) -> EVRecord:
+        '''Stores an EV in a new row and returns its view'''
+        self._reserve(self.n_evs + 1)
+
+        rows = self.chunks[self.n_evs // self.chunk_size]
+        row = self.n_evs % self.chunk_size
+        rows[row] = _field_values(ev)
+        self.n_evs += 1
+
+        return EVRecord(rows, row)
+
+    def extend(self, evs) -> None:
+        '''Stores a list of EVs in new rows'''
+        values = [_field_values(ev) for ev in evs]
+        self._reserve(self.n_evs + len(values))
+
+        i = 0
+        while i < len(values):
+            rows = self.chunks[self.n_evs // self.chunk_size]
+            row = self.n_evs % self.chunk_size
+            n = min(len(values) - i, self.chunk_size - row)
+            rows[row:row + n] = values[i:i + n]
+
+            i += n
+            self.n_evs += n
+
+    def column(self, name) -> np.ndarray:
+        '''Returns an array with the field name of all the sessions'''
+        if self.n_evs == 0:
+            return np.zeros(0, dtype=EV_DTYPE[name])
+        return np.concatenate([rows[name] for rows in self.chunks])[:self.n_evs]
+
+    def get_state(self) -> tuple:
+        '''Returns a snapshot of the registry, the rows are shared with the registry'''
+        return list(self.chunks), self.n_evs
+
+    def set_state(self, state) -> None:
+        '''Restores a snapshot taken with get_state, the same snapshot can be restored many times'''
+        chunks, self.n_evs = state
+        n_chunks = -(-self.n_evs // self.chunk_size)
+        self.chunks = list(chunks[:n_chunks])
+
+        # the rows after the snapshot are written to a copy of the last chunk
+        self.shared_chunk = self.n_evs % self.chunk_size != 0
@@ -0,0 +1,229 @@
+'''
+This file contains the fused step kernel of the PortStateEngine, one loop over the ports that applies
+the actions of a step (masking, normalisation, current thresholds, battery model, profits and the
+max_charge_current check) without the temporary arrays of the numpy version.
+
+The kernel is compiled with numba when it is installed (pip install ev2gym[compiled]), step_ports is
+None otherwise and the PortStateEngine keeps using its numpy version. The operations follow
+EV_Charger.step and EV.step in the same order, so both versions give the same results.
+
+The compiled kernel is cached next to this file, set NUMBA_CACHE_DIR to a writable directory when
+the package is installed in a read-only location.
+'''
+
+import numpy as np
+
+from ev2gym.models.ev import SOC_BINS
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# return codes of the kernel, a non-negative value is the index of an overloaded charging station
+STEP_OK = -1
+STEP_DC_ACTION = -2
+
+
+def _step_ports(a,  # actions of every port, overwritten with the normalised actions
+                charge_prices,  # charge price of every charging station
+                discharge_prices,  # discharge price of every charging station
+                # Charging station and port parameters
+                cs_offsets, occupied, is_dc, voltage, phases, sqrt_phases, port_timescale,
+                max_charge_current, min_charge_current, abs_max_discharge_current,
+                min_discharge_current,
+                # EV parameters
+                battery_capacity, min_battery_capacity, max_ac_charge_power, min_ac_charge_power,
+                max_discharge_power, min_discharge_power, transition_soc, ev_phases,
+                charge_efficiency, discharge_efficiency, timescale,
+                # EV status, updated in place
+                current_capacity, prev_capacity, current_energy, actual_current, charging_cycles,
+                previous_power, required_energy, total_energy_exchanged,
+                abs_total_energy_exchanged, soc_steps, soc_sum, active_soc_count,
+                active_soc_sum,
+                # Charging station status, updated in place
+                cs_power_output, cs_total_amps, cs_energy_charged, cs_energy_discharged,
+                cs_profits,
+                # Outputs
+                signal,  # current signal of every port
+                profit,  # profit of every charging station
+                ):
+    '''
+    Applies the actions of one step to all the ports, see PortStateEngine.step_ports
+
+    Returns STEP_OK, STEP_DC_ACTION if a DC charger got an action (nothing is updated)
+    or the index of the first charging station whose sum of amps is higher than its max_charge_current
+    '''
+    n_ports = len(a)
+    n_cs = len(cs_offsets)
+
+    # Normalised actions and current signal, computed first so that nothing is updated for a DC action
+    for j in range(n_cs):
+        start = cs_offsets[j]
+        end = cs_offsets[j + 1] if j + 1 < n_cs else n_ports
+
+        # if no EV is connected, set action to 0
+        action_sum = 0.0
+        for i in range(start, end):
+            if not occupied[i]:
+                a[i] = 0.0
+            action_sum += a[i]
+
+        for i in range(start, end):
+            # normalize actions to sum to 1 for charging surplass or -1 for discharging surplass
+            x = a[i]
+            if action_sum > 1:
+                x = x / action_sum
+            elif action_sum < -1:
+                x = -x / action_sum
+            # np.round(x, 5)
+            x = np.rint(x * 100000.0) / 100000.0
+            a[i] = x
+
+            amps = 0.0
+            if x > 0:
+                amps = x * max_charge_current[i]
+                if amps < min_charge_current[i] - 0.01:
+                    amps = 0.0
+            elif x < 0:
+                amps = x * abs_max_discharge_current[i]
+                if amps > min_discharge_current[i] - 0.01:
+                    amps = min_discharge_current[i]
+
+            if is_dc[i] and occupied[i] and x != 0:
+                return STEP_DC_ACTION
+
+            signal[i] = amps
+
+    overloaded = STEP_OK
+    for j in range(n_cs):
+        start = cs_offsets[j]
+        end = cs_offsets[j + 1] if j + 1 < n_cs else n_ports
+
+        charged = 0.0
+        discharged = 0.0
+        power_output = 0.0
+        total_amps = 0.0
+
+        for i in range(start, end):
+            energy = 0.0
+            current = 0.0
+
+            if occupied[i]:
+                # EV.step
+                amps = signal[i]
+                min_charge_amps = min_ac_charge_power[i] * 1000 / (voltage[i] * sqrt_phases[i])
+                min_discharge_amps = min_discharge_power[i] * 1000 / (voltage[i] * sqrt_phases[i])
+                if (amps > 0 and amps < min_charge_amps) or \
+                        (amps < 0 and amps > min_discharge_amps):
+                    amps = 0.0
+
+                soc = current_capacity[i] / battery_capacity[i]
+                soc_steps[i] += 1
+                soc_sum[i] += soc
+
+                if amps == 0:
+                    current_energy[i] = 0.0
+                    actual_current[i] = 0.0
+                else:
+                    if previous_power[i] == 0 or previous_power[i] / amps < 0:
+                        charging_cycles[i] += 1
+
+                    ev_voltage = voltage[i] * np.sqrt(min(phases[i], ev_phases[i]))
+                    prev_capacity[i] = current_capacity[i]
+
+                    if amps > 0:
+                        # two-stage battery model of EV._charge
+                        period = timescale[i]
+                        pilot_dsoc = charge_efficiency[i] * amps * ev_voltage / 1000 / \
+                            battery_capacity[i] / (60 / period)
+                        max_dsoc = charge_efficiency[i] * max_ac_charge_power[i] / \
+                            battery_capacity[i] / (60 / period)
+                        if pilot_dsoc > max_dsoc:
+                            pilot_dsoc = max_dsoc
+
+                        if transition_soc[i] == 1:
+                            curr_soc = pilot_dsoc + soc
+                            if curr_soc > 1:
+                                curr_soc = 1.0
+                        else:
+                            pilot_transition_soc = transition_soc[i] + (
+                                pilot_dsoc - max_dsoc
+                            ) / max_dsoc * (transition_soc[i] - 1)
+
+                            if soc < pilot_transition_soc:
+                                if 1 <= (pilot_transition_soc - soc) / pilot_dsoc:
+                                    curr_soc = pilot_dsoc + soc
+                                else:
+                                    curr_soc = 1 + np.exp(
+                                        (pilot_dsoc + soc - pilot_transition_soc)
+                                        / (pilot_transition_soc - 1)
+                                    ) * (pilot_transition_soc - 1)
+                            else:
+                                curr_soc = 1 + np.exp(pilot_dsoc / (pilot_transition_soc - 1)) * (
+                                    soc - 1)
+
+                        dsoc = curr_soc - soc
+                        current_capacity[i] = curr_soc * battery_capacity[i]
+                        current_energy[i] = dsoc * battery_capacity[i]
+                        required_energy[i] = required_energy[i] - current_energy[i]
+                        actual_current[i] = current_energy[i] / (period / 60) * 1000 / ev_voltage
+                    else:
+                        # EV._discharge
+                        given_power = amps * ev_voltage / 1000
+                        if abs(given_power / 1000) > abs(max_discharge_power[i]):
+                            given_power = max_discharge_power[i]
+
+                        given_energy = given_power * discharge_efficiency[i] * timescale[i] / 60
+                        if current_capacity[i] + given_energy < min_battery_capacity[i]:
+                            given_energy = -(current_capacity[i] - min_battery_capacity[i])
+                            current_capacity[i] = min_battery_capacity[i]
+                        else:
+                            current_capacity[i] = current_capacity[i] + given_energy
+
+                        current_energy[i] = given_energy
+                        required_energy[i] = required_energy[i] + given_energy
+                        actual_current[i] = given_energy * 60 / timescale[i] * 1000 / ev_voltage
+
+                    previous_power[i] = current_energy[i]
+                    total_energy_exchanged[i] += current_energy[i]
+                    abs_total_energy_exchanged[i] += abs(current_energy[i])
+
+                    # round up to the nearest 0.01 the current capacity
+                    current_capacity[i] = np.ceil(current_capacity[i] * 100) / 100
+
+                    # SoC bin of the active steps of the degradation model
+                    if actual_current[i] != 0:
+                        b = int(np.floor(soc * SOC_BINS))
+                        b = min(max(b, 0), SOC_BINS - 1)
+                        active_soc_count[i, b] += 1
+                        active_soc_sum[i, b] += soc
+
+                energy = current_energy[i]
+                current = actual_current[i]
+
+            # EV_Charger.step
+            if a[i] > 0:
+                charged += abs(energy)
+            elif a[i] < 0:
+                discharged += abs(energy)
+
+            if a[i] != 0:
+                power_output += energy * 60 / port_timescale[i]
+                total_amps += current
+
+                # The sum of the amps is checked after every port
+                if total_amps - 0.0001 > max_charge_current[i] and overloaded == STEP_OK:
+                    overloaded = j
+
+        profit[j] = charged * charge_prices[j] + discharged * discharge_prices[j]
+        cs_power_output[j] = power_output
+        cs_total_amps[j] = total_amps
+        cs_energy_charged[j] += charged
+        cs_energy_discharged[j] += discharged
+        cs_profits[j] += profit[j]
+
+    return overloaded
+
+
+step_ports = njit(cache=True)(_step_ports) if njit is not None else None
@@ -0,0 +1,725 @@
+'''
+This file contains the PortStateEngine class, which keeps the state of every charging port
+and every connected EV in contiguous numpy arrays (struct-of-arrays) so that one simulation
+step can be computed with array operations instead of looping over the EV_Charger and EV objects.
+
+While an engine is active, the EV_Charger and EV objects of the environment are turned into
+thin views (BoundEVCharger and BoundEV) that read and write their status variables from the
+engine arrays, so state functions, reward functions and baselines keep working unchanged.
+'''
+
+import numpy as np
+from typing import List, Tuple
+
+from ev2gym.models import battery, port_kernel
+from ev2gym.models.ev import EV, SOC_BINS, soc_bin
+from ev2gym.models.ev_charger import EV_Charger
+
+
+def new_unbound(cls):
+    '''
+    Creates an empty plain object when unpickling or copying a bound view
+    '''
+    return cls.__new__(cls)
+
+
+class PortStateField:
+    '''
+    Data descriptor of a status variable that lives in a PortStateEngine array
+    while the object is bound to the engine.
+    '''
+
+    def __init__(self, array_name):
+        self.array_name = array_name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return getattr(obj._engine, self.array_name)[obj._slot].item()
+
+    def __set__(self, obj, value):
+        getattr(obj._engine, self.array_name)[obj._slot] = value
+
+
+# EV status variables stored in the engine, attribute name -> engine array
+EV_FIELDS = {
+    'current_capacity': 'current_capacity',
+    'prev_capacity': 'prev_capacity',
+    'current_energy': 'current_energy',
+    'actual_current': 'actual_current',
+    'charging_cycles': 'charging_cycles',
+    'previous_power': 'previous_power',
+    'required_energy': 'required_energy',
+    'total_energy_exchanged': 'total_energy_exchanged',
+    'abs_total_energy_exchanged': 'abs_total_energy_exchanged',
+    'soc_steps': 'soc_steps',
+    'soc_sum': 'soc_sum',
+}
+
+# EV parameters copied into the engine on arrival (read-only while bound)
+EV_PARAMETERS = ['battery_capacity', 'min_battery_capacity', 'max_ac_charge_power',
+                 'min_ac_charge_power', 'max_discharge_power', 'min_discharge_power',
+                 'transition_soc', 'ev_phases', 'charge_efficiency',
+                 'discharge_efficiency', 'timescale', 'time_of_arrival', 'time_of_departure',
+                 'desired_capacity']
+
+# EV_Charger status and statistics variables stored in the engine
+CS_FIELDS = {
+    'current_power_output': 'cs_power_output',
+    'current_total_amps': 'cs_total_amps',
+    'current_charge_price': 'cs_charge_price',
+    'current_discharge_price': 'cs_discharge_price',
+    'n_evs_connected': 'cs_n_evs_connected',
+    'current_step': 'cs_current_step',
+    'total_energy_charged': 'cs_energy_charged',
+    'total_energy_discharged': 'cs_energy_discharged',
+    'total_profits': 'cs_profits',
+    'total_evs_served': 'cs_evs_served',
+    'total_user_satisfaction': 'cs_user_satisfaction',
+}
+
+# Arrays with one entry per port and per charging station, concatenated by PortStateEngine.stack
+PORT_ARRAYS = ['port_index', 'voltage', 'phases', 'sqrt_phases', 'max_charge_current',
+               'min_charge_current', 'abs_max_discharge_current', 'min_discharge_current',
+               'is_dc', 'port_timescale', 'occupied', 'signal', 'power_potential'] + EV_PARAMETERS + \
+    list(EV_FIELDS.values()) + ['active_soc_count', 'active_soc_sum', 'departed', 'step_soc',
+                                'step_current']
+
+CS_ARRAYS = ['cs_voltage', 'cs_phases', 'cs_max_charge_current',
+             'cs_min_charge_current'] + list(CS_FIELDS.values())
+
+
+class BoundEV(EV):
+    '''
+    View of an EV whose status variables are stored in a PortStateEngine slot.
+    '''
+
+    @property
+    def active_soc_count(self) -> np.ndarray:
+        return self._engine.active_soc_count[self._slot]
+
+    @active_soc_count.setter
+    def active_soc_count(self, values):
+        self._engine.active_soc_count[self._slot] = values
+
+    @property
+    def active_soc_sum(self) -> np.ndarray:
+        return self._engine.active_soc_sum[self._slot]
+
+    @active_soc_sum.setter
+    def active_soc_sum(self, values):
+        self._engine.active_soc_sum[self._slot] = values
+
+    def __reduce_ex__(self, protocol):
+        # pickled and copied EVs are plain EV objects
+        return (new_unbound, (EV,), self._engine.plain_state(self))
+
+
+class BoundEVCharger(EV_Charger):
+    '''
+    View of an EV_Charger whose status variables are stored in a PortStateEngine.
+    '''
+
+    @property
+    def current_signal(self) -> np.ndarray:
+        start = self._engine.cs_offsets[self._slot]
+        return self._engine.signal[start:start + self.n_ports]
+
+    @current_signal.setter
+    def current_signal(self, values):
+        start = self._engine.cs_offsets[self._slot]
+        self._engine.signal[start:start + self.n_ports] = 0
+        self._engine.signal[start:start + len(values)] = values
+
+    def spawn_ev(self, ev):
+        index = super().spawn_ev(ev)
+        self._engine.attach(ev, self._slot, index)
+        return index
+
+    def step(self, actions, charge_price, discharge_price):
+        raise NotImplementedError(
+            'Chargers bound to a PortStateEngine are stepped by the engine')
+
+    def __reduce_ex__(self, protocol):
+        # pickled and copied chargers are plain EV_Charger objects
+        return (new_unbound, (EV_Charger,), self._engine.plain_state(self))
+
+
+for name, array in EV_FIELDS.items():
+    setattr(BoundEV, name, PortStateField(array))
+
+for name, array in CS_FIELDS.items():
+    setattr(BoundEVCharger, name, PortStateField(array))
+
+
+class PortStateEngine():
+    '''
+    Struct-of-arrays state of all the ports of the charging stations.
+
+    Port i of charging station j is stored in slot cs_offsets[j] + i, in the same order as
+    the actions vector of the environment.
+
+    Methods:
+        - step: applies the actions of all ports and returns the same outputs as looping over EV_Charger.step
+        - attach/detach: (un)binds an EV to a port slot
+        - pop_departures: returns the slots of the EVs departing at a step from the departure queue
+        - charge_power_potential: array version of calculate_charge_power_potential
+        - stack: batches the engines of several environments into one engine
+
+    With compiled=True the ports are updated by the fused kernel of port_kernel, which is only
+    available when numba is installed, otherwise the numpy version is used.
+    '''
+
+    def __init__(self,
+                 charging_stations,
+                 simulation_length,
+                 compiled=False,  # update the ports with the compiled kernel if numba is installed
+                 ):
+
+        self.charging_stations = charging_stations
+        self.simulation_length = simulation_length
+        self.compiled = compiled and port_kernel.step_ports is not None
+
+        self.n_cs = len(charging_stations)
+        n_ports = np.array([cs.n_ports for cs in charging_stations], dtype=int)
+        self.n_ports = int(n_ports.sum())
+        self.cs_offsets = np.concatenate(([0], np.cumsum(n_ports)[:-1])).astype(int)
+
+        # Port to charging station mapping
+        self.port_cs = np.repeat(np.arange(self.n_cs), n_ports)
+        self.port_index = np.arange(self.n_ports) - self.cs_offsets[self.port_cs]
+        self.cs_ids = np.array([cs.id for cs in charging_stations], dtype=int)
+        self.cs_transformer = np.array([cs.connected_transformer
+                                        for cs in charging_stations], dtype=int)
+
+        # Charging station parameters
+        self.cs_voltage = np.array([cs.voltage for cs in charging_stations], dtype=float)
+        self.cs_phases = np.array([cs.phases for cs in charging_stations], dtype=float)
+        self.cs_max_charge_current = np.array([cs.max_charge_current
+                                               for cs in charging_stations], dtype=float)
+        self.cs_min_charge_current = np.array([cs.min_charge_current
+                                               for cs in charging_stations], dtype=float)
+
+        # Charging station parameters per port
+        cs_is_dc = np.array([cs.charger_type == 'DC'
+                             for cs in charging_stations], dtype=bool)
+        cs_min_discharge_current = np.array([cs.min_discharge_current
+                                             for cs in charging_stations], dtype=float)
+        cs_max_discharge_current = np.array([cs.max_discharge_current
+                                             for cs in charging_stations], dtype=float)
+        self.voltage = self.cs_voltage[self.port_cs]
+        self.phases = self.cs_phases[self.port_cs]
+        self.sqrt_phases = np.sqrt(self.phases)
+        self.max_charge_current = self.cs_max_charge_current[self.port_cs]
+        self.min_charge_current = self.cs_min_charge_current[self.port_cs]
+        self.abs_max_discharge_current = np.abs(cs_max_discharge_current[self.port_cs])
+        self.min_discharge_current = cs_min_discharge_current[self.port_cs]
+        self.is_dc = cs_is_dc[self.port_cs]
+        self.port_timescale = np.array([cs.timescale for cs in charging_stations],
+                                       dtype=float)[self.port_cs]
+
+        # Charging station status and statistics
+        self.cs_power_output = np.zeros(self.n_cs)
+        self.cs_total_amps = np.zeros(self.n_cs)
+        self.cs_charge_price = np.zeros(self.n_cs)
+        self.cs_discharge_price = np.zeros(self.n_cs)
+        self.cs_n_evs_connected = np.zeros(self.n_cs, dtype=int)
+        self.cs_current_step = np.zeros(self.n_cs, dtype=int)
+        self.cs_energy_charged = np.zeros(self.n_cs)
+        self.cs_energy_discharged = np.zeros(self.n_cs)
+        self.cs_profits = np.zeros(self.n_cs)
+        self.cs_evs_served = np.zeros(self.n_cs, dtype=int)
+        self.cs_user_satisfaction = np.zeros(self.n_cs)
+
+        # Charging station power limits of the charge power potential
+        self.cs_max_power = np.sqrt(self.cs_phases) * \
+            self.cs_voltage*self.cs_max_charge_current/1000
+        self.cs_min_power = np.sqrt(self.cs_phases) * \
+            self.cs_voltage*self.cs_min_charge_current/1000
+
+        # Port status
+        self.evs = [None] * self.n_ports
+        self.occupied = np.zeros(self.n_ports, dtype=bool)
+        self.signal = np.zeros(self.n_ports)
+        # charge power potential of the connected EV, computed on arrival
+        self.power_potential = np.zeros(self.n_ports)
+
+        # EV parameters
+        for name in EV_PARAMETERS:
+            dtype = int if name in ['time_of_arrival', 'time_of_departure'] else float
+            setattr(self, name, np.zeros(self.n_ports, dtype=dtype))
+
+        # EV status
+        for name in EV_FIELDS.values():
+            dtype = int if name in ['charging_cycles', 'soc_steps'] else float
+            setattr(self, name, np.zeros(self.n_ports, dtype=dtype))
+
+        # count and sum of the SoC of the active steps in every SoC bin, used by the battery
+        # degradation model
+        self.active_soc_count = np.zeros((self.n_ports, SOC_BINS), dtype=int)
+        self.active_soc_sum = np.zeros((self.n_ports, SOC_BINS))
+
+        # Departure queue, the slots of the EVs departing at step t are in departures[t]
+        self.departures = [[] for _ in range(simulation_length)]
+
+        # Values of the last step, used for the port statistics of departing EVs
+        self.departed = np.zeros(self.n_ports, dtype=bool)
+        self.step_soc = np.zeros(self.n_ports)
+        self.step_current = np.zeros(self.n_ports)
+
+        self.bind()
+
+    @classmethod
+    def stack(cls, engines) -> 'PortStateEngine':
+        '''
+        Concatenates the arrays of several engines into one batched engine.
+
+        The arrays of the given engines are replaced by views of the batched arrays, so calling
+        step_ports on the batched engine updates all of them at once. The batched engine does not
+        own any EV or EV_Charger object, the departing EVs are released by the engine of each
+        environment.
+        '''
+        simulation_length = engines[0].simulation_length
+        assert all(engine.simulation_length == simulation_length for engine in engines), \
+            "All the stacked engines must have the same simulation length"
+
+        batch = cls.__new__(cls)
+        batch.charging_stations = []
+        batch.simulation_length = simulation_length
+        batch.compiled = all(engine.compiled for engine in engines)
+        batch.evs = []
+
+        cs_start = np.cumsum([0] + [engine.n_cs for engine in engines])
+        port_start = np.cumsum([0] + [engine.n_ports for engine in engines])
+        batch.n_cs = int(cs_start[-1])
+        batch.n_ports = int(port_start[-1])
+        batch.cs_start = cs_start
+        batch.port_start = port_start
+
+        batch.port_cs = np.concatenate([engine.port_cs + cs_start[i]
+                                        for i, engine in enumerate(engines)])
+        batch.cs_offsets = np.concatenate([engine.cs_offsets + port_start[i]
+                                           for i, engine in enumerate(engines)])
+
+        for names, start in ((PORT_ARRAYS, port_start), (CS_ARRAYS, cs_start)):
+            for name in names:
+                array = np.concatenate([getattr(engine, name) for engine in engines])
+                setattr(batch, name, array)
+                for i, engine in enumerate(engines):
+                    setattr(engine, name, array[start[i]:start[i+1]])
+
+        return batch
+
+    def bind(self) -> None:
+        '''
+        Turns the charging stations and the connected EVs into views of the engine
+        '''
+        for j, cs in enumerate(self.charging_stations):
+            state = {name: getattr(cs, name) for name in CS_FIELDS}
+            signal = list(cs.current_signal)
+            cs.__class__ = BoundEVCharger
+            cs._engine = self
+            cs._slot = j
+            for name, value in state.items():
+                setattr(cs, name, value)
+            cs.current_signal = signal
+
+        for slot, ev in enumerate(self.evs):
+            if ev is not None and ev.__class__ is not BoundEV:
+                ev.__class__ = BoundEV
+                ev._engine = self
+                ev._slot = slot
+
+    def reset(self) -> None:
+        '''
+        Releases all the ports, it is called after the charging stations have been reset
+        '''
+        for slot in np.flatnonzero(self.occupied):
+            self.detach(slot)
+
+        self.signal[:] = 0
+        self.departed[:] = False
+        for departures in self.departures:
+            departures.clear()
+
+    def plain_state(self, obj) -> dict:
+        '''
+        Returns the instance dictionary of a bound object with the engine values materialized
+        '''
+        state = {k: v for k, v in obj.__dict__.items()
+                 if k not in ('_engine', '_slot')}
+
+        if isinstance(obj, EV):
+            for name in EV_FIELDS:
+                state[name] = getattr(obj, name)
+            state['active_soc_count'] = self.active_soc_count[obj._slot].copy()
+            state['active_soc_sum'] = self.active_soc_sum[obj._slot].copy()
+        else:
+            for name in CS_FIELDS:
+                state[name] = getattr(obj, name)
+            state['current_signal'] = obj.current_signal.tolist()
+
+        return state
+
+    def attach(self, ev, cs_index, port) -> None:
+        '''
+        Copies the EV parameters and status to the port slot and binds the EV to it
+        '''
+        slot = self.cs_offsets[cs_index] + port
+
+        for name in EV_PARAMETERS:
+            getattr(self, name)[slot] = getattr(ev, name)
+        for name, array in EV_FIELDS.items():
+            getattr(self, array)[slot] = getattr(ev, name)
+
+        self.active_soc_count[slot] = ev.active_soc_count
+        self.active_soc_sum[slot] = ev.active_soc_sum
+
+        self.evs[slot] = ev
+        self.occupied[slot] = True
+
+        phases = min(self.phases[slot], ev.ev_phases)
+        with np.errstate(divide='ignore'):
+            ev_current = ev.max_ac_charge_power * 1000/(np.sqrt(phases)*self.voltage[slot])
+        current = min(self.max_charge_current[slot], ev_current)
+        self.power_potential[slot] = np.sqrt(phases) * self.voltage[slot]*current/1000
+
+        # EVs are checked for departure from the step they arrive
+        departure_step = max(ev.time_of_departure, self.cs_current_step[cs_index])
+        if departure_step < self.simulation_length:
+            self.departures[departure_step].append(slot)
+
+        ev.__class__ = BoundEV
+        ev._engine = self
+        ev._slot = slot
+
+    def detach(self, slot) -> EV:
+        '''
+        Writes back the status of the EV of the slot and unbinds it
+        '''
+        ev = self.evs[slot]
+        ev.__dict__.update(self.plain_state(ev))
+        ev.__class__ = EV
+        del ev._engine, ev._slot
+
+        self.evs[slot] = None
+        self.occupied[slot] = False
+        return ev
+
+    def pop_departures(self, step) -> np.ndarray:
+        '''
+        Returns the sorted slots of the EVs departing at the given step and removes them from the queue
+        '''
+        if step >= self.simulation_length or not self.departures[step]:
+            return np.zeros(0, dtype=int)
+
+        slots = np.array(sorted(self.departures[step]), dtype=int)
+        self.departures[step] = []
+        return slots
+
+    def step(self, actions, charge_prices, discharge_prices, current_step) -> Tuple[float, List[float], int, List[EV]]:
+        '''
+        Updates all the ports according to the actions, equivalent to calling EV_Charger.step
+        for every charging station.
+
+        Inputs:
+            - actions: vector of size n_ports with values in [-1,1]
+            - charge_prices: charge price of every charging station (in engine order) in the current timestep
+            - discharge_prices: discharge price of every charging station (in engine order) in the current timestep
+            - current_step: the current step of the simulation, used to find the departing EVs
+
+        Outputs:
+            - profit: the total profit of all charging stations in the current timestep
+            - user_satisfaction: the user satisfaction of the departing EVs
+            - invalid_action_punishment: the number of actions given to empty ports
+            - departing_evs: the list of departing EVs
+        '''
+        departing = self.pop_departures(current_step)
+        profit, empty = self.step_ports(actions,
+                                        charge_prices,
+                                        discharge_prices,
+                                        departing)
+        user_satisfaction, departing_evs = self.release(departing)
+
+        return float(profit.sum()), user_satisfaction, int(empty.sum()), departing_evs
+
+    def step_ports(self, actions, charge_prices, discharge_prices, departing) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Array part of the step, it updates the port and charging station arrays
+        without touching the EV and EV_Charger objects.
+
+        Inputs:
+            - departing: the slots of the EVs departing in the current timestep, see pop_departures()
+
+        Outputs:
+            - profit: the profit of every charging station in the current timestep
+            - empty: mask of the ports that got an action without an EV connected
+        '''
+        occupied = self.occupied
+
+        a = np.array(actions, dtype=float)
+        assert (len(a) == self.n_ports)
+
+        # if no EV is connected, set action to 0
+        empty = ~occupied
+        a[empty] = 0
+        if isinstance(actions, np.ndarray):
+            actions[empty] = 0
+
+        if self.compiled:
+            profit = self._step_ports_compiled(a, charge_prices, discharge_prices)
+        else:
+            profit = self._step_ports_numpy(a, charge_prices, discharge_prices)
+
+        # Keep the values of the departing EVs for the port statistics
+        self.step_soc[:] = self.current_capacity / \
+            np.where(occupied, self.battery_capacity, 1)
+        self.step_current[:] = self.actual_current
+        self.departed[:] = False
+        self.departed[departing] = True
+
+        self.cs_current_step += 1
+
+        return profit, empty
+
+    def _step_ports_numpy(self, a, charge_prices, discharge_prices) -> np.ndarray:
+        '''
+        Updates the ports with array operations, returns the profit of every charging station
+        '''
+        occupied = self.occupied
+        port_cs = self.port_cs
+
+        # normalize actions to sum to 1 for charging surplass or -1 for discharging surplass
+        action_sum = np.bincount(port_cs, weights=a, minlength=self.n_cs)[port_cs]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a = np.where(action_sum > 1, a / action_sum,
+                         np.where(action_sum < -1, -a / action_sum, a))
+        a = np.round(a, 5)
+
+        charging = a > 0
+        discharging = a < 0
+
+        amps = np.zeros(self.n_ports)
+        amps[charging] = a[charging] * self.max_charge_current[charging]
+        amps[charging & (amps < self.min_charge_current - 0.01)] = 0
+        amps[discharging] = a[discharging] * \
+            self.abs_max_discharge_current[discharging]
+        low_discharge = discharging & (amps > self.min_discharge_current - 0.01)
+        amps[low_discharge] = self.min_discharge_current[low_discharge]
+
+        if np.any(self.is_dc & occupied & (charging | discharging)):
+            raise NotImplementedError
+
+        self.signal[:] = amps
+
+        energy, current = self._step_evs(amps)
+
+        # Charging station profits and energy
+        abs_energy = np.abs(energy)
+        charge_prices = np.asarray(charge_prices, dtype=float)
+        discharge_prices = np.asarray(discharge_prices, dtype=float)
+        charged = np.bincount(port_cs, weights=np.where(charging, abs_energy, 0),
+                              minlength=self.n_cs)
+        discharged = np.bincount(port_cs, weights=np.where(discharging, abs_energy, 0),
+                                 minlength=self.n_cs)
+        profit = charged * charge_prices + discharged * discharge_prices
+
+        active = charging | discharging
+        self.cs_power_output[:] = np.bincount(port_cs,
+                                              weights=np.where(active, energy, 0) *
+                                              60 / self.port_timescale,
+                                              minlength=self.n_cs)
+        self.cs_total_amps[:] = np.bincount(port_cs,
+                                            weights=np.where(active, current, 0),
+                                            minlength=self.n_cs)
+        self.cs_charge_price[:] = charge_prices
+        self.cs_discharge_price[:] = discharge_prices
+        self.cs_energy_charged += charged
+        self.cs_energy_discharged += discharged
+        self.cs_profits += profit
+
+        # The sum of the amps is checked after every port
+        cumulative_amps = np.cumsum(np.where(active, current, 0))
+        cumulative_amps -= np.concatenate(([0], cumulative_amps))[
+            self.cs_offsets][port_cs]
+        overloaded = cumulative_amps - 0.0001 > self.max_charge_current
+        if np.any(overloaded):
+            j = port_cs[np.argmax(overloaded)]
+            raise Exception(
+                f'sum of amps {self.cs_total_amps[j]} is higher than max charge current {self.cs_max_charge_current[j]}')
+
+        return profit
+
+    def _step_ports_compiled(self, a, charge_prices, discharge_prices) -> np.ndarray:
+        '''
+        Updates the ports with the fused kernel of port_kernel, returns the profit of every charging station
+        '''
+        charge_prices = np.asarray(charge_prices, dtype=float)
+        discharge_prices = np.asarray(discharge_prices, dtype=float)
+        profit = np.zeros(self.n_cs)
+
+        result = port_kernel.step_ports(
+            a, charge_prices, discharge_prices,
+            self.cs_offsets, self.occupied, self.is_dc, self.voltage, self.phases,
+            self.sqrt_phases, self.port_timescale, self.max_charge_current,
+            self.min_charge_current, self.abs_max_discharge_current, self.min_discharge_current,
+            self.battery_capacity, self.min_battery_capacity, self.max_ac_charge_power,
+            self.min_ac_charge_power, self.max_discharge_power, self.min_discharge_power,
+            self.transition_soc, self.ev_phases, self.charge_efficiency,
+            self.discharge_efficiency, self.timescale,
+            self.current_capacity, self.prev_capacity, self.current_energy, self.actual_current,
+            self.charging_cycles, self.previous_power, self.required_energy,
+            self.total_energy_exchanged, self.abs_total_energy_exchanged, self.soc_steps,
+            self.soc_sum, self.active_soc_count, self.active_soc_sum,
+            self.cs_power_output, self.cs_total_amps, self.cs_energy_charged,
+            self.cs_energy_discharged, self.cs_profits,
+            self.signal, profit)
+
+        if result == port_kernel.STEP_DC_ACTION:
+            raise NotImplementedError
+
+        self.cs_charge_price[:] = charge_prices
+        self.cs_discharge_price[:] = discharge_prices
+
+        if result != port_kernel.STEP_OK:
+            raise Exception(
+                f'sum of amps {self.cs_total_amps[result]} is higher than max charge current {self.cs_max_charge_current[result]}')
+
+        return profit
+
+    def release(self, slots) -> Tuple[List[float], List[EV]]:
+        '''
+        Disconnects the departing EVs of the given slots from their charging stations,
+        the user satisfaction and the charging station statistics are updated in bulk
+
+        Outputs:
+            - user_satisfaction: the user satisfaction of the departing EVs
+            - departing_evs: the list of departing EVs
+        '''
+        if len(slots) == 0:
+            return [], []
+
+        cs_index = self.port_cs[slots]
+        current_capacity = self.current_capacity[slots]
+        desired_capacity = self.desired_capacity[slots]
+        user_satisfaction = np.where(current_capacity < desired_capacity - 0.001,
+                                     current_capacity / desired_capacity, 1)
+
+        np.subtract.at(self.cs_n_evs_connected, cs_index, 1)
+        np.add.at(self.cs_evs_served, cs_index, 1)
+        np.add.at(self.cs_user_satisfaction, cs_index, user_satisfaction)
+
+        departing_evs = []
+        for slot in slots:
+            cs = self.charging_stations[self.port_cs[slot]]
+            cs.evs_connected[self.port_index[slot]] = None
+            departing_evs.append(self.detach(slot))
+
+        return user_satisfaction.tolist(), departing_evs
+
+    def _step_evs(self, amps) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Array version of EV.step for all the occupied ports
+        Returns the energy and actual current of every port
+        '''
+        occupied = self.occupied
+        voltage = self.voltage
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            min_charge_amps = self.min_ac_charge_power * 1000 / \
+                (voltage * self.sqrt_phases)
+            min_discharge_amps = self.min_discharge_power * 1000 / \
+                (voltage * self.sqrt_phases)
+        amps = np.where(((amps > 0) & (amps < min_charge_amps)) |
+                        ((amps < 0) & (amps > min_discharge_amps)), 0, amps)
+
+        soc = self.current_capacity / np.where(occupied, self.battery_capacity, 1)
+        self.soc_steps[occupied] += 1
+        self.soc_sum[occupied] += soc[occupied]
+
+        idle = occupied & (amps == 0)
+        self.current_energy[idle] = 0
+        self.actual_current[idle] = 0
+
+        active = occupied & (amps != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            new_cycle = active & ((self.previous_power == 0) |
+                                  (self.previous_power / amps < 0))
+        self.charging_cycles[new_cycle] += 1
+
+        phases = np.minimum(self.phases, self.ev_phases)
+
+        charge = np.flatnonzero(active & (amps > 0))
+        if len(charge):
+            self._charge(charge, amps[charge], voltage[charge], phases[charge])
+
+        discharge = np.flatnonzero(active & (amps < 0))
+        if len(discharge):
+            self._discharge(discharge, amps[discharge], voltage[discharge], phases[discharge])
+
+        self.previous_power[active] = self.current_energy[active]
+        self.total_energy_exchanged[active] += self.current_energy[active]
+        self.abs_total_energy_exchanged[active] += np.abs(
+            self.current_energy[active])
+
+        # round up to the nearest 0.01 the current capacity
+        self.current_capacity[active] = np.true_divide(
+            np.ceil(self.current_capacity[active] * 10**2), 10**2)
+
+        counted = np.flatnonzero(active & (self.actual_current != 0))
+        bins = soc_bin(soc[counted])
+        self.active_soc_count[counted, bins] += 1
+        self.active_soc_sum[counted, bins] += soc[counted]
+
+        energy = np.where(occupied, self.current_energy, 0)
+        current = np.where(occupied, self.actual_current, 0)
+        return energy, current
+
+    def _charge(self, idx, pilot, voltage, phases) -> None:
+        '''
+        Charges the EVs of the slots idx with the two-stage battery model
+        '''
+        current_capacity = self.current_capacity[idx]
+        capacity, energy, current = battery.charge(
+            pilot, voltage, phases, current_capacity, self.battery_capacity[idx],
+            self.max_ac_charge_power[idx], self.transition_soc[idx],
+            self.charge_efficiency[idx], self.timescale[idx])
+
+        self.prev_capacity[idx] = current_capacity
+        self.current_capacity[idx] = capacity
+        self.current_energy[idx] = energy
+        self.required_energy[idx] = self.required_energy[idx] - energy
+        self.actual_current[idx] = current
+
+    def _discharge(self, idx, amps, voltage, phases) -> None:
+        '''
+        Discharges the EVs of the slots idx
+        '''
+        current_capacity = self.current_capacity[idx]
+        capacity, energy, current = battery.discharge(
+            amps, voltage, phases, current_capacity, self.min_battery_capacity[idx],
+            self.max_discharge_power[idx], self.discharge_efficiency[idx],
+            self.timescale[idx])
+
+        self.prev_capacity[idx] = current_capacity
+        self.current_capacity[idx] = capacity
+        self.current_energy[idx] = energy
+        self.required_energy[idx] = self.required_energy[idx] + energy
+        self.actual_current[idx] = current
+
+    def charge_power_potential(self, current_step) -> float:
+        '''
+        Array version of calculate_charge_power_potential, the potential of every EV is computed on arrival
+        '''
+        soc = self.current_capacity / np.where(self.occupied, self.battery_capacity, 1)
+        parked = self.occupied & (soc < 1) & \
+            (self.time_of_departure > current_step)
+
+        port_power = np.where(parked, self.power_potential, 0)
+        cs_power_potential = np.bincount(self.port_cs, weights=port_power,
+                                         minlength=self.n_cs)
+
+        power_potential = np.where(cs_power_potential > self.cs_max_power, self.cs_max_power,
+                                   np.where(cs_power_potential < self.cs_min_power, 0,
+                                            cs_power_potential))
+        return float(power_potential.sum())
@@ -0,0 +1,122 @@
+'''
+This file contains the ChargePowerPotential class, which keeps the charge power potential of the
+charging stations up to date incrementally instead of scanning every port at every step.
+'''
+
+import math
+
+
+class ChargePowerPotential():
+    '''
+    Per charging station aggregates of the charge power potential of the parked EVs,
+    the total is the same as calculate_charge_power_potential.
+
+    The potential of an EV only depends on the EV and the charging station, so it is computed
+    once on arrival. An EV counts while it is not full and does not depart at the evaluated step,
+    so a charging station is only recomputed on arrivals, departures and full-SoC transitions.
+
+    Methods:
+        - arrive: adds an EV connected to a port
+        - update: updates a charging station after its step, with the EVs departing from it
+        - rebuild: recomputes all the charging stations from the connected EVs
+        - total: returns the charge power potential of a step
+    '''
+
+    def __init__(self, charging_stations):
+
+        self.charging_stations = charging_stations
+
+        # Charging station constants
+        self.max_cs_power = [math.sqrt(cs.phases) * cs.voltage*cs.max_charge_current/1000
+                             for cs in charging_stations]
+        self.min_cs_power = [math.sqrt(cs.phases) * cs.voltage*cs.min_charge_current/1000
+                             for cs in charging_stations]
+
+        self.reset()
+
+    def reset(self) -> None:
+        '''Releases all the ports'''
+        # potential of the EV connected to every port, None if the port is empty
+        self.port_power = [[None] * cs.n_ports for cs in self.charging_stations]
+        self.counted = [[False] * cs.n_ports for cs in self.charging_stations]
+        self.cs_power_potential = [0] * len(self.charging_stations)
+
+        # the ports whose EVs stop counting at step t are in departures[t]
+        self.departures = {}
+        self.dirty = set()
+        self.power_potential = 0
+
+    def _ev_power(self, cs, ev) -> float:
+        phases = min(cs.phases, ev.ev_phases)
+        ev_current = ev.max_ac_charge_power * \
+            1000/(math.sqrt(phases)*cs.voltage)
+        current = min(cs.max_charge_current, ev_current)
+        return math.sqrt(phases) * cs.voltage*current/1000
+
+    def _set_counted(self, j, port, ev, step) -> None:
+        counted = ev.get_soc() < 1 and ev.time_of_departure > step
+        if counted != self.counted[j][port]:
+            self.counted[j][port] = counted
+            self.dirty.add(j)
+
+    def arrive(self, j, port, ev, step) -> None:
+        '''Adds the EV connected to a port of charging station j, the potential is next evaluated at step'''
+        self.port_power[j][port] = self._ev_power(self.charging_stations[j], ev)
+        self.counted[j][port] = False
+        self._set_counted(j, port, ev, step)
+        self.dirty.add(j)
+
+        if ev.time_of_departure > step:
+            self.departures.setdefault(ev.time_of_departure, []).append((j, port, ev))
+
+    def update(self, j, departing_evs, step) -> None:
+        '''
+        Updates charging station j after its step, only the EVs that received a current signal
+        can have changed their SoC
+        '''
+        cs = self.charging_stations[j]
+
+        for ev in departing_evs:
+            self.port_power[j][ev.id] = None
+            self.counted[j][ev.id] = False
+            self.dirty.add(j)
+
+        for port, amps in enumerate(cs.current_signal):
+            if amps != 0 and cs.evs_connected[port] is not None:
+                self._set_counted(j, port, cs.evs_connected[port], step)
+
+    def rebuild(self, step) -> None:
+        '''Recomputes the aggregates from the EVs connected to the charging stations'''
+        self.reset()
+        for j, cs in enumerate(self.charging_stations):
+            for port, ev in enumerate(cs.evs_connected):
+                if ev is not None:
+                    self.arrive(j, port, ev, step)
+        self.dirty = set(range(len(self.charging_stations)))
+
+    def total(self, step) -> float:
+        '''Returns the total charge power potential of all currently parked EVs at step'''
+        for j, port, ev in self.departures.pop(step, []):
+            if self.charging_stations[j].evs_connected[port] is ev and self.counted[j][port]:
+                self.counted[j][port] = False
+                self.dirty.add(j)
+
+        if self.dirty:
+            for j in self.dirty:
+                self.cs_power_potential[j] = self._cs_power_potential(j)
+            self.dirty.clear()
+            self.power_potential = sum(self.cs_power_potential)
+
+        return self.power_potential
+
+    def _cs_power_potential(self, j) -> float:
+        cs_power_potential = 0
+        for power, counted in zip(self.port_power[j], self.counted[j]):
+            if counted:
+                cs_power_potential += power
+
+        if cs_power_potential > self.max_cs_power[j]:
+            return self.max_cs_power[j]
+        elif cs_power_potential < self.min_cs_power[j]:
+            return 0
+        return cs_power_potential
@@ -0,0 +1,151 @@
+'''
+This file contains the StepProfiler class, which measures the time spent in the phases of the
+simulation steps (charger stepping, EV spawning, statistics, state and reward functions, rendering,
+replay saving...) and exports them as a report or as a Chrome trace (chrome://tracing, Perfetto).
+'''
+
+import json
+import os
+import time
+from collections import deque
+from contextlib import nullcontext
+
+# context manager of the phases when profiling is disabled
+NULL_PHASE = nullcontext()
+
+
+class _Phase():
+    '''
+    Context manager that measures one call of a phase
+    '''
+
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+class StepProfiler():
+    '''
+    Cumulative and per-step timings of the phases of a simulation.
+
+    Phases of EV2Gym:
+        - step: the whole EV2Gym.step call, the other phases are part of it (except reset)
+        - charger_step, transformer_step: stepping the charging stations (or the port state) and the transformers
+        - ev_spawn, statistics, charge_power_potential: the parts of the step after the chargers
+        - state_function, reward_function: the observation and the reward of the step
+        - render, episode_statistics, save_plots, replay_saving, reset
+
+    Methods:
+        - phase: context manager measuring a phase, e.g. with profiler.phase('state_function'): ...
+        - begin_step: starts the per-step timings of a step
+        - step_report: the time of every phase in the current step [ms]
+        - report: the cumulative timings of every phase
+        - export_chrome_trace: writes the recorded phases as a Chrome trace JSON file
+    '''
+
+    def __init__(self,
+                 max_trace_events=100000,  # only the last phases are kept for the Chrome trace, 0 disables it
+                 ):
+
+        self.max_trace_events = max_trace_events
+        self.clear()
+
+    def clear(self) -> None:
+        '''Removes all the recorded timings'''
+        self.origin = time.perf_counter_ns()
+        self.step = 0
+
+        # cumulative time [ns], number of calls and longest call [ns] of every phase
+        self.total = {}
+        self.calls = {}
+        self.max = {}
+
+        # time of every phase in the current step [ns]
+        self.current = {}
+
+        # (phase, start, duration, step) of the last calls
+        self.events = deque(maxlen=self.max_trace_events)
+
+    def phase(self, name) -> _Phase:
+        '''Returns a context manager that measures a call of the phase name'''
+        return _Phase(self, name)
+
+    def begin_step(self, step) -> None:
+        '''Starts the per-step timings of step'''
+        self.step = step
+        self.current = {}
+
+    def record(self, name, start, end) -> None:
+        '''Adds a call of the phase name from start to end [ns, time.perf_counter_ns]'''
+        duration = end - start
+
+        self.total[name] = self.total.get(name, 0) + duration
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if duration > self.max.get(name, 0):
+            self.max[name] = duration
+        self.current[name] = self.current.get(name, 0) + duration
+
+        if self.max_trace_events:
+            self.events.append((name, start, duration, self.step))
+
+    def step_report(self) -> dict:
+        '''Returns the time of every phase in the current step [ms]'''
+        return {name: duration / 1e6 for name, duration in self.current.items()}
+
+    def report(self) -> dict:
+        '''
+        Returns the cumulative timings of every phase, sorted by total time:
+            - calls: number of calls
+            - total: total time [s]
+            - mean, max: mean and longest call [ms]
+            - share: fraction of the time of the step phase
+        '''
+        step_total = self.total.get('step', 0)
+
+        report = {}
+        for name in sorted(self.total, key=self.total.get, reverse=True):
+            report[name] = {'calls': self.calls[name],
+                            'total': self.total[name] / 1e9,
+                            'mean': self.total[name] / self.calls[name] / 1e6,
+                            'max': self.max[name] / 1e6,
+                            'share': self.total[name] / step_total if step_total else float('nan')}
+        return report
+
+    def format_report(self) -> str:
+        '''Returns the report as a table'''
+        lines = [f'{"phase":<24}{"calls":>10}{"total [s]":>12}{"mean [ms]":>12}{"max [ms]":>12}{"share":>8}']
+        for name, row in self.report().items():
+            lines.append(f'{name:<24}{row["calls"]:>10}{row["total"]:>12.4f}'
+                         f'{row["mean"]:>12.4f}{row["max"]:>12.4f}{row["share"]:>8.1%}')
+        return '\n'.join(lines)
+
+    def export_chrome_trace(self, path) -> str:
+        '''
+        Writes the recorded phases as Chrome trace events to path, the file can be opened in
+        chrome://tracing or https://ui.perfetto.dev
+        '''
+        pid = os.getpid()
+        events = [{'name': name,
+                   'cat': 'ev2gym',
+                   'ph': 'X',
+                   'ts': (start - self.origin) / 1e3,
+                   'dur': duration / 1e3,
+                   'pid': pid,
+                   'tid': 0,
+                   'args': {'step': step}}
+                  for name, start, duration, step in self.events]
+
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+        return path
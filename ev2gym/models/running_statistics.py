@@ -0,0 +1,80 @@
+'''
+This file contains the RunningStatistics class, which accumulates the power tracking statistics of
+an episode at every step, so that get_statistics does not loop over the whole simulation length,
+and caches the statistics of the last get_statistics call until the next step.
+'''
+
+
+class RunningStatistics():
+    '''
+    Running sums of the power tracking statistics of an episode.
+
+    The sums are accumulated in the same order as the loop over the simulation steps they replace,
+    so the statistics are the same. The steps that have not been simulated yet (e.g. when a transformer
+    overload ends the episode early) are added when the sums are read.
+
+    Methods:
+        - update: adds the power usage of a simulated step
+        - tracking_statistics: returns the tracking error, energy tracking error and power tracker violation
+        - get_cached / set_cached: the statistics of the current step, reset by update
+        - copy: returns an independent copy, used by the environment snapshots
+    '''
+
+    def __init__(self, simulation_length, timescale):
+
+        self.simulation_length = simulation_length
+        self.timescale = timescale
+
+        # number of steps added to the sums
+        self.steps = 0
+        self.tracking_error = 0
+        self.energy_tracking_error = 0
+        self.power_tracker_violation = 0
+
+        self.cached = None
+
+    def _add(self, setpoint, power_usage) -> None:
+        self.tracking_error += (setpoint - power_usage)**2
+        self.energy_tracking_error += abs(setpoint - power_usage)
+
+        if power_usage > setpoint:
+            self.power_tracker_violation += power_usage - setpoint
+
+    def update(self, step, power_setpoints, current_power_usage) -> None:
+        '''Adds the power usage of step, the steps must be added in order'''
+        assert step == self.steps, \
+            f"RunningStatistics expected step {self.steps}, got step {step}"
+
+        self._add(power_setpoints[step], current_power_usage[step])
+        self.steps += 1
+        self.cached = None
+
+    def tracking_statistics(self, power_setpoints, current_power_usage) -> tuple:
+        '''
+        Returns the tracking error, energy tracking error and power tracker violation of the whole
+        simulation length
+        '''
+        remaining = self.copy()
+        for t in range(self.steps, self.simulation_length):
+            remaining._add(power_setpoints[t], current_power_usage[t])
+
+        return remaining.tracking_error, \
+            remaining.energy_tracking_error * (self.timescale / 60), \
+            remaining.power_tracker_violation
+
+    def get_cached(self):
+        '''Returns a copy of the cached statistics, or None if they were not computed at this step'''
+        if self.cached is None:
+            return None
+        return dict(self.cached)
+
+    def set_cached(self, stats) -> None:
+        self.cached = dict(stats)
+
+    def copy(self) -> 'RunningStatistics':
+        running_statistics = RunningStatistics(self.simulation_length, self.timescale)
+        running_statistics.steps = self.steps
+        running_statistics.tracking_error = self.tracking_error
+        running_statistics.energy_tracking_error = self.energy_tracking_error
+        running_statistics.power_tracker_violation = self.power_tracker_violation
+        return running_statistics
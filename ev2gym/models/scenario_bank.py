@@ -0,0 +1,264 @@
+'''
+This file contains the ScenarioBank class, a directory of pre-generated scenarios that EV2Gym
+reads on reset instead of spawning the EVs and generating the setpoints and the transformer data.
+
+A scenario holds the EV sessions, the power setpoints, the charge and discharge prices and the
+inflexible loads, PV generation, forecasts and demand response events of every transformer.
+Every scenario is stored in a compressed .npz file, next to a bank.json file with the dimensions of the bank.
+
+Usage:
+    python -m ev2gym.models.scenario_bank --config_file ev2gym/example_config_files/PublicPST.yaml \
+        --path ./scenario_bank/PublicPST --n_scenarios 1000
+'''
+
+import argparse
+import json
+import os
+from copy import copy, deepcopy
+
+import numpy as np
+
+from ev2gym.models.ev import EV
+from ev2gym.models.ev_registry import EVRegistry
+from ev2gym.models.transformer import TR_SCENARIO_FIELDS
+from ev2gym.utilities.loaders import load_arrival_index, load_transformers, load_electricity_prices, \
+    load_power_setpoints
+
+# Arguments of the EV constructor, stored for every EV session
+EV_FIELDS = ['id', 'location', 'battery_capacity_at_arrival', 'time_of_arrival', 'time_of_departure',
+             'desired_capacity', 'battery_capacity', 'min_battery_capacity', 'max_ac_charge_power',
+             'min_ac_charge_power', 'max_dc_charge_power', 'max_discharge_power',
+             'min_discharge_power', 'ev_phases', 'transition_soc', 'charge_efficiency',
+             'discharge_efficiency', 'timescale']
+
+EV_INT_FIELDS = ['id', 'location', 'time_of_arrival', 'time_of_departure', 'ev_phases', 'timescale']
+
+DR_FIELDS = ['event_start_step', 'event_end_step', 'capacity_percentage']
+
+BANK_DIMENSIONS = ['simulation_length', 'timescale', 'number_of_charging_stations',
+                   'number_of_ports', 'number_of_transformers']
+
+
+def _dimensions(env) -> dict:
+    return {'simulation_length': int(env.simulation_length),
+            'timescale': env.timescale,
+            'number_of_charging_stations': int(env.cs),
+            'number_of_ports': int(env.number_of_ports),
+            'number_of_transformers': int(env.number_of_transformers)}
+
+
+def _scenario_file(path, index) -> str:
+    return os.path.join(path, f'scenario_{index:06d}.npz')
+
+
+def save_scenario(env, file_name) -> None:
+    '''Saves the current episode data of an environment as a scenario'''
+
+    data = {'sim_date': np.datetime64(env.sim_starting_date, 'm'),
+            'seed': env.seed,
+            'power_setpoints': env.power_setpoints,
+            'charge_prices': env.charge_prices,
+            'discharge_prices': env.discharge_prices}
+
+    for name in EV_FIELDS:
+        data[f'ev_{name}'] = env.EVs_profiles.column(name).astype(
+            int if name in EV_INT_FIELDS else float)
+
+    for name in TR_SCENARIO_FIELDS:
+        data[f'tr_{name}'] = np.array([getattr(tr, name) for tr in env.transformers])
+
+    n_events = max([len(tr.dr_events) for tr in env.transformers] + [0])
+    for name in DR_FIELDS:
+        events = np.full((len(env.transformers), n_events), np.nan)
+        for i, tr in enumerate(env.transformers):
+            events[i, :len(tr.dr_events)] = [event[name] for event in tr.dr_events]
+        data[f'dr_{name}'] = events
+
+    np.savez_compressed(file_name, **data)
+
+
+def generate_scenario_bank(config_file, path, n_scenarios, seed=0, **kwargs) -> None:
+    '''
+    Generates n_scenarios scenarios of a config file, scenario i is generated by an environment
+    reset with seed + i, the transformers and prices are generated for the date of every scenario.
+    kwargs are passed to EV2Gym, e.g. ev_spawner="vectorized".
+    '''
+    from ev2gym.models.ev2gym_env import EV2Gym
+
+    os.makedirs(path, exist_ok=True)
+    env = EV2Gym(config_file=config_file, seed=seed, **kwargs)
+    # date of the transformer data and prices of the environment
+    data_date = env.sim_starting_date
+
+    for i in range(n_scenarios):
+        env.reset(seed=seed + i)
+
+        # reset spawns the EVs of a new date (random_day) but keeps the transformer data and prices
+        # made for the date of the constructor, they are regenerated when the date changes and the
+        # setpoints, which depend on the prices, are computed again
+        if env.sim_starting_date != data_date:
+            for tr, new_tr in zip(env.transformers, load_transformers(env)):
+                for name in TR_SCENARIO_FIELDS:
+                    setattr(tr, name, getattr(new_tr, name))
+                tr.dr_events = new_tr.dr_events
+            env.transformer_bank.new_scenario()
+            env.charge_prices, env.discharge_prices = load_electricity_prices(env)
+            env.power_setpoints = load_power_setpoints(env)
+            data_date = env.sim_starting_date
+
+        save_scenario(env, _scenario_file(path, i))
+
+    with open(os.path.join(path, 'bank.json'), 'w') as f:
+        json.dump({'config_file': config_file,
+                   'scenario': env.scenario,
+                   'seed': seed,
+                   'n_scenarios': n_scenarios,
+                   **_dimensions(env)}, f, indent=4)
+
+
+class ScenarioBank():
+    '''
+    Reads the scenarios of a bank made with generate_scenario_bank.
+
+    The scenarios are served in order, or in a new random order every pass over the bank if shuffle is True.
+    indices selects a subset of the scenarios, e.g. to make fixed training and validation splits.
+
+    Every environment iterates over its own copy of the bank, and a pass starts from the seed of the
+    environment (see start_pass), so environments with different seeds get different scenarios and
+    the scenarios of an environment are reproducible from reset(seed=...).
+    '''
+
+    def __init__(self,
+                 path,
+                 shuffle=False,
+                 seed=None,  # seed of the shuffling
+                 indices=None,  # scenarios served by the bank, default all
+                 in_memory=False,  # keep the loaded scenarios in memory
+                 ):
+
+        with open(os.path.join(path, 'bank.json'), 'r') as f:
+            self.info = json.load(f)
+
+        self.path = path
+        self.shuffle = shuffle
+        self.seed = seed
+        self.rng = np.random.default_rng(seed)
+        self.indices = np.arange(self.info['n_scenarios']) if indices is None \
+            else np.asarray(indices, dtype=int)
+        assert len(self.indices) > 0, "The scenario bank is empty"
+
+        self.in_memory = in_memory
+        self._scenarios = {}
+        self._order = []
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def check(self, env) -> None:
+        '''Checks that the scenarios fit the dimensions of an environment'''
+        dimensions = _dimensions(env)
+        for name in BANK_DIMENSIONS:
+            assert self.info[name] == dimensions[name], \
+                f"The scenario bank has {name}={self.info[name]}, the environment has {dimensions[name]}"
+
+    def copy(self) -> 'ScenarioBank':
+        '''Returns a bank with its own order over the same scenarios, the loaded scenarios are shared'''
+        bank = copy(self)
+        bank.rng = deepcopy(self.rng)
+        bank._order = list(self._order)
+        return bank
+
+    def start_pass(self, seed) -> None:
+        '''
+        Starts a new pass over the bank from seed, a shuffled bank is permuted with a generator seeded
+        with seed (and the seed of the bank), an ordered bank starts at its scenario seed % len(bank)
+        '''
+        if self.shuffle:
+            self.rng = np.random.default_rng(seed if self.seed is None else [self.seed, seed])
+            order = self.rng.permutation(self.indices)
+        else:
+            order = np.roll(self.indices, -(seed % len(self.indices)))
+        self._order = order.tolist()[::-1]
+
+    def next_index(self) -> int:
+        '''Returns the index of the next scenario, starting a new pass over the bank when needed'''
+        if len(self._order) == 0:
+            order = self.rng.permutation(self.indices) if self.shuffle else self.indices
+            self._order = order.tolist()[::-1]
+        return self._order.pop()
+
+    def get_scenario(self, index) -> dict:
+        '''Reads a scenario, the EV sessions are returned as EV profiles'''
+        if index in self._scenarios:
+            return self._scenarios[index]
+
+        with np.load(_scenario_file(self.path, index)) as data:
+            data = dict(data)
+
+        fields = {name: data[f'ev_{name}'].tolist() for name in EV_FIELDS}
+        ev_profiles = EVRegistry([EV(**dict(zip(EV_FIELDS, values)))
+                                  for values in zip(*[fields[name] for name in EV_FIELDS])])
+
+        transformers = []
+        for i in range(self.info['number_of_transformers']):
+            tr = {name: data[f'tr_{name}'][i] for name in TR_SCENARIO_FIELDS}
+            tr['dr_events'] = [dict(zip(DR_FIELDS, event))
+                               for event in zip(*[data[f'dr_{name}'][i].tolist()
+                                                  for name in DR_FIELDS])
+                               if not np.isnan(event[0])]
+            for event in tr['dr_events']:
+                event['event_start_step'] = int(event['event_start_step'])
+                event['event_end_step'] = int(event['event_end_step'])
+            transformers.append(tr)
+
+        scenario = {'index': index,
+                    'sim_date': data['sim_date'].item(),
+                    'seed': int(data['seed']),
+                    'EVs_profiles': ev_profiles,
+                    'power_setpoints': data['power_setpoints'],
+                    'charge_prices': data['charge_prices'],
+                    'discharge_prices': data['discharge_prices'],
+                    'transformers': transformers}
+
+        if self.in_memory:
+            self._scenarios[index] = scenario
+        return scenario
+
+    def load(self, env, index=None) -> None:
+        '''Sets the episode data of an environment to the next scenario, or to the scenario index'''
+        scenario = self.get_scenario(self.next_index() if index is None else index)
+
+        env.scenario_index = scenario['index']
+        env.sim_date = scenario['sim_date']
+        env.sim_starting_date = env.sim_date
+
+        env.EVs_profiles = scenario['EVs_profiles']
+        env.arrival_order, env.arrival_offsets = load_arrival_index(env)
+        env.power_setpoints = scenario['power_setpoints']
+        env.charge_prices = scenario['charge_prices']
+        env.discharge_prices = scenario['discharge_prices']
+
+        for tr, data in zip(env.transformers, scenario['transformers']):
+            for name in TR_SCENARIO_FIELDS:
+                setattr(tr, name, data[name])
+            tr.dr_events = data['dr_events']
+        env.transformer_bank.new_scenario()
+        env.transformer_bank.reset(step=0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config_file", default="ev2gym/example_config_files/PublicPST.yaml",
+                        help="Path to the config file")
+    parser.add_argument("--path", default="./scenario_bank/",
+                        help="Directory of the scenario bank")
+    parser.add_argument("--n_scenarios", default=100, type=int,
+                        help="Number of scenarios")
+    parser.add_argument("--seed", default=0, type=int,
+                        help="Seed of the first scenario")
+    parser.add_argument("--ev_spawner", default="sequential",
+                        help="EV spawner: sequential, vectorized or sparse")
+    args = parser.parse_args()
+
+    generate_scenario_bank(args.config_file, args.path, args.n_scenarios,
+                           seed=args.seed, ev_spawner=args.ev_spawner)
@@ -0,0 +1,262 @@
+'''
+This file contains the PortTelemetry class, which records the per-port traces of the simulation
+(current, current signal and energy level of the connected EVs) and the arrival intervals of the EVs,
+and the TelemetrySink class, which streams the per-step statistics of a simulation to disk.
+'''
+
+import glob
+import os
+import queue
+import threading
+
+import numpy as np
+from typing import Dict, List, Tuple
+
+
+class PortTelemetry():
+    '''
+    Per-port traces of a simulation stored in [total_ports, simulation_length] arrays,
+    port i of charging station j is stored in row cs_offsets[j] + i, only the ports that exist are stored.
+
+    Detail levels:
+        - "full": current, current signal and energy level of every port and the arrival intervals
+        - "energy": energy level of every port and the arrival intervals
+        - "arrivals": only the arrival intervals of every port
+        - "none": nothing is recorded
+    '''
+
+    DETAIL_LEVELS = ['none', 'arrivals', 'energy', 'full']
+
+    TRACES = {'none': [],
+              'arrivals': [],
+              'energy': ['energy_level'],
+              'full': ['current', 'current_signal', 'energy_level']}
+
+    def __init__(self,
+                 n_ports,  # list with the number of ports of every charging station
+                 simulation_length,
+                 detail='full',
+                 dtype=np.float16,
+                 ):
+
+        assert detail in self.DETAIL_LEVELS, \
+            f"Unknown telemetry detail level {detail}, choose one of {self.DETAIL_LEVELS}"
+
+        self.detail = detail
+        self.simulation_length = simulation_length
+
+        n_ports = np.asarray(n_ports, dtype=int)
+        self.total_ports = int(n_ports.sum())
+        self.cs_offsets = np.concatenate(([0], np.cumsum(n_ports)[:-1])).astype(int)
+
+        # Port to (charging station, port) index
+        self.port_cs = np.repeat(np.arange(len(n_ports)), n_ports)
+        self.port_index = np.arange(self.total_ports) - self.cs_offsets[self.port_cs]
+
+        self.traces = {name: np.zeros([self.total_ports, simulation_length], dtype=dtype)
+                       for name in self.TRACES[detail]}
+
+        # (arrival step, departure step) of every EV connected to each port
+        self.arrivals = [[] for _ in range(self.total_ports)] \
+            if detail != 'none' else None
+
+    def slot(self, cs_id, port) -> int:
+        '''Returns the row of port of charging station cs_id'''
+        return int(self.cs_offsets[cs_id] + port)
+
+    def has(self, name) -> bool:
+        '''Returns True if the trace is recorded at the current detail level'''
+        return name in self.traces
+
+    def record(self, name, step, slots, values) -> None:
+        '''Stores the values of a trace for the given rows at a simulation step'''
+        if name in self.traces:
+            self.traces[name][slots, step] = values
+
+    def get(self, name, cs_id, port) -> np.ndarray:
+        '''Returns the trace of a port, a zero trace if it is not recorded'''
+        if name not in self.traces:
+            return np.zeros(self.simulation_length)
+        return self.traces[name][self.slot(cs_id, port)]
+
+    def add_arrival(self, cs_id, port, arrival, departure) -> None:
+        '''Stores the arrival interval of an EV'''
+        if self.arrivals is not None:
+            self.arrivals[self.slot(cs_id, port)].append((arrival, departure))
+
+    def get_arrivals(self, cs_id, port) -> List[Tuple[int, int]]:
+        '''Returns the arrival intervals of the EVs of a port'''
+        if self.arrivals is None:
+            return []
+        return self.arrivals[self.slot(cs_id, port)]
+
+    def copy(self) -> 'PortTelemetry':
+        '''Returns an independent copy of the recorded traces'''
+        telemetry = PortTelemetry.__new__(PortTelemetry)
+        telemetry.__dict__.update(self.__dict__)
+        telemetry.traces = {name: trace.copy() for name, trace in self.traces.items()}
+        if self.arrivals is not None:
+            telemetry.arrivals = [list(intervals) for intervals in self.arrivals]
+        return telemetry
+
+
+class TelemetrySink():
+    '''
+    Streams the per-step statistics of an environment to a directory of chunk files.
+
+    The environment keeps its statistics in ring buffers of window = chunk_length * n_chunks steps.
+    Every chunk_length steps the finished chunk is written by a background thread to a .npz file
+    with one [steps, ...] array per column, so the memory does not grow with the simulation length
+    and step only waits for the disk when all the other chunks of the ring are still being written.
+
+    Files are named {prefix}_episode_{episode}_chunk_{chunk}.npz and can be read with load_telemetry.
+    '''
+
+    COLUMNS = ['current_power_usage', 'cs_power', 'cs_current', 'tr_overload',
+               'tr_inflexible_loads', 'tr_solar_power']
+
+    def __init__(self,
+                 path,  # directory of the chunk files
+                 chunk_length=96,  # steps per chunk file
+                 n_chunks=4,  # chunks kept in memory
+                 ):
+
+        assert chunk_length > 0, "chunk_length must be positive"
+        assert n_chunks >= 2, "The ring buffer needs at least 2 chunks"
+
+        self.path = path
+        self.chunk_length = chunk_length
+        self.n_chunks = n_chunks
+        self.window = chunk_length * n_chunks
+        os.makedirs(path, exist_ok=True)
+
+        self.prefix = None
+        self.episode = -1
+        self.columns = {}
+        self.simulation_length = 0
+        self.chunk = 0
+        self.start = 0  # first step of the chunk being recorded
+        self.end = 0  # last recorded step + 1
+
+        # a chunk can be overwritten only after it is written, at most n_chunks - 1 are pending
+        self._free = threading.Semaphore(n_chunks - 1)
+        self._queue = queue.Queue()
+        self._error = None
+        self.closed = False
+        self._thread = threading.Thread(target=self._write_chunks,
+                                        name='TelemetrySink',
+                                        daemon=True)
+        self._thread.start()
+
+    def start_episode(self, prefix, columns, simulation_length) -> None:
+        '''
+        Starts streaming the columns of a new episode, columns maps the column names to
+        arrays whose last axis is the step, either the whole simulation or a ring of window steps
+        '''
+        self._flush()
+        if prefix != self.prefix:
+            self.episode = 0
+        elif self.end > 0:
+            self.episode += 1
+
+        self.prefix = prefix
+        self.columns = columns
+        self.simulation_length = simulation_length
+        self.chunk = 0
+        self.start = 0
+        self.end = 0
+
+    def record(self, step) -> None:
+        '''Marks the statistics of step as complete and writes the chunk when it is full'''
+        self._raise_error()
+        self.end = step + 1
+        if self.end - self.start >= self.chunk_length or self.end >= self.simulation_length:
+            self._flush()
+
+            # the next chunk reuses the slot of an already written chunk, the traces
+            # that are only recorded for the occupied ports must start from zero
+            if self.end < self.simulation_length:
+                steps = np.arange(self.end, min(self.end + self.chunk_length,
+                                                self.simulation_length))
+                for array in self.columns.values():
+                    array[..., steps % array.shape[-1]] = 0
+
+    def _flush(self) -> None:
+        '''Sends the recorded steps of the current chunk to the writer thread'''
+        if self.end <= self.start:
+            return
+
+        self._free.acquire()
+        self._queue.put((os.path.join(self.path, f'{self.prefix}_episode_{self.episode}'
+                                                 f'_chunk_{self.chunk}.npz'),
+                         self.start, self.end, dict(self.columns)))
+        self.chunk += 1
+        self.start = self.end
+
+    def _write_chunks(self) -> None:
+        '''Writes the queued chunks, runs on the background thread'''
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                break
+
+            file_name, start, end, columns = job
+            try:
+                if self._error is None:
+                    steps = np.arange(start, end)
+                    data = {name: np.moveaxis(array[..., steps % array.shape[-1]], -1, 0)
+                            for name, array in columns.items()}
+                    data['step'] = steps
+
+                    tmp_name = file_name + '.tmp'
+                    with open(tmp_name, 'wb') as f:
+                        np.savez(f, **data)
+                    os.replace(tmp_name, file_name)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._free.release()
+                self._queue.task_done()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError(f'Writing the telemetry to {self.path} failed') from self._error
+
+    def flush(self) -> None:
+        '''Writes the recorded steps and waits until all the chunk files are on disk'''
+        self._flush()
+        self._queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        '''Writes the remaining steps and stops the writer thread'''
+        if self.closed:
+            return
+        self._flush()
+        self._queue.put(None)
+        self._thread.join()
+        self.closed = True
+        self._raise_error()
+
+
+def load_telemetry(path, prefix=None, episode=0) -> Dict[str, np.ndarray]:
+    '''
+    Reads the chunk files of an episode written by a TelemetrySink and returns one
+    [steps, ...] array per column, prefix can be omitted if the directory holds a single simulation
+    '''
+    if prefix is None:
+        prefixes = {os.path.basename(f).rsplit('_episode_', 1)[0]
+                    for f in glob.glob(os.path.join(path, '*_episode_*_chunk_*.npz'))}
+        assert len(prefixes) == 1, \
+            f"Found {len(prefixes)} simulations in {path}, please provide the prefix"
+        prefix = prefixes.pop()
+
+    files = glob.glob(os.path.join(glob.escape(path),
+                                   f'{glob.escape(prefix)}_episode_{episode}_chunk_*.npz'))
+    files.sort(key=lambda f: int(f.rsplit('_chunk_', 1)[1].split('.')[0]))
+    assert len(files) > 0, f"No telemetry found for episode {episode} of {prefix} in {path}"
+
+    chunks = [dict(np.load(f)) for f in files]
+    return {name: np.concatenate([chunk[name] for chunk in chunks])
+            for name in chunks[0]}
@@ -3,6 +3,10 @@ This file contains the Transformer class which is used to model the transformer
 '''
 import numpy as np
 
+# Transformer arrays that belong to a scenario, the demand response events are stored in dr_events
+TR_SCENARIO_FIELDS = ['inflexible_load', 'solar_power', 'inflexible_load_forecast',
+                      'pv_generation_forecast', 'max_power', 'min_power', 'max_current', 'min_current']
+
 
 class Transformer():
     """
@@ -166,10 +170,37 @@ class Transformer():
 
         return known_max_power
 
-    def get_load_pv_forecast(self, step, horizon) -> np.array:
+    def get_power_limit_windows(self, n_steps, horizon) -> np.ndarray:
+        '''
+        Returns a [n_steps, horizon] matrix whose row step is get_power_limits(step, horizon).
+
+        The limit of an event is known from event_start_step - steps_ahead to event_end_step
+        and covers the steps from max(step, event_start_step) to event_end_step,
+        later events overwrite the earlier ones.
+        '''
+        power_limit = max(self.max_power)
+        windows = np.full((n_steps, horizon), power_limit)
+
+        step = np.arange(n_steps)[:, np.newaxis]
+        absolute_step = step + np.arange(horizon)[np.newaxis, :]
+
+        for event in self.dr_events:
+            known = (step + self.steps_ahead >= event['event_start_step']) & \
+                (event['event_end_step'] >= step)
+            inside = (absolute_step >= event['event_start_step']) & \
+                (absolute_step < event['event_end_step'])
+            windows[known & inside] = power_limit - \
+                power_limit * event['capacity_percentage'] / 100
+
+        return windows
 
-        load_forecast = self.inflexible_load_forecast[step:step+horizon]
-        pv_forecast = self.pv_generation_forecast[step:step+horizon]
+    def get_load_pv_forecast(self, step, horizon) -> np.array:
+        '''
+        Returns the load and PV forecasts of the next horizon steps,
+        the first value is the actual load and PV generation of the step
+        '''
+        load_forecast = self.inflexible_load_forecast[step:step+horizon].copy()
+        pv_forecast = self.pv_generation_forecast[step:step+horizon].copy()
         
         if step < len(self.inflexible_load_forecast):                        
             load_forecast[0] = self.inflexible_load[step]
@@ -183,6 +214,29 @@ class Transformer():
 
         return load_forecast, pv_forecast
 
+    def get_load_pv_forecast_windows(self, n_steps, horizon) -> tuple:
+        '''
+        Returns two [n_steps, horizon] matrices whose rows step are get_load_pv_forecast(step, horizon),
+        or None if the forecasts of some steps are not horizon long
+        '''
+        n_forecast = len(self.inflexible_load_forecast)
+        if len(self.pv_generation_forecast) != n_forecast or \
+                len(self.inflexible_load) < n_forecast or len(self.solar_power) < n_forecast:
+            return None
+
+        windows = []
+        for forecast, actual in ((self.inflexible_load_forecast, self.inflexible_load),
+                                 (self.pv_generation_forecast, self.solar_power)):
+            # the steps after the forecast are padded like get_load_pv_forecast
+            padding = np.zeros(max(n_steps, n_forecast) + horizon - n_forecast) * forecast[-1]
+            padded = np.concatenate([forecast, padding])
+            window = np.lib.stride_tricks.sliding_window_view(padded, horizon)[:n_steps].copy()
+            n_actual = min(n_steps, n_forecast)
+            window[:n_actual, 0] = actual[:n_actual]
+            windows.append(window)
+
+        return windows[0], windows[1]
+
     def normalize_pv_generation(self, env) -> None:
         '''
         Normalize the solar_power using the configuration file and teh max_power of the transformer
@@ -0,0 +1,251 @@
+'''
+This file contains the TransformerBank class, which keeps the limits, loads and status of all the
+transformers in [number_of_transformers, simulation_length] numpy arrays, so that the transformers
+are reset, aggregated and checked for overloads with array operations at every step.
+
+While a bank is active, the Transformer objects of the environment are turned into thin views
+(BoundTransformer) that read and write their arrays and status variables from the bank,
+so state functions, reward functions, baselines and plots keep working unchanged.
+'''
+
+import uuid
+
+import numpy as np
+
+from ev2gym.models.port_state import new_unbound
+from ev2gym.models.transformer import Transformer
+
+# Transformer arrays stored in the bank, one row per transformer
+TR_ARRAYS = ['max_power', 'min_power', 'max_current', 'min_current',
+             'inflexible_load', 'solar_power']
+
+# Transformer status variables stored in the bank
+TR_FIELDS = ['current_power', 'current_amps', 'current_step']
+
+
+class TransformerBankRow:
+    '''
+    Data descriptor of a transformer array that is a row of a TransformerBank array,
+    assigning a new array copies it into the row.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return getattr(obj._bank, self.name)[obj._slot]
+
+    def __set__(self, obj, value):
+        getattr(obj._bank, self.name)[obj._slot] = value
+
+
+class TransformerBankField:
+    '''
+    Data descriptor of a transformer status variable stored in a TransformerBank array
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return getattr(obj._bank, self.name)[obj._slot].item()
+
+    def __set__(self, obj, value):
+        getattr(obj._bank, self.name)[obj._slot] = value
+
+
+class BoundTransformer(Transformer):
+    '''
+    View of a Transformer whose arrays and status variables are stored in a TransformerBank row.
+    '''
+
+    def get_power_limits(self, step, horizon) -> np.ndarray:
+        windows = self._bank.get_power_limit_windows(horizon)
+        if 0 <= step < windows.shape[1]:
+            return windows[self._slot, step]
+        return super().get_power_limits(step, horizon)
+
+    def get_load_pv_forecast(self, step, horizon) -> tuple:
+        windows = self._bank.get_load_pv_forecast_windows(horizon)
+        if windows is not None and 0 <= step < windows[0].shape[1]:
+            return windows[0][self._slot, step], windows[1][self._slot, step]
+        return super().get_load_pv_forecast(step, horizon)
+
+    def __reduce_ex__(self, protocol):
+        # pickled and copied transformers are plain Transformer objects
+        return (new_unbound, (Transformer,), self._bank.plain_state(self))
+
+
+for name in TR_ARRAYS:
+    setattr(BoundTransformer, name, TransformerBankRow(name))
+
+for name in TR_FIELDS:
+    setattr(BoundTransformer, name, TransformerBankField(name))
+
+
+class TransformerBank():
+    '''
+    Array state of all the transformers of a simulation, transformer i is stored in row i.
+
+    Methods:
+        - reset: resets the current power of all transformers to their inflexible load and solar power
+        - step: adds the power and current of the charging stations to their transformers
+        - overloaded / how_overloaded: vector versions of Transformer.is_overloaded and get_how_overloaded
+        - get_power_limit_windows / get_load_pv_forecast_windows: the power limits and forecasts
+        known at every step of the episode, computed once per scenario and horizon
+        - new_scenario: drops the windows after the limits, loads, forecasts or events are changed
+        - get_state / set_state: copies and restores the arrays of the bank
+    '''
+
+    def __init__(self, transformers, charging_stations, simulation_length):
+
+        self.transformers = transformers
+        self.simulation_length = simulation_length
+        self.n_transformers = len(transformers)
+        self.rows = np.arange(self.n_transformers)
+
+        # Charging station to transformer mapping
+        self.cs_transformer = np.array([cs.connected_transformer
+                                        for cs in charging_stations], dtype=int)
+
+        for name in TR_ARRAYS:
+            setattr(self, name, np.zeros((self.n_transformers, simulation_length)))
+        self.current_power = np.zeros(self.n_transformers)
+        self.current_amps = np.zeros(self.n_transformers)
+        self.current_step = np.zeros(self.n_transformers, dtype=int)
+
+        self.bind()
+        self.new_scenario()
+
+    def bind(self) -> None:
+        '''
+        Copies the arrays and status of the plain transformers to the bank and turns them into views of it
+        '''
+        for slot, tr in enumerate(self.transformers):
+            if tr.__class__ is BoundTransformer and tr._bank is self:
+                continue
+
+            state = {name: getattr(tr, name) for name in TR_ARRAYS + TR_FIELDS}
+            for name in TR_ARRAYS + TR_FIELDS:
+                tr.__dict__.pop(name, None)
+
+            tr.__class__ = BoundTransformer
+            tr._bank = self
+            tr._slot = slot
+            for name, value in state.items():
+                setattr(tr, name, value)
+
+    def plain_state(self, tr) -> dict:
+        '''
+        Returns the instance dictionary of a bound transformer with copies of its bank values
+        '''
+        state = {k: v for k, v in tr.__dict__.items()
+                 if k not in ('_bank', '_slot')}
+        for name in TR_ARRAYS:
+            state[name] = getattr(tr, name).copy()
+        for name in TR_FIELDS:
+            state[name] = getattr(tr, name)
+        return state
+
+    def reset(self, step) -> None:
+        '''
+        Reset the current power of all transformers
+        '''
+        self.current_step[:] = step
+        self.current_power[:] = self.inflexible_load[:, step] + \
+            self.solar_power[:, step]
+        self.current_amps[:] = (self.current_power * 1000) / 400
+
+    def step(self, cs_amps, cs_power) -> None:
+        '''
+        Adds the current and power of every charging station to its transformer,
+        in the order of the charging stations
+        '''
+        np.add.at(self.current_amps, self.cs_transformer, cs_amps)
+        np.add.at(self.current_power, self.cs_transformer, cs_power)
+
+    def overloaded(self) -> np.ndarray:
+        '''
+        Returns a boolean vector with the transformers that are overloaded
+        '''
+        e = 0.0001
+        return (self.current_power > self.max_power[self.rows, self.current_step] + e) | \
+            (self.current_power < self.min_power[self.rows, self.current_step] - e)
+
+    def how_overloaded(self) -> np.ndarray:
+        '''
+        Returns how overloaded every transformer is, 0 if it is not overloaded
+        '''
+        return np.where(self.overloaded(),
+                        np.abs(self.current_power -
+                               self.max_power[self.rows, self.current_step]),
+                        0)
+
+    def new_scenario(self) -> None:
+        '''
+        Marks the limits, loads, forecasts and events of the transformers as changed
+        '''
+        # unique across processes, as snapshots can be restored in other processes
+        self.scenario_id = uuid.uuid4().int
+        self._scenario_state = None
+        self._power_limit_windows = {}
+        self._load_pv_forecast_windows = {}
+
+    def get_power_limit_windows(self, horizon) -> np.ndarray:
+        '''
+        Returns a read-only [n_transformers, simulation_length + 1, horizon] array,
+        [i, step] is the get_power_limits(step, horizon) of transformer i
+        '''
+        if horizon not in self._power_limit_windows:
+            windows = np.stack([tr.get_power_limit_windows(self.simulation_length + 1, horizon)
+                                for tr in self.transformers])
+            windows.flags.writeable = False
+            self._power_limit_windows[horizon] = windows
+        return self._power_limit_windows[horizon]
+
+    def get_load_pv_forecast_windows(self, horizon) -> tuple:
+        '''
+        Returns two read-only [n_transformers, simulation_length + 1, horizon] arrays,
+        [i, step] is the get_load_pv_forecast(step, horizon) of transformer i,
+        or None if the forecasts of some transformer are not horizon long
+        '''
+        if horizon not in self._load_pv_forecast_windows:
+            windows = [tr.get_load_pv_forecast_windows(self.simulation_length + 1, horizon)
+                       for tr in self.transformers]
+            if any(window is None for window in windows):
+                self._load_pv_forecast_windows[horizon] = None
+            else:
+                windows = (np.stack([load for load, _ in windows]),
+                           np.stack([pv for _, pv in windows]))
+                for window in windows:
+                    window.flags.writeable = False
+                self._load_pv_forecast_windows[horizon] = windows
+        return self._load_pv_forecast_windows[horizon]
+
+    def get_state(self) -> dict:
+        '''
+        Returns copies of the arrays of the bank, the scenario arrays are copied once per scenario
+        '''
+        if self._scenario_state is None:
+            self._scenario_state = {name: getattr(self, name).copy() for name in TR_ARRAYS}
+        return {'scenario_id': self.scenario_id,
+                'scenario': self._scenario_state,
+                'status': {name: getattr(self, name).copy() for name in TR_FIELDS}}
+
+    def set_state(self, state) -> None:
+        '''
+        Restores the arrays of the bank from get_state
+        '''
+        for name, array in state['status'].items():
+            getattr(self, name)[:] = array
+
+        if state['scenario_id'] != self.scenario_id:
+            for name, array in state['scenario'].items():
+                getattr(self, name)[:] = array
+            self.new_scenario()
+            self.scenario_id = state['scenario_id']
+            self._scenario_state = state['scenario']
@@ -0,0 +1,202 @@
+'''
+This file contains the EV2GymVectorEnv class, a gymnasium VectorEnv that steps a batch of
+independent EV2Gym environments in one call.
+
+The port states of all the environments are stacked into one PortStateEngine, so the charging
+stations and EVs of the whole batch are updated with a single set of array operations.
+The observations of a port_wise StateSpec state function (e.g. the ones of ev2gym.rl_agent.state)
+are built for the whole batch by a BatchObservationBuilder, the EV features are computed once for
+the ports of all the environments and written directly into the rows of the batch.
+
+EV spawning, the statistics and the reward still run once per environment. The reward functions
+are arbitrary functions of one environment and its own statistics, and the EV profiles and
+statistics are kept per environment, since the environments can be at different steps after an
+early termination.
+'''
+
+import numpy as np
+from gymnasium.vector import VectorEnv
+from gymnasium.vector.utils import batch_space
+
+try:
+    from gymnasium.vector import AutoresetMode
+except ImportError:
+    AutoresetMode = None
+
+from ev2gym.models.ev2gym_env import EV2Gym
+from ev2gym.models.port_state import PortStateEngine
+from ev2gym.rl_agent.state_spec import BatchObservationBuilder, StateSpec
+
+
+def env_options(options, i):
+    '''
+    Returns the reset options of environment i, options["scenario_index"] is either a sequence with
+    a scenario per environment or the scenario of the first environment, the next ones get the next
+    scenarios of the bank
+    '''
+    index = (options or {}).get('scenario_index')
+    if index is None:
+        return options
+
+    index = index + i if np.ndim(index) == 0 else index[i]
+    return {**options, 'scenario_index': int(index)}
+
+
+class EV2GymVectorEnv(VectorEnv):
+    '''
+    Batch of num_envs EV2Gym environments created from the same config file.
+
+    Actions are of shape (num_envs, number_of_ports) and observations of shape (num_envs, obs_dim).
+    Environments that terminate are reset in the same step, the observation and statistics
+    of the finished episode are returned in infos["final_obs"] and infos["final_info"].
+    The seeds of the episodes of environment i after a reset without seed or an autoreset are drawn
+    from its own random generator, seeded with seed + i, so they do not depend on the other
+    environments of the batch.
+    '''
+
+    metadata = {"autoreset_mode": AutoresetMode.SAME_STEP
+                if AutoresetMode is not None else "same-step"}
+
+    def __init__(self,
+                 config_file=None,
+                 num_envs=1,
+                 seed=None,  # environment i is seeded with seed + i
+                 **kwargs,  # extra arguments of EV2Gym
+                 ):
+
+        assert num_envs > 0, "num_envs must be positive"
+        # the compiled engine is kept, any other engine is replaced by the vectorized one
+        if kwargs.get('engine') != "compiled":
+            kwargs['engine'] = "vectorized"
+
+        self.num_envs = num_envs
+        self.envs = [EV2Gym(config_file=config_file,
+                            seed=None if seed is None else seed + i,
+                            **kwargs)
+                     for i in range(num_envs)]
+
+        n_ports = self.envs[0].number_of_ports
+        assert all(env.number_of_ports == n_ports for env in self.envs), \
+            "All the environments must have the same number of ports"
+
+        self.single_action_space = self.envs[0].action_space
+        self.single_observation_space = self.envs[0].observation_space
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+        self.render_mode = self.envs[0].render_mode
+
+        # One engine for the ports of all environments
+        self.port_state = PortStateEngine.stack([env.port_state for env in self.envs])
+
+        # observations of StateSpec state functions are built for the whole batch
+        state_function = self.envs[0].state_function
+        self._observation_builder = BatchObservationBuilder(self.envs, self.port_state, state_function) \
+            if isinstance(state_function, StateSpec) else None
+
+        self._seed_rngs = self._seed_generators(seed)
+        self._observations = np.zeros(self.observation_space.shape,
+                                      dtype=self.single_observation_space.dtype)
+        self._rewards = np.zeros(num_envs)
+        self._terminations = np.zeros(num_envs, dtype=bool)
+        self._truncations = np.zeros(num_envs, dtype=bool)
+
+    def reset(self, seed=None, options=None):
+        '''
+        Resets all the environments, environment i is seeded with seed + i,
+        see env_options for the scenario_index option
+        '''
+
+        if seed is not None:
+            self._seed_rngs = self._seed_generators(seed)
+
+        infos = {}
+        for i, env in enumerate(self.envs):
+            env_seed = self._next_seed(i) if seed is None else seed + i
+            self._observations[i], env_info = env.reset(seed=env_seed,
+                                                        options=env_options(options, i))
+            infos = self._add_info(infos, env_info, i)
+
+        self._terminations[:] = False
+        self._truncations[:] = False
+
+        return self._observations.copy(), infos
+
+    def step(self, actions):
+        '''
+        Steps all the environments with a (num_envs, number_of_ports) array of actions
+
+        Returns:
+            - observations: (num_envs, obs_dim) array
+            - rewards, terminations, truncations: (num_envs,) arrays
+            - infos: the batched infos of the environments
+        '''
+        if not isinstance(actions, np.ndarray) or actions.dtype != float:
+            actions = np.array(actions, dtype=float)
+        assert actions.shape == self.action_space.shape, \
+            f"Actions must be of shape {self.action_space.shape}"
+
+        for env in self.envs:
+            env._begin_step()
+
+        cs_start = self.port_state.cs_start
+        port_start = self.port_state.port_start
+
+        prices = [env._port_state_prices() for env in self.envs]
+        departing = [env.port_state.pop_departures(env.current_step) for env in self.envs]
+        profit, empty = self.port_state.step_ports(
+            actions.reshape(-1),
+            np.concatenate([charge for charge, _ in prices]),
+            np.concatenate([discharge for _, discharge in prices]),
+            np.concatenate([slots + port_start[i] for i, slots in enumerate(departing)]))
+
+        batched = self._observation_builder is not None
+        env_infos = []
+        for i, env in enumerate(self.envs):
+            ports = slice(port_start[i], port_start[i+1])
+
+            user_satisfaction_list, departing_evs = env.port_state.release(departing[i])
+            env._aggregate_port_state(user_satisfaction_list)
+
+            # the observation is written directly to the row of the environment
+            _, self._rewards[i], self._terminations[i], self._truncations[i], env_info = \
+                env._finish_step(float(profit[cs_start[i]:cs_start[i+1]].sum()),
+                                 user_satisfaction_list,
+                                 int(empty[ports].sum()),
+                                 departing_evs,
+                                 out=self._observations[i],
+                                 observe=not batched)
+            env_infos.append(env_info)
+
+        if batched:
+            self._observation_builder.build(self._observations)
+
+        infos = {}
+        for i, env in enumerate(self.envs):
+            env_info = env_infos[i]
+            if self._terminations[i] or self._truncations[i]:
+                infos = self._add_info(infos,
+                                       {"final_obs": self._observations[i].copy(),
+                                        "final_info": env_info},
+                                       i)
+                self._observations[i], env_info = env.reset(seed=self._next_seed(i))
+
+            infos = self._add_info(infos, env_info, i)
+
+        return self._observations.copy(), self._rewards.copy(), \
+            self._terminations.copy(), self._truncations.copy(), infos
+
+    def _seed_generators(self, seed):
+        '''Returns the random generators of the episode seeds, seeded with seed + i'''
+        return [np.random.default_rng(None if seed is None else seed + i)
+                for i in range(self.num_envs)]
+
+    def _next_seed(self, i):
+        '''Draws the seed of the next episode of environment i'''
+        return int(self._seed_rngs[i].integers(0, 1000000))
+
+    def render(self):
+        return tuple(env.render() for env in self.envs)
+
+    def close_extras(self, **kwargs):
+        for env in self.envs:
+            env.close()
@@ -0,0 +1,307 @@
+'''
+This file contains the StateSpec class, a state function declared as a list of features, and the
+ObservationBuilder class, which writes the observation of a StateSpec into a preallocated buffer.
+
+An observation made from a spec has the layout of the example state functions:
+    - the global features, in order
+    - for every transformer, its transformer features followed by the EV features of the ports of
+      the charging stations connected to it (in the order of env.charging_stations), zeros for empty ports
+
+Example:
+    my_state = StateSpec(name='my_state',
+                         features=[lambda env: env.current_step],
+                         ev_features=[lambda env, ports: ports.soc])
+
+    my_state(env) returns the observation, and it can be passed as the state_function of EV2Gym.
+
+The EV features are computed for all the ports at once from the arrays of a PortArrays object,
+which reads the PortStateEngine arrays when the environment uses the vectorized engine.
+The EV features of a port_wise spec are computed once for all the environments of an
+EV2GymVectorEnv by a BatchObservationBuilder.
+'''
+
+import sys
+
+import numpy as np
+
+from ev2gym.models.port_state import EV_FIELDS, EV_PARAMETERS
+
+
+class StateSpec():
+    '''
+    State function made of the features:
+        - features: functions f(env) returning a scalar or a fixed size vector
+        - transformer_features: functions f(env, tr) returning a fixed size vector
+        - ev_features: functions f(env, ports) returning a vector with a value for every port
+        - port_wise: True if the value of every port of the EV features only depends on the same
+          port and on scalar attributes of env (e.g. env.current_step), so that they can be
+          computed for the ports of several environments at once
+
+    Calling a StateSpec with an environment returns its observation, built with the
+    ObservationBuilder kept in the environment (see observation_builder).
+    Like functions, a StateSpec is pickled by reference, so it must be assigned to its name in
+    the module where it is created.
+    '''
+
+    def __init__(self,
+                 name,  # name of the state function, e.g. used in the names of the runs
+                 features=(),
+                 transformer_features=(),
+                 ev_features=(),
+                 port_wise=False,
+                 doc=None,  # description of the observation
+                 ):
+        self.__name__ = self.__qualname__ = name
+        self.__doc__ = doc
+        self.__module__ = sys._getframe(1).f_globals.get('__name__', '__main__')
+        self.features = list(features)
+        self.transformer_features = list(transformer_features)
+        self.ev_features = list(ev_features)
+        self.port_wise = port_wise
+
+    def __call__(self, env, *args) -> np.ndarray:
+        return observation_builder(env, self).build().copy()
+
+    def __reduce__(self):
+        return self.__qualname__
+
+    def __repr__(self):
+        return f'StateSpec({self.__name__})'
+
+
+def observation_builder(env, spec) -> 'ObservationBuilder':
+    '''
+    Returns the ObservationBuilder of spec for env, the builder is kept in the environment
+    '''
+    builder = env.__dict__.get('_observation_builder')
+    if builder is None or builder.spec is not spec:
+        builder = ObservationBuilder(env, spec)
+        env._observation_builder = builder
+    return builder
+
+
+class PortArrays():
+    '''
+    Per-port values of the connected EVs in the order of the ports of the environment,
+    the values of the empty ports are undefined and masked by the ObservationBuilder.
+
+    Attributes:
+        - occupied: True for the ports with an EV connected
+        - soc: the SoC of the connected EVs
+        - any EV attribute, e.g. time_of_departure or total_energy_exchanged
+    The arrays are computed on first use and kept until the next step.
+    '''
+
+    def __init__(self, env):
+        self._env = env
+        self._slots = [(cs, port) for cs in env.charging_stations
+                       for port in range(cs.n_ports)]
+        self._values = {}
+
+    def clear(self) -> None:
+        self._values = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        if name not in self._values:
+            self._values[name] = self._compute(name)
+        return self._values[name]
+
+    def _engine(self):
+        return self._env.port_state
+
+    def _compute(self, name) -> np.ndarray:
+        engine = self._engine()
+
+        if name == 'occupied':
+            if engine is not None:
+                return engine.occupied
+            return np.array([cs.evs_connected[port] is not None
+                             for cs, port in self._slots], dtype=bool)
+
+        if name == 'soc':
+            return self.current_capacity / np.where(self.occupied, self.battery_capacity, 1)
+
+        if engine is not None and (name in EV_FIELDS or name in EV_PARAMETERS):
+            return getattr(engine, EV_FIELDS.get(name, name))
+
+        return self._ev_values(name)
+
+    def _ev_values(self, name) -> np.ndarray:
+        '''Reads an attribute of the connected EV objects'''
+        engine = self._engine()
+        values = np.zeros(len(self._slots))
+        evs = engine.evs if engine is not None else \
+            [cs.evs_connected[port] for cs, port in self._slots]
+        for slot in np.flatnonzero(self.occupied):
+            values[slot] = getattr(evs[slot], name)
+        return values
+
+
+class BatchPortArrays(PortArrays):
+    '''
+    PortArrays of the ports of all the environments of a stacked PortStateEngine
+    '''
+
+    def __init__(self, envs, engine):
+        self._envs = envs
+        self._batch_engine = engine
+        self._values = {}
+
+    def _engine(self):
+        return self._batch_engine
+
+    def _ev_values(self, name) -> np.ndarray:
+        return np.concatenate([PortArrays(env)._ev_values(name) for env in self._envs])
+
+
+class PortEnv():
+    '''
+    Scalar attributes of the environments of a batch repeated for each of their ports,
+    e.g. env.current_step is an array with the current step of the environment of every port
+    '''
+
+    def __init__(self, envs, n_ports):
+        self._envs = envs
+        self._n_ports = n_ports
+        self._values = {}
+
+    def clear(self) -> None:
+        self._values = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        if name not in self._values:
+            values = np.array([getattr(env, name) for env in self._envs])
+            if values.ndim != 1:
+                raise AttributeError(
+                    f"env.{name} is not a scalar, it can not be used by a port_wise StateSpec")
+            self._values[name] = np.repeat(values, self._n_ports)
+        return self._values[name]
+
+
+class ObservationBuilder():
+    '''
+    Writes the observations of a StateSpec into a preallocated buffer.
+
+    The positions of all the features in the buffer and the transformer ordered permutation of the
+    ports are computed once, as the topology of the environment does not change.
+    '''
+
+    def __init__(self, env, spec):
+        self.env = env
+        self.spec = spec
+        self.ports = PortArrays(env)
+
+        offset = 0
+        self.features = []
+        for feature in spec.features:
+            size = np.size(feature(env))
+            self.features.append((feature, offset, offset + size))
+            offset += size
+
+        # ports of every charging station in the order of the environment
+        port_start = np.cumsum([0] + [cs.n_ports for cs in env.charging_stations])
+
+        n_ev_features = len(spec.ev_features)
+        self.transformer_features = []
+        port_order = []
+        ev_positions = []
+        for tr in env.transformers:
+            for feature in spec.transformer_features:
+                size = np.size(feature(env, tr))
+                self.transformer_features.append((feature, tr, offset, offset + size))
+                offset += size
+
+            for j, cs in enumerate(env.charging_stations):
+                if cs.connected_transformer == tr.id:
+                    for port in range(cs.n_ports):
+                        port_order.append(port_start[j] + port)
+                        ev_positions.append(np.arange(offset, offset + n_ev_features))
+                        offset += n_ev_features
+
+        # the EV features of port_order[i] are written to ev_positions[i]
+        self.port_order = np.array(port_order, dtype=int)
+        self.ev_positions = np.array(ev_positions, dtype=int).reshape(
+            len(port_order), n_ev_features)
+
+        self.buffer = np.zeros(offset)
+        self.ev_values = np.zeros((len(port_start) and port_start[-1], n_ev_features))
+
+    def build(self, out=None) -> np.ndarray:
+        '''
+        Writes the observation of the current step in out (by default the buffer of the builder)
+        and returns it
+        '''
+        buffer = self.buffer if out is None else out
+        self.build_features(buffer)
+
+        if len(self.spec.ev_features) > 0:
+            self.ports.clear()
+            occupied = self.ports.occupied
+            for i, feature in enumerate(self.spec.ev_features):
+                self.ev_values[:, i] = np.where(occupied, feature(self.env, self.ports), 0)
+            buffer[self.ev_positions] = self.ev_values[self.port_order]
+
+        return buffer
+
+    def build_features(self, buffer) -> None:
+        '''Writes the global and transformer features of the current step in buffer'''
+        env = self.env
+
+        for feature, start, end in self.features:
+            buffer[start:end] = feature(env)
+
+        for feature, tr, start, end in self.transformer_features:
+            buffer[start:end] = feature(env, tr)
+
+
+class BatchObservationBuilder():
+    '''
+    Writes the observations of a StateSpec for all the environments of an EV2GymVectorEnv, one row
+    per environment. The global and transformer features are written by the ObservationBuilder of
+    every environment, and the EV features of a port_wise spec are computed once for the ports of
+    all the environments from the stacked PortStateEngine.
+    '''
+
+    def __init__(self, envs, engine, spec):
+        self.envs = envs
+        self.spec = spec
+        self.builders = [observation_builder(env, spec) for env in envs]
+        self.batched = spec.port_wise and len(spec.ev_features) > 0
+
+        if self.batched:
+            self.ports = BatchPortArrays(envs, engine)
+            self.port_env = PortEnv(envs, np.diff(engine.port_start))
+            self.ev_values = np.zeros((engine.n_ports, len(spec.ev_features)))
+
+            # the EV features of port ports[k] are written to row rows[k], columns positions[k]
+            port_start = engine.port_start
+            self.rows = np.concatenate([np.full(len(builder.port_order), i)
+                                        for i, builder in enumerate(self.builders)])[:, None]
+            self.ports_order = np.concatenate([builder.port_order + port_start[i]
+                                               for i, builder in enumerate(self.builders)])
+            self.positions = np.concatenate([builder.ev_positions for builder in self.builders])
+
+    def build(self, out) -> np.ndarray:
+        '''Writes the observations of the current step in the rows of out and returns it'''
+        if not self.batched:
+            for i, builder in enumerate(self.builders):
+                builder.build(out=out[i])
+            return out
+
+        for i, builder in enumerate(self.builders):
+            builder.build_features(out[i])
+
+        self.ports.clear()
+        self.port_env.clear()
+        occupied = self.ports.occupied
+        for i, feature in enumerate(self.spec.ev_features):
+            self.ev_values[:, i] = np.where(occupied, feature(self.port_env, self.ports), 0)
+        out[self.rows, self.positions] = self.ev_values[self.ports_order]
+
+        return out
@@ -0,0 +1,191 @@
+'''
+This file contains the process-wide cache of the static datasets used by the loaders.
+
+Every file is parsed once per process and the series derived from it for the timescale of a
+simulation are memoised in LRU caches of DATASET_CACHE_SIZE entries. The numpy arrays of the cache
+are read-only and shared by all the environments of a process, the data frames and dictionaries
+kept as attributes of an environment are copies made with private_copy, so changing them does not
+change the cache. Worker processes forked after an environment is created inherit the parsed datasets.
+'''
+
+import functools
+import json
+
+import numpy as np
+import pandas as pd
+import pkg_resources
+
+DATASET_CACHE_SIZE = 16
+
+
+def _data_file(name) -> str:
+    return pkg_resources.resource_filename('ev2gym', f'data/{name}')
+
+
+def _read_only(array) -> np.ndarray:
+    array.flags.writeable = False
+    return array
+
+
+def private_copy(value):
+    '''
+    Returns a copy of a cached dataset that can be modified without changing the cache,
+    the read-only numpy arrays are shared
+    '''
+    if isinstance(value, dict):
+        return {key: private_copy(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [private_copy(item) for item in value]
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    if isinstance(value, np.ndarray) and value.flags.writeable:
+        return value.copy()
+    return value
+
+
+@functools.lru_cache(maxsize=1)
+def ev_spawn_datasets() -> dict:
+    '''Returns the distributions used by the EV spawner, keyed by the name of the env attribute'''
+
+    datasets = {
+        'df_arrival_week': pd.read_csv(_data_file('distribution-of-arrival.csv')),  # weekdays
+        'df_arrival_weekend': pd.read_csv(_data_file('distribution-of-arrival-weekend.csv')),  # weekends
+        'df_connection_time': pd.read_csv(_data_file('distribution-of-connection-time.csv')),  # connection time
+        'df_energy_demand': pd.read_csv(_data_file('distribution-of-energy-demand.csv')),  # energy demand
+        'time_of_connection_vs_hour': _read_only(
+            np.load(_data_file('time_of_connection_vs_hour.npy'))),  # time of connection vs hour
+    }
+
+    # energy demand per arrival, replace column work with workplace
+    df_req_energy = pd.read_csv(_data_file('mean-demand-per-arrival.csv'))
+    df_req_energy = df_req_energy.rename(columns={'work': 'workplace',
+                                                  'home': 'private'})
+    datasets['df_req_energy'] = df_req_energy.fillna(0)
+
+    # time of stay vs arrival
+    df_time_of_stay_vs_arrival = pd.read_csv(_data_file('mean-session-length-per.csv'))
+    df_time_of_stay_vs_arrival = df_time_of_stay_vs_arrival.fillna(0)
+    datasets['df_time_of_stay_vs_arrival'] = df_time_of_stay_vs_arrival.rename(columns={'work': 'workplace',
+                                                                                        'home': 'private'})
+
+    datasets['spawn_tables'] = _spawn_tables(datasets)
+    return datasets
+
+
+def _half_hour_table(df, column) -> np.ndarray:
+    '''Returns the values of a column indexed by the half hour of the "Arrival Time" column, NaN if missing'''
+    table = np.full(48, np.nan)
+    # reversed, so the first row of every half hour is kept
+    for arrival_time, value in zip(df['Arrival Time'].values[::-1], df[column].values[::-1]):
+        hour, minute = arrival_time.split(':')
+        if int(minute) in [0, 30]:
+            table[int(hour)*2 + int(minute)//30] = value
+    return _read_only(table)
+
+
+def _spawn_tables(datasets) -> dict:
+    '''
+    Returns the lookup tables of the vectorized EV spawner for every scenario:
+        - tau_week, tau_weekend: arrival rates of every 15 minute interval of the day
+        - required_energy_mean, time_of_stay_mean: means of every 30 minute interval of the day
+    '''
+    tables = {}
+    for scenario in datasets['df_arrival_week'].columns[1:]:
+        tables[scenario] = {
+            'tau_week': _read_only(datasets['df_arrival_week'][scenario].to_numpy(dtype=float)),
+            'tau_weekend': _read_only(datasets['df_arrival_weekend'][scenario].to_numpy(dtype=float)
+                                      if scenario in datasets['df_arrival_weekend']
+                                      else np.full(len(datasets['df_arrival_weekend']), np.nan)),
+            'required_energy_mean': _half_hour_table(datasets['df_req_energy'], scenario),
+            'time_of_stay_mean': _half_hour_table(datasets['df_time_of_stay_vs_arrival'], scenario),
+        }
+    return tables
+
+
+@functools.lru_cache(maxsize=1)
+def ev_specs_dataset() -> dict:
+    '''Returns the EV specs and the normalized registrations of every EV model'''
+
+    with open(_data_file('ev_specs.json')) as f:
+        ev_specs = json.load(f)
+
+    registrations = np.zeros(len(ev_specs.keys()))
+    for i, ev_name in enumerate(ev_specs.keys()):
+        # sum the total number of registrations
+        registrations[i] = ev_specs[ev_name]['number_of_registrations_2023_nl']
+
+    return {'ev_specs': ev_specs,
+            'normalized_ev_registrations': _read_only(registrations/registrations.sum())}
+
+
+def _resample(data, dataset_timescale, desired_timescale) -> pd.DataFrame:
+    '''Resamples a dataset to the timescale of the simulation'''
+
+    if desired_timescale > dataset_timescale:
+        data = data.groupby(
+            data.index // (desired_timescale/dataset_timescale)).max()
+    elif desired_timescale < dataset_timescale:
+        # extend the dataset to data.shape[0] * (dataset_timescale/desired_timescale)
+        # by repeating the data every (dataset_timescale/desired_timescale) rows
+        data = data.loc[data.index.repeat(
+            dataset_timescale/desired_timescale)].reset_index(drop=True)
+    return data
+
+
+def _dates(dataset_starting_date, periods, timescale) -> np.ndarray:
+    return _read_only(pd.date_range(start=dataset_starting_date, periods=periods,
+                                    freq=f'{timescale}min').values)
+
+
+@functools.lru_cache(maxsize=1)
+def _residential_loads_file() -> pd.DataFrame:
+    return pd.read_csv(_data_file('residential_loads.csv'), header=None)
+
+
+@functools.lru_cache(maxsize=DATASET_CACHE_SIZE)
+def residential_loads_dataset(desired_timescale):
+    '''
+    Returns the two years of household loads (starting at 2022-01-01) resampled to the timescale
+    and the date of every row
+    '''
+    data = _resample(_residential_loads_file(), 15, desired_timescale)
+
+    # duplicate the data to have two years of data
+    data = pd.concat([data, data], ignore_index=True)
+
+    return data, _dates('2022-01-01 00:00:00', data.shape[0], desired_timescale)
+
+
+@functools.lru_cache(maxsize=1)
+def _pv_generation_file() -> pd.DataFrame:
+    data = pd.read_csv(_data_file('pv_netherlands.csv'), sep=',', header=0)
+    return data.drop(['time', 'local_time'], axis=1)
+
+
+@functools.lru_cache(maxsize=DATASET_CACHE_SIZE)
+def pv_generation_dataset(desired_timescale):
+    '''
+    Returns two years of smoothed PV generation (starting at 2019-01-01) resampled to the timescale
+    and the date of every step
+    '''
+    data = _resample(_pv_generation_file(), 60, desired_timescale)
+
+    # smooth data by taking the mean of every 5 rows
+    electricity = data['electricity'].rolling(
+        window=60//desired_timescale, min_periods=1).mean()
+    # use other type of smoothing
+    electricity = electricity.ewm(
+        span=60//desired_timescale, adjust=True).mean().to_numpy()
+
+    # duplicate the data to have two years of data
+    electricity = np.concatenate([electricity, electricity])
+
+    return _read_only(electricity), \
+        _dates('2019-01-01 00:00:00', len(electricity), desired_timescale)
+
+
+def clear_dataset_cache() -> None:
+    '''Drops all the cached datasets, e.g. after the data files are changed'''
+    for cached in [ev_spawn_datasets, ev_specs_dataset, _residential_loads_file,
+                   residential_loads_dataset, _pv_generation_file, pv_generation_dataset]:
+        cached.cache_clear()
@@ -3,74 +3,33 @@ This file contains the loaders for the EV City environment.
 '''
 
 import numpy as np
-import pandas as pd
 import math
 import datetime
 import pkg_resources
-import json
 from typing import List, Tuple
 
 from ev2gym.models.ev_charger import EV_Charger
-from ev2gym.models.ev import EV
+from ev2gym.models.ev_registry import EVRegistry
 from ev2gym.models.transformer import Transformer
 
-from ev2gym.utilities.utils import EV_spawner, generate_power_setpoints
+from ev2gym.utilities.utils import EV_spawner, EV_spawner_vectorized, EV_spawner_sparse, \
+    generate_power_setpoints
+from ev2gym.utilities.price_store import load_price_store
+from ev2gym.utilities.datasets import ev_spawn_datasets, ev_specs_dataset, residential_loads_dataset, \
+    pv_generation_dataset, private_copy
 
 
 def load_ev_spawn_scenarios(env) -> None:
-    '''Loads the EV spawn scenarios of the simulation'''
-
-    df_arrival_week_file = pkg_resources.resource_filename(
-        'ev2gym', 'data/distribution-of-arrival.csv')
-    df_arrival_weekend_file = pkg_resources.resource_filename(
-        'ev2gym', 'data/distribution-of-arrival-weekend.csv')
-    df_connection_time_file = pkg_resources.resource_filename(
-        'ev2gym', 'data/distribution-of-connection-time.csv')
-    df_energy_demand_file = pkg_resources.resource_filename(
-        'ev2gym', 'data/distribution-of-energy-demand.csv')
-    time_of_connection_vs_hour_file = pkg_resources.resource_filename(
-        'ev2gym', 'data/time_of_connection_vs_hour.npy')
-
-    df_req_energy_file = pkg_resources.resource_filename(
-        'ev2gym', 'data/mean-demand-per-arrival.csv')
-    df_time_of_stay_vs_arrival_file = pkg_resources.resource_filename(
-        'ev2gym', 'data/mean-session-length-per.csv')
-
-    ev_specs_file = pkg_resources.resource_filename(
-        'ev2gym', 'data/ev_specs.json')
-
-    env.df_arrival_week = pd.read_csv(df_arrival_week_file)  # weekdays
-    env.df_arrival_weekend = pd.read_csv(df_arrival_weekend_file)  # weekends
-    env.df_connection_time = pd.read_csv(
-        df_connection_time_file)  # connection time
-    env.df_energy_demand = pd.read_csv(df_energy_demand_file)  # energy demand
-    env.time_of_connection_vs_hour = np.load(
-        time_of_connection_vs_hour_file)  # time of connection vs hour
-
-    env.df_req_energy = pd.read_csv(
-        df_req_energy_file)  # energy demand per arrival
-    # replace column work with workplace
-    env.df_req_energy = env.df_req_energy.rename(columns={'work': 'workplace',
-                                                          'home': 'private'})
-    env.df_req_energy = env.df_req_energy.fillna(0)
-
-    env.df_time_of_stay_vs_arrival = pd.read_csv(
-        df_time_of_stay_vs_arrival_file)  # time of stay vs arrival
-    env.df_time_of_stay_vs_arrival = env.df_time_of_stay_vs_arrival.fillna(0)
-    env.df_time_of_stay_vs_arrival = env.df_time_of_stay_vs_arrival.rename(columns={'work': 'workplace',
-                                                                                    'home': 'private'})
+    '''
+    Loads the EV spawn scenarios of the simulation, the files are parsed once per process and every
+    environment gets its own copy of the data frames and dictionaries
+    '''
+
+    env.__dict__.update(private_copy(ev_spawn_datasets()))
 
     # Load the EV specs
     if env.config['heterogeneous_ev_specs']:
-        with open(ev_specs_file) as f:
-            env.ev_specs = json.load(f)
-
-        registrations = np.zeros(len(env.ev_specs.keys()))
-        for i, ev_name in enumerate(env.ev_specs.keys()):
-            # sum the total number of registrations
-            registrations[i] = env.ev_specs[ev_name]['number_of_registrations_2023_nl']
-
-        env.normalized_ev_registrations = registrations/registrations.sum()
+        env.__dict__.update(private_copy(ev_specs_dataset()))
 
 
 def load_power_setpoints(env) -> np.ndarray:
@@ -90,55 +49,26 @@ def generate_residential_inflexible_loads(env) -> np.ndarray:
     in the simulation.
     '''
 
-    # Load the data
-    data_path = pkg_resources.resource_filename(
-        'ev2gym', 'data/residential_loads.csv')
-    data = pd.read_csv(data_path, header=None)
+    data, dates = residential_loads_dataset(env.timescale)
 
-    desired_timescale = env.timescale
     simulation_length = env.simulation_length
     simulation_date = env.sim_starting_date.strftime('%Y-%m-%d %H:%M:%S')
     number_of_transformers = env.number_of_transformers
 
-    dataset_timescale = 15
-    dataset_starting_date = '2022-01-01 00:00:00'
-
-    if desired_timescale > dataset_timescale:
-        data = data.groupby(
-            data.index // (desired_timescale/dataset_timescale)).max()
-    elif desired_timescale < dataset_timescale:
-        # extend the dataset to data.shape[0] * (dataset_timescale/desired_timescale)
-        # by repeating the data every (dataset_timescale/desired_timescale) rows
-        data = data.loc[data.index.repeat(
-            dataset_timescale/desired_timescale)].reset_index(drop=True)
-
-    # duplicate the data to have two years of data
-    data = pd.concat([data, data], ignore_index=True)
-
-    # add a date column to the dataframe
-    data['date'] = pd.date_range(
-        start=dataset_starting_date, periods=data.shape[0], freq=f'{desired_timescale}min')
-
-    # find year of the data
-    year = int(dataset_starting_date.split('-')[0])
     # replace the year of the simulation date with the year of the data
+    year = 2022
     simulation_date = f'{year}-{simulation_date.split("-")[1]}-{simulation_date.split("-")[2]}'
 
-    simulation_index = data[data['date'] == simulation_date].index[0]
+    simulation_index = np.flatnonzero(dates == np.datetime64(simulation_date))[0]
 
     # select the data for the simulation date
-    data = data[simulation_index:simulation_index+simulation_length]
-
-    # drop the date column
-    data = data.drop(columns=['date'])
-    new_data = pd.DataFrame()
+    data = data.iloc[simulation_index:simulation_index+simulation_length]
 
-    for i in range(number_of_transformers):
-        new_data['tr_'+str(i)] = data.sample(10, axis=1,
-                                             random_state=env.tr_seed).sum(axis=1)
+    # the households are sampled with random_state=tr_seed, so every transformer gets the same ones
+    loads = data.sample(10, axis=1,
+                        random_state=env.tr_seed).sum(axis=1).to_numpy()
 
-    # return the "tr_" columns
-    return new_data.to_numpy().T
+    return np.tile(loads, (number_of_transformers, 1))
 
 
 def generate_pv_generation(env) -> np.ndarray:
@@ -147,62 +77,23 @@ def generate_pv_generation(env) -> np.ndarray:
     and then adding minor variations to the data
     '''
 
-    # Load the data
-    data_path = pkg_resources.resource_filename(
-        'ev2gym', 'data/pv_netherlands.csv')
-    data = pd.read_csv(data_path, sep=',', header=0)
-    data.drop(['time', 'local_time'], inplace=True, axis=1)
+    electricity, dates = pv_generation_dataset(env.timescale)
 
-    desired_timescale = env.timescale
     simulation_length = env.simulation_length
     simulation_date = env.sim_starting_date.strftime('%Y-%m-%d %H:%M:%S')
     number_of_transformers = env.number_of_transformers
 
-    dataset_timescale = 60
-    dataset_starting_date = '2019-01-01 00:00:00'
-
-    if desired_timescale > dataset_timescale:
-        data = data.groupby(
-            data.index // (desired_timescale/dataset_timescale)).max()
-    elif desired_timescale < dataset_timescale:
-        # extend the dataset to data.shape[0] * (dataset_timescale/desired_timescale)
-        # by repeating the data every (dataset_timescale/desired_timescale) rows
-        data = data.loc[data.index.repeat(
-            dataset_timescale/desired_timescale)].reset_index(drop=True)
-        # data = data/ (dataset_timescale/desired_timescale)
-
-    # smooth data by taking the mean of every 5 rows
-    data['electricity'] = data['electricity'].rolling(
-        window=60//desired_timescale, min_periods=1).mean()
-    # use other type of smoothing
-    data['electricity'] = data['electricity'].ewm(
-        span=60//desired_timescale, adjust=True).mean()
-
-    # duplicate the data to have two years of data
-    data = pd.concat([data, data], ignore_index=True)
-
-    # add a date column to the dataframe
-    data['date'] = pd.date_range(
-        start=dataset_starting_date, periods=data.shape[0], freq=f'{desired_timescale}min')
-
-    # find year of the data
-    year = int(dataset_starting_date.split('-')[0])
     # replace the year of the simulation date with the year of the data
+    year = 2019
     simulation_date = f'{year}-{simulation_date.split("-")[1]}-{simulation_date.split("-")[2]}'
 
-    simulation_index = data[data['date'] == simulation_date].index[0]
+    simulation_index = np.flatnonzero(dates == np.datetime64(simulation_date))[0]
 
     # select the data for the simulation date
-    data = data[simulation_index:simulation_index+simulation_length]
+    electricity = electricity[simulation_index:simulation_index+simulation_length]
 
-    # drop the date column
-    data = data.drop(columns=['date'])
-    new_data = pd.DataFrame()
-
-    for i in range(number_of_transformers):
-        new_data['tr_'+str(i)] = data * env.tr_rng.uniform(0.9, 1.1)
-
-    return new_data.to_numpy().T
+    return np.array([electricity * env.tr_rng.uniform(0.9, 1.1)
+                     for _ in range(number_of_transformers)])
 
 
 def load_transformers(env) -> List[Transformer]:
@@ -346,22 +237,42 @@ def load_ev_charger_profiles(env) -> List[EV_Charger]:
         return charging_stations
 
 
-def load_ev_profiles(env) -> List[EV]:
+def load_ev_profiles(env) -> EVRegistry:
     '''Loads the EV profiles of the simulation
     If load_from_replay_path is None, then the EV profiles are created randomly
 
     Returns:
-        - ev_profiles: a list of ev_profile objects'''
+        - ev_profiles: an EVRegistry with the ev_profile of every session'''
 
     if env.load_from_replay_path is None:
         
-        ev_profiles = EV_spawner(env)
+        spawner = {"sequential": EV_spawner,
+                   "vectorized": EV_spawner_vectorized,
+                   "sparse": EV_spawner_sparse}[env.ev_spawner]
+
+        ev_profiles = spawner(env)
         while len(ev_profiles) == 0:
-            ev_profiles = EV_spawner(env)
+            ev_profiles = spawner(env)
             
-        return ev_profiles
+        return EVRegistry(ev_profiles)
     else:
-        return env.replay.EVs
+        return EVRegistry(env.replay.EVs)
+
+
+def load_arrival_index(env) -> Tuple[np.ndarray, np.ndarray]:
+    '''Builds the arrival index of the EV profiles of the simulation
+
+    Returns:
+        - arrival_order: the indexes of the EV profiles sorted by time of arrival
+        - arrival_offsets: a vector of size simulation length + 2, the EV profiles arriving at step t are
+        arrival_order[arrival_offsets[t]:arrival_offsets[t+1]]'''
+
+    arrivals = np.asarray(env.EVs_profiles.column('time_of_arrival'), dtype=int)
+    arrival_order = np.argsort(arrivals, kind='stable')
+    arrival_offsets = np.searchsorted(arrivals[arrival_order],
+                                      np.arange(env.simulation_length + 2))
+
+    return arrival_order, arrival_offsets
 
 
 def load_electricity_prices(env) -> Tuple[np.ndarray, np.ndarray]:
@@ -378,49 +289,30 @@ def load_electricity_prices(env) -> Tuple[np.ndarray, np.ndarray]:
     # else load historical prices
     file_path = pkg_resources.resource_filename(
         'ev2gym', 'data/Netherlands_day-ahead-2015-2023.csv')
-    data = pd.read_csv(file_path, sep=',', header=0)
-    drop_columns = ['Country', 'Datetime (Local)']
-    data.drop(drop_columns, inplace=True, axis=1)
-    data['year'] = pd.DatetimeIndex(data['Datetime (UTC)']).year
-    data['month'] = pd.DatetimeIndex(data['Datetime (UTC)']).month
-    data['day'] = pd.DatetimeIndex(data['Datetime (UTC)']).day
-    data['hour'] = pd.DatetimeIndex(data['Datetime (UTC)']).hour
+    store = load_price_store(file_path)
+
+    # for every simulation step, take the price of the corresponding UTC hour
+    prices = store.window(env.sim_starting_date, env.simulation_length, env.timescale)
+
+    missing = np.flatnonzero(np.isnan(prices))
+    if len(missing) > 0:
+        print(
+            'Error: no price found for the given date and hour. Using 2022 prices instead.')
+
+        dates = [env.sim_starting_date + datetime.timedelta(minutes=env.timescale * i)
+                 for i in missing.tolist()]
+        prices[missing] = store.lookup([datetime.datetime(2022,
+                                                          date.month,
+                                                          date.day - 1 if date.day > 28 else date.day,
+                                                          date.hour)
+                                        for date in dates])
+        if np.isnan(prices[missing]).any():
+            raise IndexError('No price found for the 2022 fallback dates')
 
     # assume charge and discharge prices are the same
     # assume prices are the same for all charging stations
-
-    charge_prices = np.zeros((env.cs, env.simulation_length))
-    discharge_prices = np.zeros((env.cs, env.simulation_length))
-    # for every simulation step, take the price of the corresponding hour
-    sim_temp_date = env.sim_starting_date
-    for i in range(env.simulation_length):
-
-        year = sim_temp_date.year
-        month = sim_temp_date.month
-        day = sim_temp_date.day
-        hour = sim_temp_date.hour
-        # find the corresponding price
-        try:
-            charge_prices[:, i] = -data.loc[(data['year'] == year) & (data['month'] == month) & (data['day'] == day) & (data['hour'] == hour),
-                                            'Price (EUR/MWhe)'].iloc[0]/1000  # €/kWh
-            discharge_prices[:, i] = data.loc[(data['year'] == year) & (data['month'] == month) & (data['day'] == day) & (data['hour'] == hour),
-                                              'Price (EUR/MWhe)'].iloc[0]/1000  # €/kWh
-        except:
-            print(
-                'Error: no price found for the given date and hour. Using 2022 prices instead.')
-
-            year = 2022
-            if day > 28:
-                day -= 1
-            print("Debug:", year, month, day, hour)
-            charge_prices[:, i] = -data.loc[(data['year'] == year) & (data['month'] == month) & (data['day'] == day) & (data['hour'] == hour),
-                                            'Price (EUR/MWhe)'].iloc[0]/1000  # €/kWh
-            discharge_prices[:, i] = data.loc[(data['year'] == year) & (data['month'] == month) & (data['day'] == day) & (data['hour'] == hour),
-                                              'Price (EUR/MWhe)'].iloc[0]/1000  # €/kWh
-
-        # step to next
-        sim_temp_date = sim_temp_date + \
-            datetime.timedelta(minutes=env.timescale)
+    charge_prices = np.tile(-prices / 1000, (env.cs, 1))  # €/kWh
+    discharge_prices = np.tile(prices / 1000, (env.cs, 1))  # €/kWh
 
     discharge_prices = discharge_prices * env.config['discharge_price_factor']
     return charge_prices, discharge_prices
@@ -0,0 +1,109 @@
+'''
+This file contains the hourly electricity price store used by load_electricity_prices.
+
+The day-ahead price csv is converted once to a binary array of hourly prices, indexed by the
+hour offset from the first UTC hour of the csv, which is memory mapped by every environment.
+The converted files are kept in EV2GYM_CACHE_DIR (default ~/.cache/ev2gym) and rebuilt when the csv changes.
+'''
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+PRICE_STORE_DIR = os.environ.get('EV2GYM_CACHE_DIR',
+                                 os.path.join(os.path.expanduser('~'), '.cache', 'ev2gym'))
+
+# price stores already opened by this process
+_price_stores = {}
+
+
+class HourlyPriceStore():
+    '''
+    Hourly prices (EUR/MWh) of a price csv, prices[i] is the price of the hour start + i
+    and missing hours are NaN
+    '''
+
+    def __init__(self, prices, start):
+        self.prices = prices
+        self.start = np.datetime64(start, 'h')
+
+    def lookup(self, dates) -> np.ndarray:
+        '''Returns the prices of the hours of the dates, NaN for the hours that are not in the store'''
+        index = (np.asarray(dates, dtype='datetime64[h]') - self.start).astype(int)
+        valid = (index >= 0) & (index < len(self.prices))
+
+        prices = np.full(len(index), np.nan)
+        prices[valid] = self.prices[index[valid]]
+        return prices
+
+    def window(self, start_date, simulation_length, timescale) -> np.ndarray:
+        '''Returns the price of the hour of every step of a simulation'''
+        step = np.timedelta64(int(round(timescale * 60)), 's')
+        dates = np.datetime64(start_date, 's') + np.arange(simulation_length) * step
+        return self.lookup(dates)
+
+
+def build_price_store(csv_path) -> HourlyPriceStore:
+    '''Parses a day-ahead price csv into an HourlyPriceStore'''
+    data = pd.read_csv(csv_path, sep=',', header=0,
+                       usecols=['Datetime (UTC)', 'Price (EUR/MWhe)'])
+    hours = pd.to_datetime(data['Datetime (UTC)']).values.astype('datetime64[h]')
+
+    start = hours.min()
+    index = (hours - start).astype(int)
+
+    # the first price of every hour is used
+    index, first = np.unique(index, return_index=True)
+    prices = np.full(index[-1] + 1, np.nan)
+    prices[index] = data['Price (EUR/MWhe)'].values[first]
+
+    return HourlyPriceStore(prices, start)
+
+
+def load_price_store(csv_path) -> HourlyPriceStore:
+    '''
+    Returns the price store of a csv, the csv is converted to a memory mapped .npy file
+    the first time it is used
+    '''
+    csv_path = os.path.abspath(csv_path)
+    if csv_path in _price_stores:
+        return _price_stores[csv_path]
+
+    source_mtime = os.path.getmtime(csv_path)
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    store_file = os.path.join(PRICE_STORE_DIR, f'{name}.npy')
+    info_file = os.path.join(PRICE_STORE_DIR, f'{name}.json')
+
+    store = None
+    try:
+        with open(info_file, 'r') as f:
+            info = json.load(f)
+        if info['source'] == csv_path and info['source_mtime'] == source_mtime:
+            store = HourlyPriceStore(np.load(store_file, mmap_mode='r'), info['start'])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if store is None:
+        store = build_price_store(csv_path)
+        try:
+            os.makedirs(PRICE_STORE_DIR, exist_ok=True)
+            # write to temporary files first, so other processes never read a partial store
+            tmp_suffix = f'.{os.getpid()}.tmp'
+            with open(store_file + tmp_suffix, 'wb') as f:
+                np.save(f, store.prices)
+            os.replace(store_file + tmp_suffix, store_file)
+            with open(info_file + tmp_suffix, 'w') as f:
+                json.dump({'source': csv_path,
+                           'source_mtime': source_mtime,
+                           'start': str(store.start)}, f)
+            os.replace(info_file + tmp_suffix, info_file)
+
+            store = HourlyPriceStore(np.load(store_file, mmap_mode='r'), store.start)
+        except OSError:
+            # the cache directory is not writable, keep the prices in memory
+            pass
+
+    _price_stores[csv_path] = store
+    return store
@@ -6,10 +6,19 @@ import math
 import datetime
 from typing import List, Dict
 
-from ev2gym.models.ev import EV
+from ev2gym.models.ev import EV, battery_degradation as ev_battery_degradation
 
 
 def get_statistics(env) -> Dict:
+    '''
+    Returns the statistics of the simulation, the power tracking statistics are read from
+    env.running_statistics and the statistics are computed once per step
+    '''
+    running_statistics = env.running_statistics
+    stats = running_statistics.get_cached()
+    if stats is not None:
+        return stats
+
     total_ev_served = np.array(
         [cs.total_evs_served for cs in env.charging_stations]).sum()
     total_profits = np.array(
@@ -21,37 +30,23 @@ def get_statistics(env) -> Dict:
     average_user_satisfaction = np.array(
         [cs.get_avg_user_satisfaction() for cs in env.charging_stations
          if cs.total_evs_served > 0]).mean()
-    # get transformer overload from env.tr_overload
-    total_transformer_overload = np.array(env.tr_overload).sum()
-
-    tracking_error = 0
-    energy_tracking_error = 0
-    power_tracker_violation = 0
-    for t in range(env.simulation_length):
-        # tracking_error += (min(env.power_setpoints[t], env.charge_power_potential[t]) -
-        #                    env.current_power_usage[t])**2
-        # energy_tracking_error += abs(min(env.power_setpoints[t], env.charge_power_potential[t]) -
-        #                              env.current_power_usage[t])
-
-        tracking_error += (env.power_setpoints[t] -
-                           env.current_power_usage[t])**2
-        energy_tracking_error += abs(env.power_setpoints[t] -
-                                     env.current_power_usage[t])
-
-        if env.current_power_usage[t] > env.power_setpoints[t]:
-            power_tracker_violation += env.current_power_usage[t] - \
-                env.power_setpoints[t]
+    # transformer overload accumulated every step, env.tr_overload may only hold the last steps
+    total_transformer_overload = env.total_transformer_overload
 
-    energy_tracking_error *= env.timescale / 60
+    # tracking_error: sum of (power_setpoints[t] - current_power_usage[t])**2
+    # energy_tracking_error: sum of abs(power_setpoints[t] - current_power_usage[t]) in kWh
+    # power_tracker_violation: sum of the power usage above the setpoints
+    tracking_error, energy_tracking_error, power_tracker_violation = \
+        running_statistics.tracking_statistics(env.power_setpoints, env.current_power_usage)
 
     # calculate total batery degradation
-    battery_degradation = np.array(
-        [np.array(ev.get_battery_degradation()) for ev in env.EVs])
-    if len(battery_degradation) == 0:
-        battery_degradation = np.zeros((1, 2))
-    battery_degradation_calendar = battery_degradation[:, 0].sum()
-    battery_degradation_cycling = battery_degradation[:, 1].sum()
-    battery_degradation = battery_degradation.sum()
+    d_cal, d_cyc = ev_battery_degradation(env.EVs)
+    for ev, calendar_loss, cyclic_loss in zip(env.EVs, d_cal, d_cyc):
+        ev.calendar_loss = calendar_loss
+        ev.cyclic_loss = cyclic_loss
+    battery_degradation_calendar = d_cal.sum()
+    battery_degradation_cycling = d_cyc.sum()
+    battery_degradation = battery_degradation_calendar + battery_degradation_cycling
 
     # find the final battery capacity of evs
     if env.eval_mode != "unstirred" and len(env.EVs) > 0 \
@@ -96,6 +91,7 @@ def get_statistics(env) -> Dict:
             stats['opt_energy_user_satisfaction'] = env.replay.optimal_stats["energy_user_satisfaction"]
             stats['opt_total_energy_charged'] = env.replay.optimal_stats["total_energy_charged"]
 
+    running_statistics.set_cached(stats)
     return stats
 
 
@@ -345,6 +341,267 @@ def EV_spawner(env) -> List[EV]:
     return ev_list
 
 
+def EV_spawner_vectorized(env) -> List[EV]:
+    '''
+    Vectorized version of EV_spawner, it follows the same arrival and occupancy rules but draws
+    the arrivals of all ports at once and samples the EVs arriving in the same round in bulk,
+    using the half hour lookup tables of env.spawn_tables. The random numbers are drawn in a
+    different order, so the same seed gives a different scenario than EV_spawner.
+
+    Returns:
+        EVs: list of EVs, sorted by arrival step and port
+    '''
+
+    tables = env.spawn_tables[env.scenario]
+    simulation_length = env.simulation_length
+
+    arrival_probabilities = np.random.rand(
+        env.number_of_ports, simulation_length)
+
+    # Define minimum time of stay duration so that an EV can fully charge
+    min_time_of_stay = env.config['ev']["min_time_of_stay"]
+    min_time_of_stay_steps = min_time_of_stay // env.timescale
+
+    steps, hour, minute, spawn_rate = _spawn_rates(env, tables, min_time_of_stay_steps)
+
+    arrivals = np.zeros((env.number_of_ports, simulation_length + 1), dtype=bool)
+    arrivals[:, steps] = arrival_probabilities[:, steps]*100 < spawn_rate[steps]
+
+    # First arrival step of every port at or after every step, simulation_length if none
+    next_arrival = np.where(arrivals, np.arange(simulation_length + 1), simulation_length)
+    next_arrival = np.minimum.accumulate(next_arrival[:, ::-1], axis=1)[:, ::-1]
+
+    port_cs, port_index = _port_locations(env)
+
+    # Every round spawns the next EV of every port that still has arrivals,
+    # a port is free again two steps after its EV departs
+    ev_list = []
+    ports = np.arange(env.number_of_ports)
+    free = np.full(env.number_of_ports, 2)
+    while len(ports) > 0:
+        t = next_arrival[ports, free]
+        arriving = t < simulation_length
+        ports, t = ports[arriving], t[arriving]
+        if len(ports) == 0:
+            break
+
+        evs, departure = _spawn_EVs(env, tables, port_cs[ports], port_index[ports], t,
+                                    hour[t], minute[t], min_time_of_stay_steps)
+        ev_list += [(step, port, ev)
+                    for step, port, ev in zip(t.tolist(), ports.tolist(), evs)
+                    if ev is not None]
+
+        free = np.minimum(np.where(departure >= 0, departure + 2, t + 1), simulation_length)
+
+    ev_list.sort(key=lambda x: (x[0], x[1]))
+    return [ev for _, _, ev in ev_list]
+
+
+def EV_spawner_sparse(env) -> List[EV]:
+    '''
+    Event-driven version of EV_spawner, the arrivals of every port are sampled as a renewal process.
+    The next arrival of a free port is drawn by thinning: candidate steps are drawn with geometric
+    gaps at the highest arrival probability of the simulation and accepted with the ratio of the
+    arrival probability of their step, after an arrival the port skips to two steps after the departure.
+    This gives the same arrival statistics as EV_spawner, while the cost and memory scale with the
+    number of sessions instead of ports x steps.
+
+    Returns:
+        EVs: list of EVs, sorted by arrival step and port
+    '''
+
+    tables = env.spawn_tables[env.scenario]
+
+    # Define minimum time of stay duration so that an EV can fully charge
+    min_time_of_stay = env.config['ev']["min_time_of_stay"]
+    min_time_of_stay_steps = min_time_of_stay // env.timescale
+
+    steps, hour, minute, spawn_rate = _spawn_rates(env, tables, min_time_of_stay_steps)
+
+    # probability of an arrival at a free port in every step
+    arrival_probability = np.minimum(spawn_rate / 100, 1)
+    max_probability = arrival_probability.max()
+    if max_probability <= 0:
+        return []
+    last_step = steps[-1] + 1 if len(steps) > 0 else 0
+
+    port_cs, port_index = _port_locations(env)
+
+    ev_list = []
+    ports = np.arange(env.number_of_ports)
+    candidate = np.full(env.number_of_ports, 2)
+    while len(ports) > 0:
+        candidate = candidate + np.random.geometric(max_probability, size=len(ports)) - 1
+        inside = candidate < last_step
+        ports, candidate = ports[inside], candidate[inside]
+
+        accepted = np.random.rand(len(ports)) * max_probability < \
+            arrival_probability[candidate]
+
+        t = candidate[accepted]
+        if len(t) > 0:
+            evs, departure = _spawn_EVs(env, tables, port_cs[ports[accepted]],
+                                        port_index[ports[accepted]], t,
+                                        hour[t], minute[t], min_time_of_stay_steps)
+            ev_list += [(step, port, ev)
+                        for step, port, ev in zip(t.tolist(), ports[accepted].tolist(), evs)
+                        if ev is not None]
+
+            # a port is free again two steps after its EV departs
+            candidate[accepted] = np.where(departure >= 0, departure + 2, t + 1)
+
+        candidate[~accepted] += 1
+
+    ev_list.sort(key=lambda x: (x[0], x[1]))
+    return [ev for _, _, ev in ev_list]
+
+
+def _spawn_rates(env, tables, min_time_of_stay_steps):
+    '''
+    Returns the steps in which EVs can arrive, the hour and minute of every step and the spawn rate
+    of every step, an EV arrives at a free port if 100 * U(0, 1) < spawn rate
+    '''
+    simulation_length = env.simulation_length
+    timescale = env.timescale
+
+    # Date of every step, the spawner clock starts at sim_date in step 2
+    steps = np.arange(2, simulation_length-min_time_of_stay_steps-1)
+    dates = np.datetime64(env.sim_date, 's') + \
+        (steps - 2) * np.timedelta64(int(round(timescale * 60)), 's')
+    days = dates.astype('datetime64[D]')
+    minutes = (dates - days).astype('timedelta64[m]').astype(int)
+    hour = np.zeros(simulation_length, dtype=int)
+    minute = np.zeros(simulation_length, dtype=int)
+    hour[steps], minute[steps] = minutes // 60, minutes % 60
+    # 1970-01-01 was a Thursday
+    weekday = (days.astype(int) + 3) % 7
+
+    # Divide by 15 because the spawn rate is in 15 minute intervals (in the csv file)
+    i = hour[steps]*4 + minute[steps]//15
+    weekend = weekday >= 5
+    tau = np.where(weekend,
+                   tables['tau_weekend'][i],
+                   tables['tau_week'][i])
+    if env.scenario == "workplace":
+        tau[weekend | (hour[steps] < 6) | (hour[steps] > 18)] = 0
+    multiplier = 1
+
+    spawn_rate = np.zeros(simulation_length)
+    spawn_rate[steps] = tau * multiplier * (timescale/60) * env.config["spawn_multiplier"]
+
+    return steps, hour, minute, spawn_rate
+
+
+def _port_locations(env):
+    '''Returns the charging station and the port index of every port of the simulation'''
+    port_cs = np.concatenate([[cs.id] * cs.n_ports for cs in env.charging_stations])
+    port_index = np.concatenate([np.arange(cs.n_ports) for cs in env.charging_stations])
+    return port_cs, port_index
+
+
+def _spawn_EVs(env, tables, cs_ids, ports, steps, hour, minute, min_time_of_stay_steps):
+    '''
+    Vectorized version of spawn_single_EV for EVs arriving at the given steps
+
+    Returns:
+        - evs: list with an EV or None for every arrival
+        - departure: the departure step of every EV, -1 for the arrivals that did not spawn
+    '''
+    n = len(steps)
+    ev_config = env.config["ev"]
+
+    # required energy and time of stay dependent on the half hour of arrival
+    half_hour = hour*2 + minute//30
+    required_energy_mean = tables['required_energy_mean'][half_hour]
+    time_of_stay_mean = tables['time_of_stay_mean'][half_hour]
+    if np.isnan(required_energy_mean).any() or np.isnan(time_of_stay_mean).any():
+        raise ValueError(f'Missing arrival time in the spawn tables of scenario {env.scenario}')
+
+    required_energy = np.random.normal(
+        required_energy_mean, 0.5*required_energy_mean)  # kWh
+    low = required_energy < 5
+    required_energy[low] = np.random.randint(5, 10, size=low.sum())
+
+    if env.heterogeneous_specs:
+        ev_names = list(env.ev_specs.keys())
+        sampled_ev = np.random.choice(
+            len(ev_names), size=n, p=env.normalized_ev_registrations)
+        battery_capacity = np.array([env.ev_specs[name]["battery_capacity"]
+                                     for name in ev_names])[sampled_ev]
+    else:
+        battery_capacity = np.full(n, ev_config["battery_capacity"])
+
+    initial_battery_capacity = battery_capacity - required_energy
+    full = battery_capacity < required_energy
+    if full.any():
+        initial_battery_capacity[full] = np.random.randint(1, battery_capacity[full])
+
+    high = initial_battery_capacity > ev_config['desired_capacity']
+    if high.any():
+        initial_battery_capacity[high] = np.random.randint(1, battery_capacity[high])
+
+    initial_battery_capacity = np.maximum(initial_battery_capacity,
+                                          ev_config['min_battery_capacity'])
+
+    time_of_stay = np.random.normal(
+        time_of_stay_mean, 0.2*time_of_stay_mean)  # hours
+
+    # turn from hours to steps
+    time_of_stay = time_of_stay * 60 / env.timescale + 1
+    time_of_stay = np.maximum(time_of_stay, min_time_of_stay_steps)
+
+    spawned = np.ones(n, dtype=bool)
+    if env.empty_ports_at_end_of_simulation:
+        spawned = time_of_stay + steps + 4 < env.simulation_length
+
+    departure = np.where(spawned, (time_of_stay + steps + 3).astype(int), -1)
+
+    if env.heterogeneous_specs:
+        discharge_efficiency = np.round(1 - (np.random.rand(n)+0.00001)/20, 3)  # [0.95-1]
+        transition_soc = np.round(0.9 - (np.random.rand(n)+0.00001)/5, 3)  # [0.7-0.9]
+
+    evs = [None] * n
+    for k in np.flatnonzero(spawned).tolist():
+        if env.heterogeneous_specs:
+            specs = env.ev_specs[ev_names[sampled_ev[k]]]
+            evs[k] = EV(id=int(ports[k]),
+                        location=int(cs_ids[k]),
+                        battery_capacity_at_arrival=float(initial_battery_capacity[k]),
+                        max_ac_charge_power=specs["max_ac_charge_power"],
+                        max_dc_charge_power=specs["max_dc_charge_power"],
+                        max_discharge_power=-specs["max_dc_discharge_power"],
+                        discharge_efficiency=float(discharge_efficiency[k]),
+                        transition_soc=float(transition_soc[k]),
+                        battery_capacity=specs["battery_capacity"],
+                        desired_capacity=0.8*specs["battery_capacity"],
+                        time_of_arrival=int(steps[k])+1,
+                        time_of_departure=int(departure[k]),
+                        ev_phases=3,
+                        timescale=env.timescale,
+                        )
+        else:
+            evs[k] = EV(id=int(ports[k]),
+                        location=int(cs_ids[k]),
+                        battery_capacity_at_arrival=float(initial_battery_capacity[k]),
+                        battery_capacity=ev_config["battery_capacity"],
+                        desired_capacity=ev_config['desired_capacity'],
+                        max_ac_charge_power=ev_config['max_ac_charge_power'],
+                        min_ac_charge_power=ev_config['min_ac_charge_power'],
+                        max_dc_charge_power=ev_config['max_dc_charge_power'],
+                        max_discharge_power=ev_config['max_discharge_power'],
+                        min_discharge_power=ev_config['min_discharge_power'],
+                        time_of_arrival=int(steps[k])+1,
+                        time_of_departure=int(departure[k]),
+                        ev_phases=ev_config['ev_phases'],
+                        transition_soc=ev_config['transition_soc'],
+                        charge_efficiency=ev_config['charge_efficiency'],
+                        discharge_efficiency=ev_config['discharge_efficiency'],
+                        timescale=env.timescale,
+                        )
+
+    return evs, departure
+
+
 def smooth_vector(v) -> np.ndarray:
     n = len(v)
     smoothed_v = [0] * n
@@ -371,10 +628,24 @@ def smooth_vector(v) -> np.ndarray:
 
 
 def median_smoothing(v, window_size) -> np.ndarray:
+    '''
+    Median filter of v, the window is truncated at the edges of the vector.
+    The median of the full windows is computed at once with a sliding window view of v.
+    '''
+    v = np.asarray(v)
     smoothed_v = np.zeros_like(v)
     half_window = window_size // 2
+    full_window = 2 * half_window + 1
+
+    if len(v) >= full_window:
+        smoothed_v[half_window:len(v) - half_window] = np.median(
+            np.lib.stride_tricks.sliding_window_view(v, full_window), axis=1)
+        edges = list(range(half_window)) + \
+            list(range(len(v) - half_window, len(v)))
+    else:
+        edges = range(len(v))
 
-    for i in range(len(v)):
+    for i in edges:
         start = max(0, i - half_window)
         end = min(len(v), i + half_window + 1)
         smoothed_v[i] = np.median(v[start:end])
@@ -382,12 +653,58 @@ def median_smoothing(v, window_size) -> np.ndarray:
     return smoothed_v
 
 
+def _redistribute_load(shifted_load, lengths, min_power_limit, max_power_limit) -> None:
+    '''
+    Pushes the shifted loads (one row per EV, padded with zeros after the length of the stay)
+    inside the power limits of every EV, in place.
+
+    Every pass scans the stay of the EVs still out of limits: the load lower than the minimum
+    power is moved to the next step and the load higher than the maximum power is cut and
+    its excess moved to the next step, the last step moves its load to the first one.
+    At most 11 passes are made.
+    '''
+    rows = np.arange(len(shifted_load))
+
+    for _ in range(11):
+        load = shifted_load[rows]
+        min_load = np.where(load != 0, load, np.inf).min(axis=1)
+        out_of_limits = (min_load < min_power_limit[rows]) | \
+            (load.max(axis=1) > max_power_limit[rows])
+        rows = rows[out_of_limits]
+        if len(rows) == 0:
+            break
+
+        min_limit = min_power_limit[rows]
+        max_limit = max_power_limit[rows]
+        last = lengths[rows] - 1
+
+        for i in range(lengths[rows].max()):
+            value = shifted_load[rows, i]
+
+            lower = (value < min_limit) & (value > 0)
+            higher = ~lower & (value > max_limit)
+            load_to_shift = np.where(lower, value, value - max_limit)
+            load_to_shift[~(lower | higher)] = 0
+
+            shifted_load[rows, i] = np.where(lower, 0,
+                                             np.where(higher, max_limit, value))
+
+            # the load of the last step of a stay is moved to the first step
+            wrap = last == i
+            if wrap.any():
+                shifted_load[rows[wrap], 0] += load_to_shift[wrap]
+            inside = last > i
+            if inside.any():
+                shifted_load[rows[inside], i + 1] += load_to_shift[inside]
+
+
 def generate_power_setpoints(env) -> np.ndarray:
     '''
     This function generates the power setpoints for the entire simulation using
     the list of EVs and the charging stations from the environment.
 
     It considers the ev SoC and teh steps required to fully charge the EVs.
+    The loads of all the EVs are generated and pushed inside the power limits at once.
 
     Returns:
         power_setpoints: np.ndarray
@@ -405,61 +722,57 @@ def generate_power_setpoints(env) -> np.ndarray:
     min_cs_power = env.charging_stations[0].get_min_charge_power()
     max_cs_power = env.charging_stations[0].get_max_power()
 
-    total_evs_spawned = 0
-    for t in range(env.simulation_length):
-        counter = total_evs_spawned
-        for _, ev in enumerate(env.EVs_profiles[counter:]):
-            if ev.time_of_arrival == t + 1:
-                total_evs_spawned += 1
-
-                required_energy = ev.battery_capacity - ev.battery_capacity_at_arrival
-                required_energy *= required_energy_multiplier / 100
-                min_power_limit = max(ev.min_ac_charge_power, min_cs_power)
-                max_power_limit = min(ev.max_ac_charge_power, max_cs_power)
-
-                # Spread randomly the required energy over the time of stay using the prices as weights
-                shifted_load = np.random.normal(loc=1 - prices[t+2:ev.time_of_departure],
-                                                scale=min(
-                                                    prices[t+2:ev.time_of_departure]),
-                                                size=ev.time_of_departure - t - 2)
-                # make shifted load positive
-                shifted_load = np.abs(shifted_load)
-                shifted_load = shifted_load / np.sum(shifted_load)
-                shifted_load = shifted_load * required_energy * 60 / env.timescale
-
-                # find power lower than min_power_limit and higher than max_power_limit
-                step = 0
-                while np.min(shifted_load[shifted_load != 0]) < min_power_limit or \
-                        np.max(shifted_load) > max_power_limit:
-
-                    if step > 10:
-                        break
-
-                    # print(f"Shifted load: {shifted_load}")
-                    for i in range(len(shifted_load)):
-                        if shifted_load[i] < min_power_limit and shifted_load[i] > 0:
-                            load_to_shift = shifted_load[i]
-                            shifted_load[i] = 0
-
-                            if i == len(shifted_load) - 1:
-                                shifted_load[0] += load_to_shift
-                            else:
-                                shifted_load[i+1] += load_to_shift
-
-                        elif shifted_load[i] > max_power_limit:
-                            load_to_shift = shifted_load[i] - max_power_limit
-                            shifted_load[i] = max_power_limit
-
-                            if i == len(shifted_load) - 1:
-                                shifted_load[0] += load_to_shift
-                            else:
-                                shifted_load[i+1] += load_to_shift
-                    step += 1
-
-                power_setpoints[t+2:ev.time_of_departure] += shifted_load
-
-            elif ev.time_of_arrival > t + 1:
-                break
+    # the EVs arriving at steps 1 to simulation_length, in the order of arrival
+    evs = env.get_arriving_evs(1)
+    for t in range(2, env.simulation_length + 1):
+        evs += env.get_arriving_evs(t)
+
+    if len(evs) == 0:
+        return median_smoothing(power_setpoints, 5)
+
+    # the load of an EV is spread from the step after its arrival to its departure
+    starts = np.array([ev.time_of_arrival + 1 for ev in evs], dtype=int)
+    ends = np.array([ev.time_of_departure for ev in evs], dtype=int)
+    lengths = ends - starts
+
+    required_energy = np.array([ev.battery_capacity - ev.battery_capacity_at_arrival
+                                for ev in evs])
+    required_energy *= required_energy_multiplier / 100
+    min_power_limit = np.maximum([ev.min_ac_charge_power for ev in evs], min_cs_power)
+    max_power_limit = np.minimum([ev.max_ac_charge_power for ev in evs], max_cs_power)
+
+    # Spread randomly the required energy over the time of stay using the prices as weights,
+    # the samples of all the EVs are drawn with a single call in the order of arrival
+    steps = np.concatenate([np.arange(start, end)
+                           for start, end in zip(starts, ends)])
+    owner = np.repeat(np.arange(len(evs)), lengths)
+    scale = np.array([min(prices[start:end])
+                     for start, end in zip(starts, ends)])
+    samples = np.random.normal(loc=1 - prices[steps],
+                               scale=scale[owner],
+                               size=len(steps))
+
+    # make shifted load positive
+    samples = np.abs(samples)
+
+    # the sums are taken over the stay of every EV, as padding would change their rounding
+    offsets = np.cumsum(lengths) - lengths
+    total = np.array([np.sum(samples[offset:offset + length])
+                      for offset, length in zip(offsets, lengths)])
+    samples = samples / total[owner]
+    samples = samples * required_energy[owner] * 60 / env.timescale
+
+    # one row per EV, padded with zeros
+    position = np.arange(len(steps)) - offsets[owner]
+    shifted_load = np.zeros((len(evs), lengths.max()))
+    shifted_load[owner, position] = samples
+
+    # find power lower than min_power_limit and higher than max_power_limit
+    _redistribute_load(shifted_load, lengths,
+                       min_power_limit, max_power_limit)
+
+    # the loads are added in the order of arrival
+    np.add.at(power_setpoints, steps, shifted_load[owner, position])
 
     # return smooth_vector(power_setpoints)
 
@@ -335,14 +335,14 @@ def plot_comparable_EV_SoC(results_path, save_path=None, algorithm_names=None):
             df = pd.DataFrame([], index=date_range)
 
             for port in range(cs.n_ports):
-                df[port] = env.port_energy_level[port, cs.id, :]
+                df[port] = env.port_telemetry.get('energy_level', cs.id, port)
 
             # Add another row with one datetime step to make the plot look better
             df.loc[df.index[-1] +
                    datetime.timedelta(minutes=env.timescale)] = df.iloc[-1]
 
             for port in range(cs.n_ports):
-                for i, (t_arr, t_dep) in enumerate(env.port_arrival[f'{cs.id}.{port}']):
+                for i, (t_arr, t_dep) in enumerate(env.port_telemetry.get_arrivals(cs.id, port)):
                     t_dep = t_dep + 1
                     if t_dep > len(df):
                         t_dep = len(df)
@@ -423,14 +423,14 @@ def plot_comparable_EV_SoC_single(results_path, save_path=None, algorithm_names=
             df = pd.DataFrame([], index=date_range)
 
             for port in range(cs.n_ports):
-                df[port] = env.port_energy_level[port, cs.id, :]
+                df[port] = env.port_telemetry.get('energy_level', cs.id, port)
 
             # Add another row with one datetime step to make the plot look better
             df.loc[df.index[-1] +
                    datetime.timedelta(minutes=env.timescale)] = df.iloc[-1]
 
             for port in range(cs.n_ports):
-                for i, (t_arr, t_dep) in enumerate(env.port_arrival[f'{cs.id}.{port}']):
+                for i, (t_arr, t_dep) in enumerate(env.port_telemetry.get_arrivals(cs.id, port)):
                     t_dep = t_dep + 1
                     if t_dep > len(df):
                         t_dep = len(df)
@@ -524,7 +524,7 @@ def plot_comparable_CS_Power(results_path, save_path=None, algorithm_names=None)
             df = pd.DataFrame([], index=date_range)
 
             for port in range(cs.n_ports):
-                df[port] = env.port_current[port, cs.id, :]
+                df[port] = env.port_telemetry.get('current', cs.id, port)
             
             #multiply df[port] by the voltage to get the power
             df = df * cs.voltage * math.sqrt(cs.phases) / 1000
@@ -534,7 +534,7 @@ def plot_comparable_CS_Power(results_path, save_path=None, algorithm_names=None)
                    datetime.timedelta(minutes=env.timescale)] = df.iloc[-1]
 
             for port in range(cs.n_ports):
-                for i, (t_arr, t_dep) in enumerate(env.port_arrival[f'{cs.id}.{port}']):
+                for i, (t_arr, t_dep) in enumerate(env.port_telemetry.get_arrivals(cs.id, port)):
                     t_dep = t_dep + 1
                     if t_dep > len(df):
                         t_dep = len(df)
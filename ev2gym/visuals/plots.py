@@ -81,14 +81,14 @@ def ev_city_plot(env):
             df = pd.DataFrame([], index=date_range)
 
             for port in range(cs.n_ports):
-                df[port] = env.port_energy_level[port, cs.id, :]
+                df[port] = env.port_telemetry.get('energy_level', cs.id, port)
 
             # Add another row with one datetime step to make the plot look better
             df.loc[df.index[-1] +
                    datetime.timedelta(minutes=env.timescale)] = df.iloc[-1]
 
             for port in range(cs.n_ports):
-                for i, (t_arr, t_dep) in enumerate(env.port_arrival[f'{cs.id}.{port}']):
+                for i, (t_arr, t_dep) in enumerate(env.port_telemetry.get_arrivals(cs.id, port)):
                     t_dep = t_dep + 1
                     if t_dep > len(df):
                         t_dep = len(df)
@@ -112,7 +112,7 @@ def ev_city_plot(env):
             plt.xticks(ticks=date_range_print,
                        labels=[f'{d.hour:2d}:{d.minute:02d}' for d in date_range_print], rotation=45,
                        fontsize=22)
-            # if len(env.port_arrival[f'{cs.id}.{port}']) < 6:
+            # if len(env.port_telemetry.get_arrivals(cs.id, port)) < 6:
             if dim_x < 3:
                 plt.legend()
             plt.grid(True, which='minor', axis='both')
@@ -254,8 +254,8 @@ def ev_city_plot(env):
             df_signal = pd.DataFrame([], index=date_range)
 
             for port in range(cs.n_ports):
-                df[port] = env.port_current[port, cs.id, :]
-                df_signal[port] = env.port_current_signal[port, cs.id, :]
+                df[port] = env.port_telemetry.get('current', cs.id, port)
+                df_signal[port] = env.port_telemetry.get('current_signal', cs.id, port)
                 # create 2 dfs, one for positive power and one for negative
             df_pos = df.copy()
             df_pos[df_pos < 0] = 0
@@ -3,7 +3,6 @@
 import yaml
 import os
 import pickle
-from copy import deepcopy
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -252,7 +251,7 @@ def evaluator():
                     action, _ = model.predict(state, deterministic=True)
                     obs, reward, done, stats = env.step(action)
                     if i == simulation_length - 2:
-                        saved_env = deepcopy(env.get_attr('env')[0])
+                        saved_env = env.get_attr('env')[0].unwrapped.fork()
 
                     stats = stats[0]
                 else:
@@ -294,7 +293,7 @@ def evaluator():
                     if algorithm in [PPO, A2C, DDPG, SAC, TD3, TQC, TRPO, ARS, RecurrentPPO]:
                         env = saved_env
 
-                    plot_results_dict[algorithm.__name__] = deepcopy(env)
+                    plot_results_dict[algorithm.__name__] = env.fork()
 
                     break
 
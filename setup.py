@@ -33,7 +33,11 @@ setup(
         'pandas',
         'networkx',
         'gurobipy',
-    ]
+    ],
+    extras_require={
+        # fused step kernel of engine="compiled"
+        'compiled': ['numba'],
+    }
 )
 
 """